@@ -0,0 +1,72 @@
+"""
+Measure the time taken to store validation results, either one at a time
+(POST /results/) or as a batch (POST /results/bulk).
+
+Usage:
+
+    $ export VF_TEST_TOKEN=<oidc-access-token>
+    $ python benchmark_result_writes.py model_instance_id test_instance_id [base_url] [n_results]
+
+The service should be running at base_url (default http://127.0.0.1:8000).
+The results created are deleted at the end, which requires admin rights.
+"""
+
+import os
+import sys
+import statistics
+from datetime import datetime, timezone
+from time import perf_counter
+
+import requests
+
+
+def build_result(model_instance_id, test_instance_id, i):
+    now = datetime.now(timezone.utc)
+    return {
+        "model_instance_id": model_instance_id,
+        "test_instance_id": test_instance_id,
+        "results_storage": [
+            {"download_url": f"http://example.com/benchmark_result_{now.strftime('%Y%m%d-%H%M%S')}_{i}"}
+        ],
+        "score": 0.5,
+        "passed": True,
+        "project_id": "model-validation",
+        "normalized_score": 0.5,
+    }
+
+
+def main(model_instance_id, test_instance_id, base_url, n_results):
+    headers = {"Authorization": f"Bearer {os.environ['VF_TEST_TOKEN']}"}
+    created = []
+
+    timings = []
+    for i in range(n_results):
+        payload = build_result(model_instance_id, test_instance_id, i)
+        start = perf_counter()
+        response = requests.post(f"{base_url}/results/", json=payload, headers=headers)
+        timings.append(perf_counter() - start)
+        response.raise_for_status()
+        created.append(response.json()["id"])
+    print(f"{'POST /results/':20} {n_results:5d} results, "
+          f"median {statistics.median(timings):.3f} s, max {max(timings):.3f} s per result")
+
+    payload = [build_result(model_instance_id, test_instance_id, i) for i in range(n_results)]
+    start = perf_counter()
+    response = requests.post(f"{base_url}/results/bulk", json=payload, headers=headers)
+    elapsed = perf_counter() - start
+    response.raise_for_status()
+    statuses = response.json()
+    created.extend(item["result"]["id"] for item in statuses if item["result"])
+    n_failed = sum(item["status_code"] != 201 for item in statuses)
+    print(f"{'POST /results/bulk':20} {n_results:5d} results, "
+          f"{elapsed:.3f} s in total, {elapsed / n_results:.3f} s per result, {n_failed} failed")
+
+    for result_id in created:
+        requests.delete(f"{base_url}/results/{result_id}", headers=headers)
+
+
+if __name__ == "__main__":
+    model_instance_id, test_instance_id = sys.argv[1:3]
+    base_url = sys.argv[3] if len(sys.argv) > 3 else "http://127.0.0.1:8000"
+    n_results = int(sys.argv[4]) if len(sys.argv) > 4 else 10
+    main(model_instance_id, test_instance_id, base_url.rstrip("/"), n_results)
@@ -0,0 +1,58 @@
+"""
+Compare the response times of the two backends for searching validation results
+(the KG Query API and the Nexus API).
+
+Usage:
+
+    $ export VF_TEST_TOKEN=<oidc-access-token>
+    $ python benchmark_results_backends.py [base_url] [repeats]
+
+The service should be running at base_url (default http://127.0.0.1:8000).
+"""
+
+import os
+import sys
+import statistics
+from time import perf_counter
+
+import requests
+
+
+SEARCHES = {
+    "no filters": {"size": 100},
+    "by model alias": {"model_alias": "bianchi_2012", "size": 100},
+    "by model id": {"model_id": "528ec0e6-2f21-413c-9abd-d131f7150882", "size": 100},
+    "by test alias": {"test_alias": "hippo_somafeat_CA1_pyr_cACpyr", "size": 100},
+    "second page": {"model_alias": "bianchi_2012", "size": 20, "from_index": 20},
+}
+
+
+def time_search(base_url, params, backend, headers):
+    start = perf_counter()
+    response = requests.get(
+        f"{base_url}/results/", params=dict(params, backend=backend), headers=headers
+    )
+    elapsed = perf_counter() - start
+    response.raise_for_status()
+    return elapsed, len(response.json()), response.headers.get("X-Results-Backend")
+
+
+def main(base_url, repeats):
+    headers = {"Authorization": f"Bearer {os.environ['VF_TEST_TOKEN']}"}
+    print(f"{'search':20} {'backend':10} {'used':10} {'n':>5} {'median (s)':>11} {'max (s)':>9}")
+    for label, params in SEARCHES.items():
+        for backend in ("nexus", "kg_query"):
+            timings = []
+            for i in range(repeats):
+                elapsed, n_results, backend_used = time_search(base_url, params, backend, headers)
+                timings.append(elapsed)
+            print(
+                f"{label:20} {backend:10} {backend_used or '?':10} {n_results:5d} "
+                f"{statistics.median(timings):11.3f} {max(timings):9.3f}"
+            )
+
+
+if __name__ == "__main__":
+    base_url = sys.argv[1] if len(sys.argv) > 1 else "http://127.0.0.1:8000"
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    main(base_url.rstrip("/"), repeats)
@@ -0,0 +1,233 @@
+"""
+In-memory index from the aliases of models and tests to their UUIDs.
+
+Looking up a model or test by alias, or checking that an alias is not already in use,
+otherwise needs a KG query each time. The index is refreshed from the KG in full every
+`ALIAS_INDEX_REFRESH_INTERVAL`, and in between, every `ALIAS_INDEX_SYNC_INTERVAL`,
+with the models and tests modified since the previous refresh.
+Changes made through this service are applied immediately.
+
+The index is only used while it is up to date (`ALIAS_INDEX_MAX_STALENESS`), otherwise
+the KG is queried. Aliases registered by other processes since the last refresh are not
+seen, so a duplicate alias may occasionally sneak through; each full refresh reports any
+aliases shared by several models or tests.
+"""
+
+import asyncio
+import logging
+import threading
+from collections import defaultdict
+from time import time
+
+from fairgraph.base import as_list
+from fairgraph.brainsimulation import ModelProject, ValidationTestDefinition
+
+from . import settings, metrics
+from .auth import get_kg_client
+from .kg_executor import kg_call
+from .kg_resolver import get_by_uuid
+from .queries import (
+    query_kg_objects,
+    build_modified_since_filter,
+    model_alias_exists as _model_alias_exists_in_kg,
+    test_alias_exists as _test_alias_exists_in_kg,
+)
+
+
+logger = logging.getLogger("validation_service_v2")
+
+BATCH_SIZE = 1000
+
+kg_client = get_kg_client()
+
+
+class AliasIndex:
+    """Thread-safe mapping between aliases and the UUIDs of the objects which have them"""
+
+    def __init__(self, name, cls):
+        self.name = name
+        self.cls = cls
+        self._lock = threading.Lock()
+        self._ids = defaultdict(set)  # alias -> UUIDs
+        self._aliases = {}  # UUID -> alias
+        self._changes = {}  # UUID -> alias (None if removed), recorded until the next full refresh
+        self.refreshed_at = None  # KG state reflected by the index (start of the last refresh)
+        self.full_refreshed_at = None
+
+    def _set(self, uuid, alias):
+        previous = self._aliases.pop(uuid, None)
+        if previous is not None:
+            self._ids[previous].discard(uuid)
+            if not self._ids[previous]:
+                del self._ids[previous]
+        if alias:
+            self._aliases[uuid] = alias
+            self._ids[alias].add(uuid)
+
+    def set(self, uuid, alias):
+        """Record the alias of an object (None if it has no alias, or has been deleted)"""
+        uuid = str(uuid)
+        with self._lock:
+            self._set(uuid, alias)
+            if self._changes is not None:
+                self._changes[uuid] = alias
+
+    def remove(self, uuid):
+        self.set(uuid, None)
+
+    def start_full_refresh(self):
+        """Start recording changes, which will be applied again after `replace_all()`"""
+        with self._lock:
+            self._changes = {}
+
+    def replace_all(self, aliases, refreshed_at):
+        """
+        Replace the contents of the index with a dict of UUID -> alias reflecting the state
+        of the KG at `refreshed_at`, keeping any changes made since `start_full_refresh()`
+        """
+        with self._lock:
+            self._ids.clear()
+            self._aliases.clear()
+            for uuid, alias in aliases.items():
+                self._set(uuid, alias)
+            for uuid, alias in (self._changes or {}).items():
+                self._set(uuid, alias)
+            self._changes = None
+            self.refreshed_at = self.full_refreshed_at = refreshed_at
+
+    def update(self, aliases, refreshed_at):
+        """Apply a dict of UUID -> alias for the objects modified since the previous refresh"""
+        with self._lock:
+            for uuid, alias in aliases.items():
+                self._set(uuid, alias)
+            self.refreshed_at = refreshed_at
+
+    def is_fresh(self):
+        return (
+            self.full_refreshed_at is not None
+            and time() - self.refreshed_at <= settings.ALIAS_INDEX_MAX_STALENESS
+        )
+
+    def lookup(self, alias):
+        """Return the UUIDs of the objects with this alias, or None if the index is out of date"""
+        if not self.is_fresh():
+            metrics.increment(f"aliases.{self.name}.stale_lookups")
+            return None
+        with self._lock:
+            return set(self._ids.get(alias, ()))
+
+    def duplicates(self):
+        """Return a dict of the aliases shared by several objects, with their UUIDs"""
+        with self._lock:
+            return {alias: sorted(ids) for alias, ids in self._ids.items() if len(ids) > 1}
+
+    def __len__(self):
+        return len(self._aliases)
+
+
+model_aliases = AliasIndex("models", ModelProject)
+test_aliases = AliasIndex("tests", ValidationTestDefinition)
+_refresh_task = None
+metrics.register_gauge("aliases.models", lambda: len(model_aliases))
+metrics.register_gauge("aliases.tests", lambda: len(test_aliases))
+metrics.register_gauge("aliases.models.duplicates", lambda: len(model_aliases.duplicates()))
+metrics.register_gauge("aliases.tests.duplicates", lambda: len(test_aliases.duplicates()))
+
+
+def _get_aliases(cls, since):
+    """Return a dict of UUID -> alias for the objects of type `cls` modified since `since` (or all of them)"""
+    filter_query, context = build_modified_since_filter(since)
+    aliases = {}
+    from_index = 0
+    while True:
+        batch = query_kg_objects(
+            cls, filter_query, context, kg_client, size=BATCH_SIZE, from_index=from_index
+        )
+        aliases.update((obj.uuid, obj.alias) for obj in batch)
+        if len(batch) < BATCH_SIZE:
+            return aliases
+        from_index += len(batch)
+
+
+async def refresh(index, full=False):
+    started_at = time()
+    if full or index.full_refreshed_at is None:
+        index.start_full_refresh()
+        aliases = await kg_call(_get_aliases, index.cls, None)
+        index.replace_all(aliases, started_at)
+        duplicates = index.duplicates()
+        for alias, ids in duplicates.items():
+            logger.warning(f"Found multiple {index.name} (n={len(ids)}) with alias '{alias}': {', '.join(ids)}")
+        metrics.observe(f"aliases.{index.name}.full_refresh", time() - started_at)
+    else:
+        since = index.refreshed_at - settings.CATALOG_SYNC_OVERLAP
+        index.update(await kg_call(_get_aliases, index.cls, since), started_at)
+
+
+async def _refresh_periodically():
+    while True:
+        for index in (model_aliases, test_aliases):
+            full = (
+                index.full_refreshed_at is None
+                or time() - index.full_refreshed_at >= settings.ALIAS_INDEX_REFRESH_INTERVAL
+            )
+            try:
+                await refresh(index, full)
+            except asyncio.CancelledError:
+                raise
+            except Exception as err:
+                logger.error(f"Unable to refresh the alias index of {index.name}: {err}")
+                metrics.increment("aliases.refresh_failures")
+        await asyncio.sleep(settings.ALIAS_INDEX_SYNC_INTERVAL)
+
+
+def start_refreshing():
+    global _refresh_task
+    _refresh_task = asyncio.ensure_future(_refresh_periodically())
+
+
+async def stop_refreshing():
+    global _refresh_task
+    if _refresh_task is not None:
+        _refresh_task.cancel()
+        await asyncio.gather(_refresh_task, return_exceptions=True)
+        _refresh_task = None
+
+
+async def get_by_alias(index, alias):
+    """
+    Return the model project or test definition with the given alias, a list of them
+    if several have the same alias, or None if there is none.
+    """
+    ids = index.lookup(alias)
+    if ids:
+        objects = await asyncio.gather(
+            *(kg_call(get_by_uuid, index.cls, uuid, kg_client) for uuid in ids)
+        )
+        # the alias may have been changed by another process since the index was refreshed
+        objects = [obj for obj in objects if obj is not None and obj.alias == alias]
+        if objects:
+            metrics.increment(f"aliases.{index.name}.hits")
+            return objects[0] if len(objects) == 1 else objects
+    # either the index is out of date, or the alias may have been registered by another process
+    metrics.increment(f"aliases.{index.name}.misses")
+    found = await kg_call(index.cls.from_alias, alias, kg_client, api="nexus")
+    for obj in as_list(found):
+        index.set(obj.uuid, obj.alias)
+    return found
+
+
+async def model_alias_exists(alias):
+    if not alias:
+        return False
+    ids = model_aliases.lookup(alias)
+    if ids is None:
+        return await kg_call(_model_alias_exists_in_kg, alias, kg_client)
+    return bool(ids)
+
+
+async def test_alias_exists(alias):
+    ids = test_aliases.lookup(alias)
+    if ids is None:
+        return await kg_call(_test_alias_exists_in_kg, alias, kg_client)
+    return bool(ids)
@@ -1,17 +1,38 @@
-import requests
+import asyncio
+from contextvars import ContextVar
+import random
 import logging
 import json
+import base64
+import hashlib
+from time import time
 
+import httpx
 from fairgraph.client import KGClient
 
 from fastapi import HTTPException, status
 from authlib.integrations.starlette_client import OAuth
+from authlib.jose import jwt, JoseError
 
 from . import settings
+from .cache import TTLCache
 
 logger = logging.getLogger("validation_service_v2")
 
 kg_client = None
+http_client = None
+
+user_cache = TTLCache("users", maxsize=settings.USER_CACHE_SIZE, ttl=settings.USER_CACHE_TTL)
+jwks_cache = TTLCache("jwks", maxsize=2, ttl=settings.JWKS_CACHE_TTL)
+_last_jwks_refresh = 0.0
+permissions_cache = TTLCache(
+    "collab_permissions", maxsize=settings.PERMISSIONS_CACHE_SIZE, ttl=settings.PERMISSIONS_CACHE_TTL
+)
+collab_info_cache = TTLCache(
+    "collab_info", maxsize=settings.PERMISSIONS_CACHE_SIZE, ttl=settings.PERMISSIONS_CACHE_TTL
+)
+# permission checks already made (or in progress) during the current request
+request_permissions = ContextVar("request_permissions", default=None)
 
 oauth = OAuth()
 
@@ -41,22 +62,192 @@ def get_kg_client():
     return kg_client
 
 
-def get_user_from_token(token):
+def get_http_client():
+    """
+    Return the HTTP client shared by all requests to the identity and collab services,
+    which keeps connections alive between requests.
+    """
+    global http_client
+    if http_client is None:
+        http_client = httpx.AsyncClient(
+            timeout=httpx.Timeout(settings.HTTP_TIMEOUT, connect=settings.HTTP_CONNECT_TIMEOUT),
+            limits=httpx.Limits(
+                max_connections=settings.HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=settings.HTTP_MAX_KEEPALIVE_CONNECTIONS,
+            ),
+            trust_env=False,
+        )
+    return http_client
+
+
+async def close_http_client():
+    global http_client
+    if http_client is not None:
+        await http_client.aclose()
+        http_client = None
+
+
+RETRY_STATUS_CODES = (429, 502, 503, 504)
+
+
+async def http_get(url, token=None):
+    """
+    GET a URL, retrying with jittered exponential backoff
+    in case of network errors or temporary unavailability of the remote service.
+    """
+    headers = {"Authorization": f"Bearer {token}"} if token else {}
+    for attempt in range(settings.HTTP_MAX_RETRIES + 1):
+        try:
+            response = await get_http_client().get(url, headers=headers)
+        except httpx.TransportError as err:
+            if attempt == settings.HTTP_MAX_RETRIES:
+                raise
+            logger.warning(f"Error accessing {url}: {err!r}, retrying")
+        else:
+            if (
+                response.status_code not in RETRY_STATUS_CODES
+                or attempt == settings.HTTP_MAX_RETRIES
+            ):
+                return response
+            logger.warning(f"{url} returned status {response.status_code}, retrying")
+        backoff = min(settings.HTTP_RETRY_BACKOFF * 2 ** attempt, settings.HTTP_RETRY_BACKOFF_MAX)
+        await asyncio.sleep(random.uniform(0, backoff))
+
+
+def _token_cache_key(token):
+    # we don't keep the tokens themselves in memory longer than necessary
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+
+def _token_expiry(token):
+    """
+    Return the expiry time (in seconds since the epoch) claimed by a JWT access token,
+    or None if the token is opaque or has no expiry claim.
+
+    The signature is not checked here, the expiry is only used to bound cache lifetimes.
+    """
+    try:
+        payload = token.split(".")[1]
+        payload += "=" * (-len(payload) % 4)
+        claims = json.loads(base64.urlsafe_b64decode(payload))
+        return float(claims["exp"])
+    except (IndexError, KeyError, TypeError, ValueError):
+        return None
+
+
+def _cache_ttl_for_token(token, ttl):
+    expiry = _token_expiry(token)
+    if expiry is not None:
+        ttl = min(ttl, expiry - time())
+    return ttl
+
+
+async def _get_iam_configuration():
+    conf = jwks_cache.get("configuration")
+    if conf is None:
+        conf = (await http_get(settings.EBRAINS_IAM_CONF_URL)).json()
+        jwks_cache.set("configuration", conf)
+    return conf
+
+
+async def _get_jwks(force_refresh=False):
+    """
+    Return the JSON Web Key Set of the EBRAINS IAM.
+
+    The key set is cached, and is refetched when the cache expires or when a token is signed
+    with a key we don't know (i.e. the IAM has rotated its keys).
+    """
+    global _last_jwks_refresh
+    jwks = jwks_cache.get("keys")
+    if jwks is None or (
+        force_refresh and time() - _last_jwks_refresh > settings.JWKS_MIN_REFRESH_INTERVAL
+    ):
+        jwks = (await http_get((await _get_iam_configuration())["jwks_uri"])).json()
+        jwks_cache.set("keys", jwks)
+        _last_jwks_refresh = time()
+    return jwks
+
+
+async def verify_token(token):
+    """
+    Verify an EBRAINS access token locally, using the public keys of the IAM.
+
+    Returns the token claims, or None if the token could not be verified locally
+    (e.g. it was issued by another identity provider, or has expired),
+    in which case the caller should fall back to asking the identity provider.
+    """
+    try:
+        issuer = (await _get_iam_configuration())["issuer"]
+        try:
+            claims = jwt.decode(
+                token,
+                await _get_jwks(),
+                claims_options={"iss": {"essential": True, "value": issuer}},
+            )
+        except ValueError:
+            # unknown key id, perhaps the keys have been rotated
+            claims = jwt.decode(
+                token,
+                await _get_jwks(force_refresh=True),
+                claims_options={"iss": {"essential": True, "value": issuer}},
+            )
+        claims.validate()
+    except (JoseError, ValueError, KeyError, httpx.HTTPError) as err:
+        logger.debug(f"Unable to verify token locally: {err}")
+        return None
+    return dict(claims)
+
+
+async def get_userinfo(token):
+    """
+    Get EBRAINS user information, including team roles, from the token claims if possible,
+    otherwise from the userinfo endpoint of the IAM.
     """
-    Get user id with token
-    :param request: request
-    :type request: str
-    :returns: res._content
-    :rtype: str
+    claims = await verify_token(token)
+    if claims and "sub" in claims and "team" in claims.get("roles", {}):
+        return claims
+    return await oauth.ebrains.userinfo(token={"access_token": token, "token_type": "bearer"})
+
+
+async def get_user_from_token(token):
+    """
+    Get user information with token
+
+    Results are cached per token, for at most `USER_CACHE_TTL` seconds
+    and never beyond the expiry of the token.
+
+    :param token: access token
+    :type token: str
+    :returns: user information
+    :rtype: dict
     """
+    key = _token_cache_key(token)
+    user_info = user_cache.get(key)
+    if user_info is None:
+        user_info = await _get_user_from_identity_service(token)
+        user_cache.set(key, user_info, ttl=_cache_ttl_for_token(token, user_cache.ttl))
+    return user_info
+
+
+def invalidate_user(token):
+    """Remove any cached user information for the given token"""
+    user_cache.invalidate(_token_cache_key(token))
+
+
+async def _get_user_from_identity_service(token):
+    claims = await verify_token(token)
+    if claims and "sub" in claims and "family_name" in claims:
+        user_info = claims
+        user_info["id"] = user_info["sub"]
+        user_info["username"] = user_info.get("preferred_username", "unknown")
+        return user_info
     url_v1 = f"{settings.HBP_IDENTITY_SERVICE_URL_V1}/user/me"
     url_v2 = f"{settings.HBP_IDENTITY_SERVICE_URL_V2}/userinfo"
-    headers = {"Authorization": f"Bearer {token}"}
     # logger.debug("Requesting user information for given access token")
-    res1 = requests.get(url_v1, headers=headers)
+    res1 = await http_get(url_v1, token)
     if res1.status_code != 200:
         # logger.debug(f"Problem with v1 token: {res1.content}")
-        res2 = requests.get(url_v2, headers=headers)
+        res2 = await http_get(url_v2, token)
         if res2.status_code != 200:
             raise HTTPException(status_code=401, detail="Invalid token")
         else:
@@ -73,26 +264,48 @@ def get_user_from_token(token):
 
 async def get_collab_permissions_v1(collab_id, user_token):
     url = f"{settings.HBP_COLLAB_SERVICE_URL}collab/{collab_id}/permissions/"
-    headers = {"Authorization": f"Bearer {user_token}"}
-    res = requests.get(url, headers=headers)
+    res = await http_get(url, user_token)
     # if res.status_code != 200:
     #    return {"VIEW": False, "UPDATE": False}
     try:
         response = res.json()
-    except json.decoder.JSONDecodeError:
+    except ValueError:
         raise Exception(
             f"Error in retrieving collab permissions from {url}. Response was: {res.content}"
         )
     return response
 
 
+async def _token_subject(token):
+    """
+    Identify the user for the purposes of caching.
+
+    We only use the subject claim if the token has been verified,
+    otherwise a forged token could pick up another user's permissions.
+    """
+    claims = await verify_token(token)
+    if claims and "sub" in claims:
+        return claims["sub"]
+    return _token_cache_key(token)
+
+
 async def get_collab_info(collab_id, user_token):
+    key = (await _token_subject(user_token), str(collab_id))
+    collab_info = collab_info_cache.get(key)
+    if collab_info is None:
+        collab_info = await _get_collab_info_from_service(collab_id, user_token)
+        collab_info_cache.set(
+            key, collab_info, ttl=_cache_ttl_for_token(user_token, collab_info_cache.ttl)
+        )
+    return collab_info
+
+
+async def _get_collab_info_from_service(collab_id, user_token):
     collab_info_url = f"{settings.HBP_COLLAB_SERVICE_URL_V2}collabs/{collab_id}"
-    headers = {"Authorization": f"Bearer {user_token}"}
-    res = requests.get(collab_info_url, headers=headers)
+    res = await http_get(collab_info_url, user_token)
     try:
         response = res.json()
-    except json.decoder.JSONDecodeError:
+    except ValueError:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid collab id"
         )
@@ -100,9 +313,7 @@ async def get_collab_info(collab_id, user_token):
 
 
 async def get_collab_permissions_v2(collab_id, user_token):
-    userinfo = await oauth.ebrains.userinfo(
-        token={"access_token": user_token, "token_type": "bearer"}
-    )
+    userinfo = await get_userinfo(user_token)
     if "error" in userinfo:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED, detail=userinfo["error_description"]
@@ -128,14 +339,45 @@ async def get_collab_permissions_v2(collab_id, user_token):
     return permissions
 
 
+async def get_collab_permissions(collab_id, user_token):
+    """
+    Get the permissions of a user for a given collab.
+
+    Permissions are cached for a short time per user and collab, with a shorter lifetime
+    for "negative" results so that users who have just joined a collab don't wait too long.
+    Within a single request, repeated checks for the same collab share one lookup.
+    """
+    key = (await _token_subject(user_token), str(collab_id))
+    permissions_in_request = request_permissions.get()
+    if permissions_in_request is None:
+        return await _get_collab_permissions_cached(key, collab_id, user_token)
+    if key not in permissions_in_request:
+        permissions_in_request[key] = asyncio.ensure_future(
+            _get_collab_permissions_cached(key, collab_id, user_token)
+        )
+    return await permissions_in_request[key]
+
+
+async def _get_collab_permissions_cached(key, collab_id, user_token):
+    permissions = permissions_cache.get(key)
+    if permissions is None:
+        try:
+            int(collab_id)
+            get_permissions_from_service = get_collab_permissions_v1
+        except ValueError:
+            get_permissions_from_service = get_collab_permissions_v2
+        permissions = await get_permissions_from_service(collab_id, user_token)
+        if permissions.get("UPDATE", False):
+            ttl = settings.PERMISSIONS_CACHE_TTL
+        else:
+            ttl = settings.PERMISSIONS_NEGATIVE_CACHE_TTL
+        permissions_cache.set(key, permissions, ttl=_cache_ttl_for_token(user_token, ttl))
+    return permissions
+
+
 async def is_collab_member(collab_id, user_token):
     if collab_id is None:
         return False
-    try:
-        int(collab_id)
-        get_collab_permissions = get_collab_permissions_v1
-    except ValueError:
-        get_collab_permissions = get_collab_permissions_v2
     permissions = await get_collab_permissions(collab_id, user_token)
     return permissions.get("UPDATE", False)
 
@@ -0,0 +1,118 @@
+"""
+In-memory caches, used to avoid repeated round-trips to remote services
+"""
+
+import threading
+from collections import OrderedDict
+from time import monotonic
+
+
+_registry = {}
+
+
+class TTLCache:
+    """
+    Thread-safe least-recently-used cache, whose entries expire after a time-to-live.
+
+    Each entry may be given its own time-to-live (e.g. bounded by the expiry of an access token),
+    otherwise the default for the cache is used.
+    If `stale_ttl` is given, expired entries are kept for that many further seconds,
+    and may be retrieved with `lookup()` (e.g. to serve them while they are being refreshed).
+    Caches are registered by name so that their statistics can be reported.
+    """
+
+    def __init__(self, name, maxsize=1024, ttl=300, stale_ttl=0):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self._data = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        _registry[name] = self
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                expires_at, value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            if expires_at <= monotonic():
+                if expires_at + self.stale_ttl <= monotonic():
+                    del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def lookup(self, key):
+        """
+        Return a tuple (found, value, stale).
+
+        Expired entries are returned with stale=True until `stale_ttl` has also elapsed.
+        """
+        with self._lock:
+            try:
+                expires_at, value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return False, None, False
+            now = monotonic()
+            if expires_at + self.stale_ttl <= now:
+                del self._data[key]
+                self.misses += 1
+                return False, None, False
+            self._data.move_to_end(key)
+            self.hits += 1
+            return True, value, expires_at <= now
+
+    def set(self, key, value, ttl=None):
+        if ttl is None:
+            ttl = self.ttl
+        if ttl <= 0 or self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = (monotonic() + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __contains__(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            return item is not None and item[0] > monotonic()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+                "stale_ttl": self.stale_ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else None,
+            }
+
+
+def cache_stats():
+    """Return statistics for all named caches"""
+    return {name: cache.stats() for name, cache in _registry.items()}
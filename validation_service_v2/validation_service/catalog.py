@@ -0,0 +1,755 @@
+"""
+Local read replica of the catalog: models, tests, their instances, and validation results.
+
+Listing models or tests from the KG means resolving many linked objects, which takes seconds.
+Instead, the API representations of these objects are kept in a local SQLite database,
+and read endpoints serve from it as long as it is no more out of date than a configurable
+bound (`CATALOG_REPLICA_MAX_STALENESS`, which clients may override with `max_staleness`).
+
+The replica is kept current in two ways:
+  - a sync task polls the KG for objects modified since the previous sync (with an overlap,
+    to allow for the time the KG takes to become consistent), and from time to time performs
+    a full sync, which also removes objects which have been deleted from the KG;
+  - objects created, updated or deleted through this service are written through immediately.
+
+Several service processes may share the same replica: the sync is claimed with a lease,
+so only one of them syncs at a time. Since another process may hold the database lock,
+writes, and reads which may be large, are run outside the event loop (`replica_call()`).
+"""
+
+import asyncio
+import json
+import logging
+import sqlite3
+import threading
+from contextlib import contextmanager
+from itertools import chain
+from time import time
+from uuid import UUID
+
+from fastapi.encoders import jsonable_encoder
+from fairgraph.brainsimulation import (
+    ModelProject,
+    ModelInstance as ModelInstanceKG,
+    MEModel,
+    ValidationTestDefinition,
+    ValidationScript,
+    ValidationResult as ValidationResultKG,
+)
+
+from . import settings, metrics
+from .data_models import (
+    ScientificModel,
+    ModelInstance,
+    ValidationTest,
+    ValidationTestInstance,
+    ValidationResult,
+    ConsistencyError,
+)
+from .db import kg_client
+from .kg_executor import kg_call
+from .kg_resolver import get_by_uuid, invalidate, map_concurrently
+from .queries import query_kg_objects, build_modified_since_filter
+
+
+logger = logging.getLogger("validation_service_v2")
+
+MAX_STALENESS_DESCRIPTION = (
+    "Maximum age in seconds of the local copy of the catalog which may be used to answer "
+    "this request (default set by the server). Use 0 to read directly from the Knowledge Graph."
+)
+
+_schema = """
+CREATE TABLE IF NOT EXISTS models (
+    id TEXT PRIMARY KEY,
+    alias TEXT,
+    project_id TEXT,
+    private INTEGER,
+    date_created REAL,
+    updated REAL NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS models_alias ON models (alias);
+CREATE TABLE IF NOT EXISTS model_instances (
+    id TEXT PRIMARY KEY,
+    model_id TEXT NOT NULL,
+    timestamp REAL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS model_instances_model ON model_instances (model_id);
+CREATE TABLE IF NOT EXISTS tests (
+    id TEXT PRIMARY KEY,
+    alias TEXT,
+    date_created REAL,
+    updated REAL NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS tests_alias ON tests (alias);
+CREATE TABLE IF NOT EXISTS test_instances (
+    id TEXT PRIMARY KEY,
+    test_id TEXT NOT NULL,
+    timestamp REAL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS test_instances_test ON test_instances (test_id);
+CREATE TABLE IF NOT EXISTS results (
+    id TEXT PRIMARY KEY,
+    model_instance_id TEXT NOT NULL,
+    test_instance_id TEXT NOT NULL,
+    passed INTEGER,
+    project_id TEXT,
+    timestamp REAL,
+    updated REAL NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS results_model_instance ON results (model_instance_id);
+CREATE INDEX IF NOT EXISTS results_test_instance ON results (test_instance_id);
+CREATE INDEX IF NOT EXISTS results_timestamp ON results (timestamp);
+CREATE TABLE IF NOT EXISTS sync_state (
+    name TEXT PRIMARY KEY,
+    synced_at REAL,
+    full_synced_at REAL,
+    lease_until REAL NOT NULL DEFAULT 0
+);
+INSERT OR IGNORE INTO sync_state (name) VALUES ('catalog');
+"""
+
+# columns which may be used directly in filters; other filters use the stored JSON
+_model_columns = {"id": "id", "alias": "alias", "project_id": "project_id", "private": "private"}
+_test_columns = {"id": "id", "alias": "alias"}
+
+
+def _epoch(timestamp):
+    return timestamp.timestamp() if timestamp else None
+
+
+def _values(value):
+    if value is None:
+        return []
+    values = value if isinstance(value, (list, tuple, set)) else [value]
+    return [str(item) if isinstance(item, UUID) else item for item in values]
+
+
+def _in(expression, values):
+    return f"{expression} IN ({', '.join('?' * len(values))})", list(values)
+
+
+def _conditions(filters, columns, people=()):
+    """
+    Build SQL conditions from API filters, each with a value or list of values.
+    `people` names the filters which match the family name of a list of people.
+    """
+    conditions = []
+    for name, value in filters.items():
+        values = _values(value)
+        if not values:
+            continue
+        if name in people:
+            sql, params = _in("json_extract(person.value, '$.family_name')", values)
+            conditions.append(
+                (f"EXISTS (SELECT 1 FROM json_each(data, '$.{name}') AS person WHERE {sql})", params)
+            )
+        else:
+            conditions.append(_in(columns.get(name, f"json_extract(data, '$.{name}')"), values))
+    return conditions
+
+
+def _where(conditions):
+    if not conditions:
+        return "", []
+    return (
+        " WHERE " + " AND ".join(sql for sql, _ in conditions),
+        list(chain.from_iterable(params for _, params in conditions)),
+    )
+
+
+class CatalogReplica:
+    """Local copy of the API representations of models, tests and results"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._connection.row_factory = sqlite3.Row
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.executescript(_schema)
+
+    def _execute(self, sql, *args):
+        with self._lock:
+            return self._connection.execute(sql, args).fetchall()
+
+    @contextmanager
+    def _transaction(self):
+        with self._lock:
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._connection
+            except BaseException:
+                self._connection.execute("ROLLBACK")
+                raise
+            self._connection.execute("COMMIT")
+
+    # sync state
+
+    def claim_sync(self, now):
+        """
+        Take the lease for syncing, returning the sync state,
+        or None if another process is already syncing.
+        """
+        with self._lock:
+            claimed = self._connection.execute(
+                "UPDATE sync_state SET lease_until = ? WHERE name = 'catalog' AND lease_until <= ?",
+                (now + settings.CATALOG_SYNC_LEASE, now),
+            ).rowcount
+            if not claimed:
+                return None
+            return self._connection.execute(
+                "SELECT * FROM sync_state WHERE name = 'catalog'"
+            ).fetchone()
+
+    def renew_sync_lease(self):
+        self._execute(
+            "UPDATE sync_state SET lease_until = ? WHERE name = 'catalog'",
+            time() + settings.CATALOG_SYNC_LEASE,
+        )
+
+    def complete_sync(self, started_at, full):
+        """Record a successful sync, which reflects the state of the KG at `started_at`"""
+        if full:
+            self._execute(
+                "UPDATE sync_state SET synced_at = ?, full_synced_at = ?, lease_until = 0 "
+                "WHERE name = 'catalog'",
+                started_at, started_at,
+            )
+        else:
+            self._execute(
+                "UPDATE sync_state SET synced_at = ?, lease_until = 0 WHERE name = 'catalog'",
+                started_at,
+            )
+
+    def release_sync(self):
+        self._execute("UPDATE sync_state SET lease_until = 0 WHERE name = 'catalog'")
+
+    def age(self):
+        """
+        Time in seconds since the KG state reflected by the replica,
+        or None if the replica has not yet been fully populated
+        """
+        state = self._execute("SELECT synced_at, full_synced_at FROM sync_state WHERE name = 'catalog'")[0]
+        if state["full_synced_at"] is None:
+            return None
+        return time() - state["synced_at"]
+
+    # writes
+
+    def store_models(self, models):
+        """Add or replace models, together with all their instances"""
+        now = time()
+        with self._transaction() as connection:
+            for model in models:
+                data = jsonable_encoder(model.dict(exclude={"instances"}))
+                connection.execute(
+                    "INSERT OR REPLACE INTO models (id, alias, project_id, private, date_created, updated, data) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (str(model.id), model.alias, model.project_id, model.private,
+                     _epoch(model.date_created), now, json.dumps(data)),
+                )
+                connection.execute("DELETE FROM model_instances WHERE model_id = ?", (str(model.id),))
+                for instance in model.instances or []:
+                    self._store_model_instance(connection, instance)
+
+    def _store_model_instance(self, connection, instance):
+        # internal attributes (e.g. the ID of the model script) are not part of the API
+        data = jsonable_encoder(instance.dict(include=set(ModelInstance.__fields__)))
+        connection.execute(
+            "INSERT OR REPLACE INTO model_instances (id, model_id, timestamp, data) VALUES (?, ?, ?, ?)",
+            (str(instance.id), str(instance.model_id), _epoch(instance.timestamp), json.dumps(data)),
+        )
+
+    def store_model_instance(self, instance):
+        with self._transaction() as connection:
+            self._store_model_instance(connection, instance)
+
+    def remove_model(self, model_id):
+        with self._transaction() as connection:
+            connection.execute("DELETE FROM model_instances WHERE model_id = ?", (str(model_id),))
+            connection.execute("DELETE FROM models WHERE id = ?", (str(model_id),))
+
+    def remove_model_instance(self, instance_id):
+        self._execute("DELETE FROM model_instances WHERE id = ?", str(instance_id))
+
+    def model_ids_for_instances(self, instance_ids):
+        instance_ids = _values(instance_ids)
+        if not instance_ids:
+            return set()
+        sql, params = _in("id", instance_ids)
+        return set(
+            row["model_id"] for row in self._execute(f"SELECT model_id FROM model_instances WHERE {sql}", *params)
+        )
+
+    def store_tests(self, tests):
+        """Add or replace tests, together with all their instances"""
+        now = time()
+        with self._transaction() as connection:
+            for test in tests:
+                data = jsonable_encoder(test.dict(exclude={"instances"}))
+                connection.execute(
+                    "INSERT OR REPLACE INTO tests (id, alias, date_created, updated, data) VALUES (?, ?, ?, ?, ?)",
+                    (str(test.id), test.alias, _epoch(test.date_created), now, json.dumps(data)),
+                )
+                connection.execute("DELETE FROM test_instances WHERE test_id = ?", (str(test.id),))
+                for instance in test.instances or []:
+                    self._store_test_instance(connection, instance)
+
+    def _store_test_instance(self, connection, instance):
+        connection.execute(
+            "INSERT OR REPLACE INTO test_instances (id, test_id, timestamp, data) VALUES (?, ?, ?, ?)",
+            (str(instance.id), str(instance.test_id), _epoch(instance.timestamp),
+             json.dumps(jsonable_encoder(instance))),
+        )
+
+    def store_test_instances(self, instances):
+        with self._transaction() as connection:
+            for instance in instances:
+                self._store_test_instance(connection, instance)
+
+    def remove_test(self, test_id):
+        with self._transaction() as connection:
+            connection.execute("DELETE FROM test_instances WHERE test_id = ?", (str(test_id),))
+            connection.execute("DELETE FROM tests WHERE id = ?", (str(test_id),))
+
+    def remove_test_instance(self, instance_id):
+        self._execute("DELETE FROM test_instances WHERE id = ?", str(instance_id))
+
+    def store_results(self, results):
+        now = time()
+        with self._transaction() as connection:
+            for result in results:
+                connection.execute(
+                    "INSERT OR REPLACE INTO results (id, model_instance_id, test_instance_id, passed, "
+                    "project_id, timestamp, updated, data) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (str(result.id), str(result.model_instance_id), str(result.test_instance_id),
+                     result.passed, result.project_id, _epoch(result.timestamp), now,
+                     json.dumps(jsonable_encoder(result))),
+                )
+
+    def remove_result(self, result_id):
+        self._execute("DELETE FROM results WHERE id = ?", str(result_id))
+
+    def remove_missing(self, table, seen_ids, before):
+        """
+        Remove the models, tests or results which were not seen in a full sync started at `before`
+        (objects written through since then are kept)
+        """
+        stored_ids = set(
+            row["id"] for row in self._execute(f"SELECT id FROM {table} WHERE updated < ?", before)
+        )
+        missing = list(stored_ids.difference(seen_ids))
+        remove = {
+            "models": self.remove_model,
+            "tests": self.remove_test,
+            "results": self.remove_result,
+        }[table]
+        for object_id in missing:
+            remove(object_id)
+        if missing:
+            logger.info(f"Removed {len(missing)} deleted {table} from the catalog replica")
+
+    # reads
+
+    def _attach_instances(self, rows, table, parent_column):
+        """Return the stored objects, each with the list of its instances in chronological order"""
+        objects = {row["id"]: dict(json.loads(row["data"]), instances=[]) for row in rows}
+        if objects:
+            sql, params = _in(parent_column, list(objects))
+            for row in self._execute(
+                f"SELECT {parent_column} AS parent_id, data FROM {table} WHERE {sql} ORDER BY timestamp",
+                *params,
+            ):
+                objects[row["parent_id"]]["instances"].append(json.loads(row["data"]))
+        return list(objects.values())
+
+    def _query(self, table, instance_table, parent_column, conditions, size, from_index, fields):
+        where, params = _where(conditions)
+        total = self._execute(f"SELECT COUNT(*) FROM {table}{where}", *params)[0][0]
+        rows = self._execute(
+            f"SELECT id, data, (SELECT COUNT(*) FROM {instance_table} "
+            f"WHERE {instance_table}.{parent_column} = {table}.id) AS instance_count "
+            f"FROM {table}{where} ORDER BY date_created DESC, id LIMIT ? OFFSET ?",
+            *params, size, from_index,
+        )
+        if fields:
+            objects = []
+            for row in rows:
+                data = dict(json.loads(row["data"]), instance_count=row["instance_count"])
+                objects.append({key: value for key, value in data.items() if key in fields})
+            return objects, total
+        return self._attach_instances(rows, instance_table, parent_column), total
+
+    def _get(self, table, instance_table, parent_column, id_or_alias):
+        try:
+            rows = self._execute(f"SELECT id, data FROM {table} WHERE id = ?", str(UUID(id_or_alias)))
+        except ValueError:
+            rows = self._execute(f"SELECT id, data FROM {table} WHERE alias = ?", id_or_alias)
+        if len(rows) != 1:
+            return None
+        return self._attach_instances(rows, instance_table, parent_column)[0]
+
+    def query_models(self, filters, size, from_index, fields=None):
+        """
+        Return a page of models matching the filters (as for `build_model_project_filters()`),
+        and the total number of matching models.
+        If `fields` is given, only those fields of `ScientificModelSummary` are returned.
+        """
+        conditions = _conditions(filters, _model_columns, people=("author", "owner"))
+        return self._query("models", "model_instances", "model_id", conditions, size, from_index, fields)
+
+    def get_model(self, model_id):
+        """Return the model with the given ID or alias, or None if it is not (unambiguously) present"""
+        return self._get("models", "model_instances", "model_id", model_id)
+
+    def query_tests(self, filters, size, from_index, fields=None):
+        """As `query_models()`, for tests"""
+        conditions = _conditions(filters, _test_columns, people=("author",))
+        return self._query("tests", "test_instances", "test_id", conditions, size, from_index, fields)
+
+    def get_test(self, test_id):
+        return self._get("tests", "test_instances", "test_id", test_id)
+
+    def query_results(self, filters, size, from_index):
+        """
+        Return a page of results matching the filters (as for `build_result_filters()`),
+        most recent first, and the total number of matching results.
+        """
+        conditions = []
+        for name, sql in (
+            ("model_instance_id", "model_instance_id IN ({})"),
+            ("test_instance_id", "test_instance_id IN ({})"),
+            ("model_id", "model_instance_id IN (SELECT id FROM model_instances WHERE model_id IN ({}))"),
+            ("test_id", "test_instance_id IN (SELECT id FROM test_instances WHERE test_id IN ({}))"),
+            ("model_alias", "model_instance_id IN (SELECT model_instances.id FROM model_instances "
+                            "JOIN models ON models.id = model_instances.model_id WHERE models.alias IN ({}))"),
+            ("test_alias", "test_instance_id IN (SELECT test_instances.id FROM test_instances "
+                           "JOIN tests ON tests.id = test_instances.test_id WHERE tests.alias IN ({}))"),
+            ("score_type", "test_instance_id IN (SELECT test_instances.id FROM test_instances "
+                           "JOIN tests ON tests.id = test_instances.test_id "
+                           "WHERE json_extract(tests.data, '$.score_type') IN ({}))"),
+            ("passed", "passed IN ({})"),
+            ("project_id", "project_id IN ({})"),
+        ):
+            values = _values(filters.get(name))
+            if name == "project_id":
+                values = [str(value) for value in values]
+            if values:
+                conditions.append((sql.format(", ".join("?" * len(values))), values))
+        where, params = _where(conditions)
+        total = self._execute(f"SELECT COUNT(*) FROM results{where}", *params)[0][0]
+        rows = self._execute(
+            f"SELECT data FROM results{where} ORDER BY timestamp DESC, id DESC LIMIT ? OFFSET ?",
+            *params, size, from_index,
+        )
+        return [json.loads(row["data"]) for row in rows], total
+
+    # columnar access, for the score table
+
+    def score_rows(self, since=None):
+        """
+        Return (id, model instance ID, test instance ID, score, timestamp, passed, project ID)
+        for all results, or for those stored since the timestamp `since`
+        """
+        where, params = ("", []) if since is None else (" WHERE updated >= ?", [since])
+        return [
+            tuple(row) for row in self._execute(
+                "SELECT id, model_instance_id, test_instance_id, json_extract(data, '$.score'), "
+                f"timestamp, passed, project_id FROM results{where}",
+                *params,
+            )
+        ]
+
+    def score_dimensions(self, model_instance_ids=None, test_instance_ids=None):
+        """
+        Return a dict of model instance ID -> model ID, and a dict of
+        test instance ID -> (test ID, score type), for all instances or for those given
+        """
+        model_where, model_params = "", []
+        test_where, test_params = "", []
+        if model_instance_ids is not None:
+            model_where, model_params = _where([_in("id", _values(model_instance_ids))])
+        if test_instance_ids is not None:
+            test_where, test_params = _where([_in("test_instances.id", _values(test_instance_ids))])
+        model_instances = {
+            row["id"]: row["model_id"]
+            for row in self._execute(f"SELECT id, model_id FROM model_instances{model_where}", *model_params)
+        }
+        test_instances = {
+            row["id"]: (row["test_id"], row["score_type"])
+            for row in self._execute(
+                "SELECT test_instances.id, test_instances.test_id, "
+                "json_extract(tests.data, '$.score_type') AS score_type FROM test_instances "
+                f"LEFT JOIN tests ON tests.id = test_instances.test_id{test_where}",
+                *test_params,
+            )
+        }
+        return model_instances, test_instances
+
+
+_replica = None
+_replica_lock = threading.Lock()
+_sync_task = None
+
+
+def get_replica():
+    global _replica
+    with _replica_lock:
+        if _replica is None:
+            _replica = CatalogReplica(settings.CATALOG_REPLICA_PATH)
+        return _replica
+
+
+def fresh_replica(max_staleness=None):
+    """
+    Return the replica if it is enabled and reflects the KG as it was no more than
+    `max_staleness` seconds ago (default `CATALOG_REPLICA_MAX_STALENESS`), otherwise None.
+    """
+    if not settings.CATALOG_REPLICA_PATH:
+        return None
+    if max_staleness is None:
+        max_staleness = settings.CATALOG_REPLICA_MAX_STALENESS
+    replica = get_replica()
+    age = replica.age()
+    if age is None or age > max_staleness:
+        metrics.increment("catalog.stale_reads")
+        return None
+    metrics.increment("catalog.reads")
+    return replica
+
+
+async def replica_call(func, *args):
+    """Run a blocking replica operation (e.g. `replica.query_models`) in a worker thread"""
+    loop = asyncio.get_event_loop()
+    return await loop.run_in_executor(None, func, *args)
+
+
+def replica_age_header(replica):
+    return {"X-Catalog-Replica-Age": f"{replica.age():.0f}"}
+
+
+# write-through of this service's own changes
+
+async def _write_through(method_name, *args):
+    if not settings.CATALOG_REPLICA_PATH:
+        return
+    try:
+        await replica_call(getattr(get_replica(), method_name), *args)
+    except sqlite3.Error as err:
+        # the change will be picked up by the next sync
+        logger.warning(f"Unable to update the catalog replica ({method_name}): {err}")
+
+
+async def store_model(model):
+    await _write_through("store_models", [model])
+
+
+async def store_model_instance(instance):
+    await _write_through("store_model_instance", instance)
+
+
+async def remove_model(model_id):
+    await _write_through("remove_model", model_id)
+
+
+async def remove_model_instance(instance_id):
+    await _write_through("remove_model_instance", instance_id)
+
+
+async def store_test(test):
+    await _write_through("store_tests", [test])
+
+
+async def store_test_instance(instance):
+    await _write_through("store_test_instances", [instance])
+
+
+async def remove_test(test_id):
+    await _write_through("remove_test", test_id)
+
+
+async def remove_test_instance(instance_id):
+    await _write_through("remove_test_instance", instance_id)
+
+
+async def store_result(result):
+    await _write_through("store_results", [result])
+
+
+async def remove_result(result_id):
+    await _write_through("remove_result", result_id)
+
+
+# sync from the KG
+
+async def _convert(from_kg_objects, kg_objects):
+    """
+    Convert KG objects to the API data models. If the batch cannot be converted,
+    the objects are converted one at a time, and those which fail are skipped.
+    """
+    try:
+        return await kg_call(from_kg_objects, kg_objects, kg_client)
+    except Exception as err:
+        if len(kg_objects) == 1:
+            logger.warning(f"Unable to add {kg_objects[0].id} to the catalog replica: {err}")
+            return []
+    converted = await asyncio.gather(*(_convert(from_kg_objects, [obj]) for obj in kg_objects))
+    return list(chain.from_iterable(converted))
+
+
+def _results_from_kg_objects(results, client):
+    def convert(result):
+        try:
+            return ValidationResult.from_kg_object(result, client)
+        except ConsistencyError as err:
+            logger.warning(str(err))
+            return None
+
+    return [obj for obj in map_concurrently(convert, results) if obj is not None]
+
+
+def _test_instances_from_kg_objects(test_scripts, client):
+    return [ValidationTestInstance.from_kg_object(test_script, client) for test_script in test_scripts]
+
+
+async def _sync_objects(replica, cls, since, store):
+    """
+    Retrieve the KG objects of type `cls` modified since the timestamp `since`
+    (or all of them if `since` is None), passing each batch to the coroutine function `store()`.
+    Returns the set of their UUIDs.
+    """
+    filter_query, context = build_modified_since_filter(since)
+    batch_size = settings.CATALOG_SYNC_BATCH_SIZE
+    seen = set()
+    from_index = 0
+    while True:
+        batch = await kg_call(
+            query_kg_objects, cls, filter_query, context, kg_client,
+            size=batch_size, from_index=from_index
+        )
+        if batch:
+            await store(batch)
+        seen.update(obj.uuid for obj in batch)
+        await replica_call(replica.renew_sync_lease)
+        if len(batch) < batch_size:
+            return seen
+        from_index += len(batch)
+
+
+async def _sync(replica, since):
+    """
+    Copy the catalog objects modified since the timestamp `since` (or all of them) into the replica,
+    returning the UUIDs of the models, tests and results which were retrieved.
+    """
+    seen = {}
+
+    async def store_models(model_projects):
+        await replica_call(replica.store_models, await _convert(ScientificModel.from_kg_objects, model_projects))
+
+    seen["models"] = await _sync_objects(replica, ModelProject, since, store_models)
+
+    if since is not None:
+        # the project does not change when one of its instances is updated,
+        # so we convert again the projects of any modified instances
+        async def refresh_models(model_instances):
+            for model_instance in model_instances:
+                invalidate(model_instance.id)  # from the object cache, which may be out of date
+            model_ids = (await replica_call(
+                replica.model_ids_for_instances, [model_instance.uuid for model_instance in model_instances]
+            )).difference(seen["models"])
+            model_projects = await asyncio.gather(
+                *(kg_call(get_by_uuid, ModelProject, model_id, kg_client) for model_id in model_ids)
+            )
+            model_projects = [model_project for model_project in model_projects if model_project]
+            if model_projects:
+                await store_models(model_projects)
+            seen["models"].update(model_ids)
+
+        for cls in (ModelInstanceKG, MEModel):
+            await _sync_objects(replica, cls, since, refresh_models)
+
+    async def store_tests(test_definitions):
+        await replica_call(replica.store_tests, await _convert(ValidationTest.from_kg_objects, test_definitions))
+
+    seen["tests"] = await _sync_objects(replica, ValidationTestDefinition, since, store_tests)
+
+    if since is not None:
+        async def store_test_instances(test_scripts):
+            await replica_call(
+                replica.store_test_instances, await _convert(_test_instances_from_kg_objects, test_scripts)
+            )
+
+        await _sync_objects(replica, ValidationScript, since, store_test_instances)
+
+    async def store_results(results):
+        await replica_call(replica.store_results, await _convert(_results_from_kg_objects, results))
+
+    seen["results"] = await _sync_objects(replica, ValidationResultKG, since, store_results)
+    return seen
+
+
+async def sync_replica(replica):
+    """
+    Bring the replica up to date, unless another process is already doing so.
+
+    The first sync, and then one every `CATALOG_FULL_SYNC_INTERVAL`, retrieves everything,
+    and removes from the replica any objects which are no longer in the KG.
+    Other syncs only retrieve objects which have been modified since the previous one.
+    """
+    started_at = time()
+    state = await replica_call(replica.claim_sync, started_at)
+    if state is None:
+        return
+    full = (
+        state["full_synced_at"] is None
+        or started_at - state["full_synced_at"] >= settings.CATALOG_FULL_SYNC_INTERVAL
+    )
+    since = None if full else state["synced_at"] - settings.CATALOG_SYNC_OVERLAP
+    try:
+        seen = await _sync(replica, since)
+        if full:
+            for table, ids in seen.items():
+                await replica_call(replica.remove_missing, table, ids, started_at)
+    except BaseException:
+        replica.release_sync()
+        raise
+    await replica_call(replica.complete_sync, started_at, full)
+    metrics.observe("catalog.full_sync" if full else "catalog.sync", time() - started_at)
+    logger.info(
+        f"{'Full' if full else 'Incremental'} sync of the catalog replica: "
+        + ", ".join(f"{len(ids)} {table}" for table, ids in seen.items())
+    )
+
+
+async def _sync_periodically(replica):
+    while True:
+        try:
+            await sync_replica(replica)
+        except asyncio.CancelledError:
+            raise
+        except Exception as err:
+            logger.error(f"Unable to sync the catalog replica: {err}")
+            metrics.increment("catalog.sync_failures")
+        await asyncio.sleep(settings.CATALOG_SYNC_INTERVAL)
+
+
+def start_sync():
+    global _sync_task
+    replica = get_replica()
+    metrics.register_gauge("catalog.replica_age", replica.age)
+    _sync_task = asyncio.ensure_future(_sync_periodically(replica))
+
+
+async def stop_sync():
+    global _sync_task
+    if _sync_task is not None:
+        _sync_task.cancel()
+        await asyncio.gather(_sync_task, return_exceptions=True)
+        _sync_task = None
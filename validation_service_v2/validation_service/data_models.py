@@ -2,11 +2,12 @@ import os
 from os.path import join, dirname
 from uuid import UUID
 from enum import Enum
-from typing import List
+from typing import List, ClassVar, Optional
 from datetime import datetime, timezone
 from itertools import chain
 import logging
 import json
+import asyncio
 import tempfile
 import hashlib
 from urllib.parse import urlparse, parse_qs, quote
@@ -24,9 +25,11 @@ import fairgraph.core
 import fairgraph.brainsimulation
 
 from .examples import EXAMPLES
-from .db import (_get_model_by_id_or_alias, _get_model_instance_by_id,
+from .db import (_get_model_instance_and_project, _check_model_access,
                  _get_test_by_id_or_alias, _get_test_instance_by_id)
 from .auth import get_user_from_token
+from .kg_executor import kg_call
+from .kg_resolver import resolve, resolve_many, get_by_uuid, map_concurrently
 
 
 fairgraph.core.use_namespace(fairgraph.brainsimulation.DEFAULT_NAMESPACE)
@@ -149,10 +152,7 @@ class Person(BaseModel):
 
     @classmethod
     def from_kg_object(cls, p, client):
-        if isinstance(p, KGProxy):
-            pr = p.resolve(client, api="nexus")
-        else:
-            pr = p
+        pr = resolve(p, client)
         return cls(given_name=pr.given_name, family_name=pr.family_name)
 
     def to_kg_object(self):
@@ -181,9 +181,22 @@ class ModelInstance(BaseModel):
     @classmethod
     def from_kg_object(cls, instance, client, model_id):
         if isinstance(instance, KGProxy):
-            instance = instance.resolve(client, api="nexus")
+            instance = resolve(instance, client)
             if instance is None:
                 raise Exception(f"Instance not found.")
+        resolved = resolve_many(cls._linked_objects(instance), client)
+        return cls._from_resolved(instance, resolved, model_id)
+
+    @staticmethod
+    def _linked_objects(instance):
+        linked_objects = [instance.main_script] + as_list(instance.alternate_of)
+        if hasattr(instance, "morphology"):
+            linked_objects.append(instance.morphology)
+        return linked_objects
+
+    @classmethod
+    def _from_resolved(cls, instance, resolved, model_id):
+        """Build from a resolved instance, taking linked objects from `resolved`"""
         instance_data = {
             "id": instance.uuid,
             "uri": instance.id,
@@ -195,7 +208,7 @@ class ModelInstance(BaseModel):
             "alternatives": []
         }
         if instance.main_script:
-            main_script = instance.main_script.resolve(client, api="nexus")
+            main_script = resolved.lookup(instance.main_script)
         else:
             raise Exception(f"main_script unexpectedly not present.\ninstance: {instance}")
         if main_script:
@@ -210,12 +223,12 @@ class ModelInstance(BaseModel):
             )
         if instance.alternate_of:
             for alt in as_list(instance.alternate_of):
-                alt_obj = alt.resolve(client, api="nexus")
+                alt_obj = resolved.lookup(alt)
                 if alt_obj and alt_obj.identifier:
                     url = f"https://kg.ebrains.eu/search/instances/Model/{alt_obj.identifier}"
                     instance_data["alternatives"].append(url)
         if hasattr(instance, "morphology"):
-            morph = instance.morphology.resolve(client, api="nexus")
+            morph = resolved.lookup(instance.morphology)
             instance_data["morphology"] = morph.morphology_file
             instance_data["morphology_id"] = morph.id  # internal
         if hasattr(instance, "e_model"):
@@ -348,10 +361,48 @@ class ScientificModel(BaseModel):
 
     @classmethod
     def from_kg_object(cls, model_project, client):
+        return cls.from_kg_objects([model_project], client)[0]
+
+    @classmethod
+    def from_kg_objects(cls, model_projects, client):
+        """
+        Convert a list of model projects, resolving linked objects level by level,
+        concurrently across all the projects.
+        """
+        resolved = resolve_many(
+            chain.from_iterable(
+                as_list(model_project.authors)
+                + as_list(model_project.owners)
+                + as_list(model_project.organization)
+                + as_list(model_project.instances)
+                for model_project in model_projects
+            ),
+            client,
+        )
+        model_instances = [
+            resolved.lookup(inst_obj)
+            for model_project in model_projects
+            for inst_obj in as_list(model_project.instances)
+        ]
+        resolved.update(
+            resolve_many(
+                chain.from_iterable(
+                    ModelInstance._linked_objects(inst) for inst in model_instances if inst
+                ),
+                client,
+            )
+        )
+        return [cls._from_resolved(model_project, resolved) for model_project in model_projects]
+
+    @classmethod
+    def _from_resolved(cls, model_project, resolved):
         instances = []
         for inst_obj in as_list(model_project.instances):
             try:
-                inst = ModelInstance.from_kg_object(inst_obj, client, model_id=model_project.uuid)
+                inst = resolved.lookup(inst_obj)
+                if inst is None:
+                    raise Exception(f"Instance not found.")
+                inst = ModelInstance._from_resolved(inst, resolved, model_id=model_project.uuid)
             except Exception as err:
                 logger.warning(f"Problem retrieving model instance {inst_obj.id}: {err}")
             else:
@@ -362,10 +413,16 @@ class ScientificModel(BaseModel):
                 uri=model_project.id,
                 name=model_project.name,
                 alias=model_project.alias,
-                author=[Person.from_kg_object(p, client) for p in as_list(model_project.authors)],
-                owner=[Person.from_kg_object(p, client) for p in as_list(model_project.owners)],
+                author=[
+                    Person.from_kg_object(resolved.lookup(p), None)
+                    for p in as_list(model_project.authors)
+                ],
+                owner=[
+                    Person.from_kg_object(resolved.lookup(p), None)
+                    for p in as_list(model_project.owners)
+                ],
                 project_id=model_project.collab_id,
-                organization=model_project.organization.resolve(client, api="nexus").name
+                organization=resolved.lookup(model_project.organization).name
                 if model_project.organization
                 else None,
                 private=model_project.private,
@@ -439,6 +496,107 @@ class ScientificModel(BaseModel):
         return kg_objects
 
 
+class Summary(BaseModel):
+    """
+    Base class for lightweight representations of KG objects, for use in listings.
+
+    Only the requested fields are filled in, so that linked objects are only
+    retrieved when they are needed.
+    """
+
+    default_fields: ClassVar[List[str]] = []
+
+    @classmethod
+    def select_fields(cls, fields):
+        """Check the fields requested by a client, returning the default fields if none were given"""
+        if not fields:
+            return set(cls.default_fields)
+        unknown_fields = set(fields).difference(cls.__fields__)
+        if unknown_fields:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Unknown field(s): {', '.join(sorted(unknown_fields))}. "
+                f"Valid fields are: {', '.join(cls.__fields__)}",
+            )
+        return set(fields)
+
+
+class ScientificModelSummary(Summary):
+    id: UUID = None
+    uri: HttpUrl = None
+    name: str = None
+    alias: str = None
+    author: List[Person] = None
+    owner: List[Person] = None
+    project_id: str = None
+    organization: str = None
+    private: bool = None
+    cell_type: CellType = None
+    model_scope: ModelScope = None
+    abstraction_level: AbstractionLevel = None
+    brain_region: BrainRegion = None
+    species: Species = None
+    description: str = None
+    date_created: datetime = None
+    instance_count: int = None
+
+    default_fields: ClassVar[List[str]] = [
+        "id", "uri", "name", "alias", "author", "project_id", "private", "cell_type",
+        "model_scope", "abstraction_level", "brain_region", "species", "date_created",
+        "instance_count",
+    ]
+
+    @classmethod
+    def from_kg_objects(cls, model_projects, client, fields):
+        """
+        Convert a list of model projects, without retrieving their instances.
+        Authors, owners and organizations are only retrieved if those fields are requested.
+        """
+        linked_attrs = {"author": "authors", "owner": "owners", "organization": "organization"}
+        resolved = resolve_many(
+            chain.from_iterable(
+                as_list(getattr(model_project, attr_name))
+                for model_project in model_projects
+                for field_name, attr_name in linked_attrs.items()
+                if field_name in fields
+            ),
+            client,
+        )
+        return [cls._from_resolved(model_project, resolved, fields) for model_project in model_projects]
+
+    @classmethod
+    def _from_resolved(cls, model_project, resolved, fields):
+        data = dict(
+            id=model_project.uuid,
+            uri=model_project.id,
+            name=model_project.name,
+            alias=model_project.alias,
+            project_id=model_project.collab_id,
+            private=model_project.private,
+            cell_type=model_project.celltype.label if model_project.celltype else None,
+            model_scope=model_project.model_of.label if model_project.model_of else None,
+            abstraction_level=model_project.abstraction_level.label
+            if model_project.abstraction_level
+            else None,
+            brain_region=model_project.brain_region.label if model_project.brain_region else None,
+            species=model_project.species.label if model_project.species else None,
+            description=model_project.description,
+            date_created=model_project.date_created,
+            instance_count=len(as_list(model_project.instances)),
+        )
+        if "author" in fields:
+            data["author"] = [
+                Person.from_kg_object(resolved.lookup(p), None) for p in as_list(model_project.authors)
+            ]
+        if "owner" in fields:
+            data["owner"] = [
+                Person.from_kg_object(resolved.lookup(p), None) for p in as_list(model_project.owners)
+            ]
+        if "organization" in fields and model_project.organization:
+            data["organization"] = resolved.lookup(model_project.organization).name
+        return cls(**{key: value for key, value in data.items() if key in fields})
+
+
 class ScientificModelPatch(BaseModel):
     id: UUID = None
     uri: HttpUrl = None
@@ -564,15 +722,39 @@ class ValidationTest(BaseModel):
 
     @classmethod
     def from_kg_object(cls, test_definition, client, recently_saved_scripts=[]):
+        return cls.from_kg_objects([test_definition], client, recently_saved_scripts)[0]
+
+    @classmethod
+    def from_kg_objects(cls, test_definitions, client, recently_saved_scripts=[]):
+        """
+        Convert a list of test definitions, retrieving their scripts, authors and
+        reference data concurrently across all the tests.
+        """
+        scripts = map_concurrently(
+            lambda test_definition: test_definition.scripts.resolve(client, api="nexus"),
+            test_definitions,
+        )
+        resolved = resolve_many(
+            chain.from_iterable(
+                as_list(test_definition.authors) + as_list(test_definition.reference_data)
+                for test_definition in test_definitions
+            ),
+            client,
+        )
+        return [
+            cls._from_resolved(test_definition, as_list(test_scripts), resolved, recently_saved_scripts)
+            for test_definition, test_scripts in zip(test_definitions, scripts)
+        ]
+
+    @classmethod
+    def _from_resolved(cls, test_definition, test_scripts, resolved, recently_saved_scripts):
         # due to the time it takes for Nexus to become consistent, we add newly saved scripts
         # to the result of the KG query in case they are not yet included
-        scripts = {
-            scr.id: scr for scr in as_list(test_definition.scripts.resolve(client, api="nexus"))
-        }
+        scripts = {scr.id: scr for scr in test_scripts}
         for script in recently_saved_scripts:
             scripts[id] = script
         instances = [
-            ValidationTestInstance.from_kg_object(inst, client) for inst in scripts.values()
+            ValidationTestInstance.from_kg_object(inst, None) for inst in scripts.values()
         ]
         obj = cls(
             id=test_definition.uuid,
@@ -580,7 +762,10 @@ class ValidationTest(BaseModel):
             name=test_definition.name,
             alias=test_definition.alias,
             implementation_status=test_definition.status or ImplementationStatus.proposal.value,
-            author=[Person.from_kg_object(p, client) for p in as_list(test_definition.authors)],
+            author=[
+                Person.from_kg_object(resolved.lookup(p), None)
+                for p in as_list(test_definition.authors)
+            ],
             cell_type=test_definition.celltype.label if test_definition.celltype else None,
             brain_region=test_definition.brain_region.label
             if test_definition.brain_region
@@ -590,7 +775,7 @@ class ValidationTest(BaseModel):
             date_created=test_definition.date_created,
             old_uuid=test_definition.old_uuid,
             data_location=[
-                item.resolve(client, api="nexus").result_file.location
+                resolved.lookup(item).result_file.location
                 for item in as_list(test_definition.reference_data)
             ],
             data_type=test_definition.data_type,
@@ -645,6 +830,92 @@ class ValidationTest(BaseModel):
         return kg_objects
 
 
+class ValidationTestSummary(Summary):
+    id: UUID = None
+    uri: HttpUrl = None
+    name: str = None
+    alias: str = None
+    implementation_status: ImplementationStatus = None
+    author: List[Person] = None
+    cell_type: CellType = None
+    brain_region: BrainRegion = None
+    species: Species = None
+    description: str = None
+    date_created: datetime = None
+    data_location: List[HttpUrl] = None
+    data_type: str = None
+    recording_modality: RecordingModality = None
+    test_type: ValidationTestType = None
+    score_type: ScoreType = None
+    instance_count: int = None
+
+    default_fields: ClassVar[List[str]] = [
+        "id", "uri", "name", "alias", "implementation_status", "author", "cell_type",
+        "brain_region", "species", "date_created", "data_type", "recording_modality",
+        "test_type", "score_type",
+    ]
+
+    @classmethod
+    def from_kg_objects(cls, test_definitions, client, fields):
+        """
+        Convert a list of test definitions, retrieving only what is needed for the requested fields.
+        Counting instances requires a query per test, so `instance_count` is not a default field.
+        """
+        if "instance_count" in fields:
+            instance_counts = map_concurrently(
+                lambda test_definition: len(
+                    as_list(test_definition.scripts.resolve(client, api="nexus"))
+                ),
+                test_definitions,
+            )
+        else:
+            instance_counts = [None] * len(test_definitions)
+        linked_objects = []
+        for test_definition in test_definitions:
+            if "author" in fields:
+                linked_objects.extend(as_list(test_definition.authors))
+            if "data_location" in fields:
+                linked_objects.extend(as_list(test_definition.reference_data))
+        resolved = resolve_many(linked_objects, client)
+        return [
+            cls._from_resolved(test_definition, instance_count, resolved, fields)
+            for test_definition, instance_count in zip(test_definitions, instance_counts)
+        ]
+
+    @classmethod
+    def _from_resolved(cls, test_definition, instance_count, resolved, fields):
+        data = dict(
+            id=test_definition.uuid,
+            uri=test_definition.id,
+            name=test_definition.name,
+            alias=test_definition.alias,
+            implementation_status=test_definition.status or ImplementationStatus.proposal.value,
+            cell_type=test_definition.celltype.label if test_definition.celltype else None,
+            brain_region=test_definition.brain_region.label
+            if test_definition.brain_region
+            else None,
+            species=test_definition.species.label if test_definition.species else None,
+            description=test_definition.description,
+            date_created=test_definition.date_created,
+            data_type=test_definition.data_type,
+            recording_modality=test_definition.recording_modality or None,
+            test_type=test_definition.test_type or None,
+            score_type=test_definition.score_type or None,
+            instance_count=instance_count,
+        )
+        if "author" in fields:
+            data["author"] = [
+                Person.from_kg_object(resolved.lookup(p), None)
+                for p in as_list(test_definition.authors)
+            ]
+        if "data_location" in fields:
+            data["data_location"] = [
+                resolved.lookup(item).result_file.location
+                for item in as_list(test_definition.reference_data)
+            ]
+        return cls(**{key: value for key, value in data.items() if key in fields})
+
+
 class ValidationTestPatch(BaseModel):
     id: UUID = None
     uri: HttpUrl = None
@@ -692,12 +963,12 @@ class ValidationTestPatch(BaseModel):
 # note: the following function was essentially copied from resources/models.py
 # todo: refactor to eliminate this duplication
 def _get_model_instance_by_id_no_access_check(instance_id, kg_client):
-    model_instance = fairgraph.brainsimulation.ModelInstance.from_uuid(
-        str(instance_id), kg_client, api="nexus"
+    model_instance = get_by_uuid(
+        fairgraph.brainsimulation.ModelInstance, str(instance_id), kg_client
     )
     if model_instance is None:
-        model_instance = fairgraph.brainsimulation.MEModel.from_uuid(
-            str(instance_id), kg_client, api="nexus"
+        model_instance = get_by_uuid(
+            fairgraph.brainsimulation.MEModel, str(instance_id), kg_client
         )
     if model_instance is None:
         raise HTTPException(
@@ -707,6 +978,18 @@ def _get_model_instance_by_id_no_access_check(instance_id, kg_client):
     return model_instance
 
 
+def _get_test_script_and_definition(test_instance_id, kg_client):
+    test_code = get_by_uuid(
+        fairgraph.brainsimulation.ValidationScript, str(test_instance_id), kg_client
+    )
+    if test_code is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Test instance with ID '{test_instance_id}' not found.",
+        )
+    return test_code, resolve(test_code.test_definition, kg_client)
+
+
 class ConsistencyError(Exception):
     pass
 
@@ -836,7 +1119,7 @@ class ValidationResult(BaseModel):
     @classmethod
     def from_kg_object(cls, result, client):
         if result.generated_by:
-            validation_activity = result.generated_by.resolve(client, api="nexus")
+            validation_activity = resolve(result.generated_by, client)
         else:
             raise ConsistencyError("Missing ValidationActivity")
         if validation_activity is None:
@@ -847,7 +1130,7 @@ class ValidationResult(BaseModel):
         logger.debug("Additional data for {}:\n{}".format(result.id, result.additional_data))
         additional_data = []
         for item in as_list(result.additional_data):
-            item = item.resolve(client, api="nexus")
+            item = resolve(item, client)
             if item:
                 additional_data.append(File.from_kg_object(item.result_file))
             else:
@@ -873,6 +1156,8 @@ class ValidationResult(BaseModel):
             additional_data.append(
                 File.from_kg_query(item)
             )
+        if not (result["model_instance"] and result["test_instance"]):
+            raise ConsistencyError(f"Missing model or test instance for result {result['uri']}")
         return cls(
             id=uuid_from_uri(result["uri"]),
             uri=result["uri"],
@@ -887,7 +1172,11 @@ class ValidationResult(BaseModel):
             normalized_score=result["normalized_score"],
         )
 
-    def to_kg_objects(self, kg_client):
+    def to_kg_objects(self, kg_client, test_code=None, test_definition=None, model_instance=None):
+        """
+        The test script, test definition and model instance may be given if they have
+        already been retrieved, otherwise they are looked up in the KG.
+        """
         timestamp = ensure_has_timezone(self.timestamp) or datetime.now(timezone.utc)
 
         additional_data = [
@@ -900,20 +1189,32 @@ class ValidationResult(BaseModel):
         ]
         kg_objects = additional_data[:]
 
-        test_code = fairgraph.brainsimulation.ValidationScript.from_id(
-            str(self.test_instance_id), kg_client, api="nexus"
-        )
-        test_definition = test_code.test_definition.resolve(kg_client, api="nexus")
-        model_instance = _get_model_instance_by_id_no_access_check(self.model_instance_id, kg_client)
+        if test_code is None:
+            test_code, test_definition = _get_test_script_and_definition(
+                self.test_instance_id, kg_client
+            )
+        if model_instance is None:
+            model_instance = _get_model_instance_by_id_no_access_check(
+                self.model_instance_id, kg_client
+            )
         reference_data = fairgraph.core.Collection(
             f"Reference data for {test_definition.name}",
             members=as_list(test_definition.reference_data),
         )
         kg_objects.append(reference_data)
 
+        # The activity and the result link to each other, so the activity is saved
+        # without its link to the result, which is added once the result exists
+        # (see `_save_result()` in resources/results.py).
+        activity = fairgraph.brainsimulation.ValidationActivity(
+            model_instance=model_instance,
+            test_script=test_code,
+            reference_data=reference_data,
+            timestamp=timestamp,
+        )
         result = fairgraph.brainsimulation.ValidationResult(
             name=f"Validation results for model {self.model_instance_id} and test {self.test_instance_id} with timestamp {timestamp.isoformat()}",
-            generated_by=None,
+            generated_by=activity,
             description=None,
             score=self.score,
             normalized_score=self.normalized_score,
@@ -922,19 +1223,68 @@ class ValidationResult(BaseModel):
             additional_data=additional_data,
             collab_id=self.project_id,
         )
-
-        activity = fairgraph.brainsimulation.ValidationActivity(
-            model_instance=model_instance,
-            test_script=test_code,
-            reference_data=reference_data,
-            timestamp=timestamp,
-            result=result,
-        )
-        kg_objects.append(result)
         kg_objects.append(activity)
+        kg_objects.append(result)
         return kg_objects
 
 
+class ValidationResultStatus(BaseModel):
+    """Outcome of storing one of a batch of validation results"""
+    index: int
+    status_code: int
+    result: ValidationResult = None
+    detail: str = None
+
+
+class IngestionJob(BaseModel):
+    """Status of a submission queued for storage in the KG"""
+    id: UUID
+    idempotency_key: str
+    kind: str
+    status: str
+    attempts: int
+    created: datetime
+    updated: datetime
+    object_id: UUID = None
+    error: str = None
+
+
+class ScoreMatrix(BaseModel):
+    """
+    Scores of model instances (rows) against test instances (columns).
+    Only the cells with results are listed, each given by its `row` and `column`
+    (indices into the lists of instance IDs) and its statistics.
+    """
+    model_instance_id: List[UUID]
+    model_id: List[Optional[UUID]]
+    test_instance_id: List[UUID]
+    test_id: List[Optional[UUID]]
+    row: List[int]
+    column: List[int]
+    count: List[int] = None
+    mean: List[Optional[float]] = None
+    latest: List[Optional[float]] = None
+    latest_timestamp: List[Optional[float]] = None  # seconds since the epoch
+    best: List[Optional[float]] = None
+
+
+
+class ScoreStatistics(BaseModel):
+    """
+    Statistics of the scores of groups of results, in columnar form (one entry per group).
+    There is also a column "p<q>" for each percentile q requested, e.g. "p50" for the median.
+    """
+    group: List[Optional[str]]
+    count: List[int]
+    mean: List[Optional[float]]
+    std: List[Optional[float]]
+    min: List[Optional[float]]
+    max: List[Optional[float]]
+    pass_rate: List[Optional[float]]
+
+    class Config:
+        extra = "allow"
+
 class ValidationResultWithTestAndModel(ValidationResult):
     model_instance: ModelInstance
     test_instance: ValidationTestInstance
@@ -943,37 +1293,105 @@ class ValidationResultWithTestAndModel(ValidationResult):
 
     @classmethod
     async def from_kg_object(cls, result, client, token):
-        vr = ValidationResult.from_kg_object(result, client)
-
-        model_instance_kg, model_id = await _get_model_instance_by_id(vr.model_instance_id, token)
-        model_project = await _get_model_by_id_or_alias(model_id, token)
+        vr = await kg_call(ValidationResult.from_kg_object, result, client)
+        return (await cls.from_validation_results([vr], client, token))[0]
 
-        model_instance = ModelInstance.from_kg_object(model_instance_kg, client, model_project.uuid)
-        model = ScientificModel.from_kg_object(model_project, client)
+    @classmethod
+    async def from_kg_objects(cls, results, client, token):
+        """
+        Convert a list of KG results. Results which cannot be converted
+        due to inconsistencies in the KG are omitted.
+        """
+        objects = await asyncio.gather(
+            *(kg_call(ValidationResult.from_kg_object, result, client) for result in results),
+            return_exceptions=True
+        )
+        validation_results = []
+        for obj in objects:
+            if isinstance(obj, ConsistencyError):  # todo: count these and report them in the response
+                logger.warning(str(obj))
+            elif isinstance(obj, Exception):
+                raise obj
+            else:
+                validation_results.append(obj)
+        return await cls.from_validation_results(validation_results, client, token)
 
-        test_script = _get_test_instance_by_id(vr.test_instance_id, token)
-        test_definition = _get_test_by_id_or_alias(test_script.test_definition.uuid, token)
+    @classmethod
+    async def from_validation_results(cls, validation_results, client, token):
+        """
+        Add the models and tests to a list of validation results.
+
+        Many results usually share the same model or test, so each distinct model and test
+        is retrieved, access-checked and converted only once, concurrently.
+        """
+        model_instance_ids = list(set(vr.model_instance_id for vr in validation_results))
+        test_instance_ids = list(set(vr.test_instance_id for vr in validation_results))
+        model_instances_and_projects, test_scripts = await asyncio.gather(
+            asyncio.gather(*(_get_model_instance_and_project(id) for id in model_instance_ids)),
+            asyncio.gather(*(_get_test_instance_by_id(id, token) for id in test_instance_ids)),
+        )
 
-        test_instance = ValidationTestInstance.from_kg_object(test_script, token)
-        test = ValidationTest.from_kg_object(test_definition, client)
+        model_projects = {}
+        for model_instance_kg, model_project in model_instances_and_projects:
+            model_projects.setdefault(model_project.uuid, model_project)
+        await asyncio.gather(
+            *(_check_model_access(model_project, token) for model_project in model_projects.values())
+        )
+        test_definition_ids = set(test_script.test_definition.uuid for test_script in test_scripts)
+        test_definitions = await asyncio.gather(
+            *(_get_test_by_id_or_alias(id, token) for id in test_definition_ids)
+        )
 
-        return cls(
-            id=vr.id,
-            uri=vr.uri,
-            old_uuid=vr.old_uuid,
-            model_instance_id=vr.model_instance_id,
-            test_instance_id=vr.test_instance_id,
-            results_storage=vr.results_storage,
-            score=vr.score,
-            passed=vr.passed,
-            timestamp=vr.timestamp,
-            project_id=vr.project_id,
-            normalized_score=vr.normalized_score,
-            model_instance=model_instance,
-            test_instance=test_instance,
-            model=model,
-            test=test
+        models, model_instances, tests = await asyncio.gather(
+            kg_call(ScientificModel.from_kg_objects, list(model_projects.values()), client),
+            asyncio.gather(
+                *(
+                    kg_call(ModelInstance.from_kg_object, model_instance_kg, client, model_project.uuid)
+                    for model_instance_kg, model_project in model_instances_and_projects
+                )
+            ),
+            kg_call(ValidationTest.from_kg_objects, test_definitions, client),
         )
+        models = {str(model.id): model for model in models}
+        tests = {str(test.id): test for test in tests}
+        model_instances = {
+            model_instance_id: (model_instance, models[model_project.uuid])
+            for model_instance_id, model_instance, (_, model_project) in zip(
+                model_instance_ids, model_instances, model_instances_and_projects
+            )
+        }
+        test_instances = {
+            test_instance_id: (
+                ValidationTestInstance.from_kg_object(test_script, client),
+                tests[test_script.test_definition.uuid],
+            )
+            for test_instance_id, test_script in zip(test_instance_ids, test_scripts)
+        }
+
+        objects = []
+        for vr in validation_results:
+            model_instance, model = model_instances[vr.model_instance_id]
+            test_instance, test = test_instances[vr.test_instance_id]
+            objects.append(
+                cls(
+                    id=vr.id,
+                    uri=vr.uri,
+                    old_uuid=vr.old_uuid,
+                    model_instance_id=vr.model_instance_id,
+                    test_instance_id=vr.test_instance_id,
+                    results_storage=vr.results_storage,
+                    score=vr.score,
+                    passed=vr.passed,
+                    timestamp=vr.timestamp,
+                    project_id=vr.project_id,
+                    normalized_score=vr.normalized_score,
+                    model_instance=model_instance,
+                    test_instance=test_instance,
+                    model=model,
+                    test=test
+                )
+            )
+        return objects
 
 
 class SoftwareDependency(BaseModel):
@@ -989,10 +1407,10 @@ class ComputingEnvironment(BaseModel):
 
     @classmethod
     def from_kg_object(cls, env_obj, kg_client):
-        hardware_obj = env_obj.hardware.resolve(kg_client, api="nexus")
+        hardware_obj = resolve(env_obj.hardware, kg_client)
         dependencies = []
         for dep in as_list(env_obj.software):
-            dep = dep.resolve(kg_client, api="nexus")
+            dep = resolve(dep, kg_client)
             dependencies.append(
                 SoftwareDependency(name=dep.name, version=dep.version)
             )
@@ -1042,9 +1460,9 @@ class Simulation(BaseModel):
     environment: ComputingEnvironment = None
     started_by: Person = None
 
-    def _get_person(self, kg_client, token):
+    async def _get_person(self, kg_client, token):
         if self.started_by is None:
-            user_info = get_user_from_token(token.credentials)
+            user_info = await get_user_from_token(token.credentials)
             family_name = user_info["family_name"]
             given_name = user_info["given_name"]
         else:
@@ -1055,9 +1473,9 @@ class Simulation(BaseModel):
 
     @classmethod
     def from_kg_object(cls, sim_activity, kg_client):
-        outputs = [output.resolve(kg_client, api="nexus")
+        outputs = [resolve(output, kg_client)
                    for output in as_list(sim_activity.result)]
-        config_obj = sim_activity.config.resolve(kg_client, api="nexus")
+        config_obj = resolve(sim_activity.config, kg_client)
         if config_obj and config_obj.config_file:
             config = kg_client._nexus_client._http_client.get(config_obj.config_file.location)
         else:
@@ -1068,7 +1486,7 @@ class Simulation(BaseModel):
                     "msg": f"Unable to retrieve config. config_obj={config_obj} config_file={config_obj.config_file.location}"
                 }
             }
-        env_obj = sim_activity.computing_environment.resolve(kg_client, api="nexus")
+        env_obj = resolve(sim_activity.computing_environment, kg_client)
         if env_obj:
             env = ComputingEnvironment.from_kg_object(env_obj, kg_client)
         else:
@@ -1086,11 +1504,25 @@ class Simulation(BaseModel):
             started_by=Person.from_kg_object(sim_activity.started_by, kg_client)
         )
 
-    def to_kg_objects(self, kg_client, token):
+    async def prepare_for_queue(self, token):
+        """
+        Fill in the information which needs the user's access token,
+        so that the simulation can be stored later, without it.
+        """
+        if self.started_by is None:
+            user_info = await get_user_from_token(token.credentials)
+            self.started_by = Person(
+                given_name=user_info["given_name"], family_name=user_info["family_name"]
+            )
+        for output_file in self.outputs:
+            if output_file.download_url is None and output_file.file_store == "drive":
+                output_file.download_url = await kg_call(output_file.get_share_link, token)
+
+    async def to_kg_objects(self, kg_client, token):
         kg_objects ={}
 
         # get person who launched this simulation
-        person = self._get_person(kg_client, token)
+        person = await self._get_person(kg_client, token)
         kg_objects['person'] = [person]
 
         # get timestamps
@@ -1099,7 +1531,10 @@ class Simulation(BaseModel):
 
         # check if sim config already exists
         config_identifier = hashlib.sha1(json.dumps(self.configuration).encode("utf-8")).hexdigest()
-        sim_config = fairgraph.brainsimulation.SimulationConfiguration.by_name(config_identifier, kg_client, api="nexus")
+        sim_config = await kg_call(
+            fairgraph.brainsimulation.SimulationConfiguration.by_name,
+            config_identifier, kg_client, api="nexus"
+        )
         if not sim_config:
             tmp_config_file = tempfile.NamedTemporaryFile(mode="w", encoding="utf-8", delete=False)
             json.dump(self.configuration, tmp_config_file)
@@ -1114,7 +1549,10 @@ class Simulation(BaseModel):
         kg_objects['config'] = [sim_config]
 
         # get model instance
-        model_instance = fairgraph.brainsimulation.ModelInstance.from_id(str(self.model_instance_id), kg_client, api="nexus")
+        model_instance = await kg_call(
+            fairgraph.brainsimulation.ModelInstance.from_id,
+            str(self.model_instance_id), kg_client, api="nexus"
+        )
 
         sim_outputs = []
         n = len(self.outputs)
@@ -1128,7 +1566,7 @@ class Simulation(BaseModel):
             sim_output = fairgraph.brainsimulation.SimulationOutput(
                 name=f"Output {i}/{n} from simulation of model instance {model_instance.uuid} with config {sim_config.name} at {start_timestamp}",
                 identifier=output_identifier,
-                result_file=output_file.to_kg_object(token),
+                result_file=await kg_call(output_file.to_kg_object, token),
                 generated_by=None,  # to be added after saving
                 derived_from=model_instance,
                 #data_type=None,
@@ -1153,7 +1591,9 @@ class Simulation(BaseModel):
             #name=
             description=self.description,
             #identifier=
-            model_instance=_get_model_instance_by_id_no_access_check(self.model_instance_id, kg_client),
+            model_instance=await kg_call(
+                _get_model_instance_by_id_no_access_check, self.model_instance_id, kg_client
+            ),
             config=sim_config,
             timestamp=start_timestamp,
             result=sim_outputs,
@@ -3,83 +3,145 @@ Functions relating to database (Knowledge Graph) access
 """
 
 
+import asyncio
 from uuid import UUID
-from time import sleep
+from time import monotonic
 from fastapi import HTTPException, status
+from fairgraph.base import as_list
 from fairgraph.brainsimulation import (
     ModelProject, ModelInstance, MEModel,
     ValidationTestDefinition, ValidationScript)
 from .auth import get_kg_client, get_user_from_token, is_collab_member, is_admin
+from .kg_executor import kg_call
+from .kg_resolver import resolve, get_by_uuid
+from .cache import TTLCache
+from .aliases import model_aliases, test_aliases, get_by_alias
+from . import metrics
 
 
-RETRY_INTERVAL = 60  # seconds
+RETRY_INITIAL_INTERVAL = 0.5  # seconds, doubled after each attempt
+RETRY_MAX_INTERVAL = 8  # seconds
+RETRY_DEADLINE = 30  # seconds
+
+# Projects saved by this service, indexed by the URIs of their instances.
+# Queries for the project containing an instance may not see recent changes until
+# the KG has become consistent, so we look here first ("read-your-writes").
+recently_saved_projects = TTLCache("recently_saved_projects", maxsize=1000, ttl=300)
 
 kg_client = get_kg_client()
 
 
 async def _check_model_access(model_project, token):
-    if model_project.private:
+    await _check_project_access(model_project.private, model_project.collab_id, token)
+
+
+async def _check_project_access(private, collab_id, token):
+    if private:
         if not (
-            await is_collab_member(model_project.collab_id, token.credentials)
+            await is_collab_member(collab_id, token.credentials)
             or await is_admin(token.credentials)
         ):
             raise HTTPException(
                 status_code=status.HTTP_403_FORBIDDEN,
-                detail=f"Access to this model is restricted to members of Collab #{model_project.collab_id}",
+                detail=f"Access to this model is restricted to members of Collab #{collab_id}",
             )
 
 
 async def _get_model_by_id_or_alias(model_id, token):
     try:
         model_id = UUID(model_id)
-        model_project = ModelProject.from_uuid(str(model_id), kg_client, api="nexus")
+        model_project = await kg_call(get_by_uuid, ModelProject, str(model_id), kg_client)
     except ValueError:
         model_alias = str(model_id)
-        model_project = ModelProject.from_alias(model_alias, kg_client, api="nexus")
+        model_project = await get_by_alias(model_aliases, model_alias)
     if not model_project:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f"Model with ID or alias '{model_id}' not found.",
         )
+    if isinstance(model_project, list):
+        # this could happen if a duplicate alias has sneaked through
+        raise Exception(
+            f"Found multiple models (n={len(model_project)}) with id/alias '{model_id}'"
+        )
     # todo: fairgraph should accept UUID object as well as str
     await _check_model_access(model_project, token)
     return model_project
 
 
 async def _get_model_instance_by_id(instance_id, token):
-    model_instance = ModelInstance.from_uuid(str(instance_id), kg_client, api="nexus")
+    model_instance, model_project = await _get_model_instance_and_project(instance_id)
+    await _check_model_access(model_project, token)
+    return model_instance, model_project.uuid
+
+
+async def _get_model_instance_and_project(instance_id):
+    """Return a model instance and its parent project, without checking access permissions"""
+    model_instance = await kg_call(get_by_uuid, ModelInstance, str(instance_id), kg_client)
     if model_instance is None:
-        model_instance = MEModel.from_uuid(str(instance_id), kg_client, api="nexus")
+        model_instance = await kg_call(get_by_uuid, MEModel, str(instance_id), kg_client)
     if model_instance is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f"Model instance with ID '{instance_id}' not found.",
         )
 
-    model_project = model_instance.project.resolve(kg_client, api="nexus")
+    model_project = recently_saved_projects.get(model_instance.id)
+    if model_project is None:
+        model_project = await _get_parent_project(model_instance)
     if not model_project:
-        # we could get an empty response if the model_project has just been
-        # updated and the KG is not consistent, so we wait and try again
-        sleep(RETRY_INTERVAL)
-        model_project = model_instance.project.resolve(kg_client, api="nexus")
-        if not model_project:
-            # in case of a dangling model instance, where the parent model_project
-            # has been deleted but the instance wasn't
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail=f"Model instance with ID '{instance_id}' no longer exists.",
-            )
-    await _check_model_access(model_project, token)
-    return model_instance, model_project.uuid
+        # in case of a dangling model instance, where the parent model_project
+        # has been deleted but the instance wasn't
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Model instance with ID '{instance_id}' no longer exists.",
+        )
+    return model_instance, model_project
+
+
+async def _get_parent_project(model_instance):
+    model_project = await kg_call(model_instance.project.resolve, kg_client, api="nexus")
+    if model_project:
+        return model_project
+    # we could get an empty response if the model_project has just been
+    # updated and the KG is not consistent, so we wait and try again,
+    # backing off exponentially until the deadline
+    started_at = monotonic()
+    interval = RETRY_INITIAL_INTERVAL
+    try:
+        while not model_project and monotonic() - started_at + interval <= RETRY_DEADLINE:
+            await asyncio.sleep(interval)
+            metrics.increment("db.parent_project_retries")
+            model_project = await kg_call(model_instance.project.resolve, kg_client, api="nexus")
+            interval = min(2 * interval, RETRY_MAX_INTERVAL)
+    finally:
+        metrics.observe("db.parent_project_retry_time", monotonic() - started_at)
+    return model_project
+
+
+def remember_saved_project(model_project):
+    """
+    Record a model project which has just been saved,
+    so that its instances can be found before the KG has become consistent.
+    """
+    for instance in as_list(model_project.instances):
+        recently_saved_projects.set(instance.id, model_project)
 
 
-def _get_test_by_id_or_alias(test_id, token):
+def forget_saved_project(model_project):
+    for instance in as_list(model_project.instances):
+        recently_saved_projects.invalidate(instance.id)
+
+
+async def _get_test_by_id_or_alias(test_id, token):
     try:
         test_id = UUID(test_id)
-        test_definition = ValidationTestDefinition.from_uuid(str(test_id), kg_client, api="nexus")
+        test_definition = await kg_call(
+            get_by_uuid, ValidationTestDefinition, str(test_id), kg_client
+        )
     except ValueError:
         test_alias = test_id
-        test_definition = ValidationTestDefinition.from_alias(test_alias, kg_client, api="nexus")
+        test_definition = await get_by_alias(test_aliases, test_alias)
     if not test_definition:  # None or empty list
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -94,15 +156,15 @@ def _get_test_by_id_or_alias(test_id, token):
     return test_definition
 
 
-def _get_test_instance_by_id(instance_id, token):
-    test_instance = ValidationScript.from_uuid(str(instance_id), kg_client, api="nexus")
+async def _get_test_instance_by_id(instance_id, token):
+    test_instance = await kg_call(get_by_uuid, ValidationScript, str(instance_id), kg_client)
     if test_instance is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f"Test instance with ID '{instance_id}' not found.",
         )
 
-    test_definition = test_instance.test_definition.resolve(kg_client, api="nexus")
+    test_definition = await kg_call(resolve, test_instance.test_definition, kg_client)
     # todo: in case of a dangling test instance, where the parent test_definition
     #       has been deleted but the instance wasn't, we could get a None here
     #       which we need to deal with
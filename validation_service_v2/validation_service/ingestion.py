@@ -0,0 +1,369 @@
+"""
+Background storage of validation results and simulations in the Knowledge Graph.
+
+Writing to the KG can be slow, and clients which time out and retry end up creating
+duplicate results. Instead, a client can ask for a submission to be queued:
+it is validated, stored in a local SQLite database together with its idempotency key,
+and stored in the KG later by worker tasks, which retry on failure.
+Submitting again with the same idempotency key returns the existing job.
+
+Jobs are claimed with a lease, so that several service processes may share the same queue,
+and a job whose worker died is picked up again once its lease has expired. The lease is
+renewed while the job is being stored.
+
+Storing a submission takes several KG writes. Handlers record each completed write in the
+job's progress (`JobProgress`), so that a job which is retried, after an error or by another
+worker, resumes where it stopped rather than storing a second copy of the submission.
+Since another process may hold the database lock, the queue is only accessed
+from worker threads (`_run()`), never directly from the event loop.
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import uuid
+from datetime import datetime, timezone
+from time import time
+
+from fastapi import HTTPException, status
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+from . import settings, metrics
+from .kg_executor import kg_call
+from .kg_resolver import save_object
+
+
+logger = logging.getLogger("validation_service_v2")
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+# kind -> coroutine function taking the payload and the job progress, returning the UUID of the stored object
+_handlers = {}
+
+_schema = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    idempotency_key TEXT NOT NULL UNIQUE,
+    kind TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    payload_hash TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    created REAL NOT NULL,
+    updated REAL NOT NULL,
+    next_attempt REAL NOT NULL,
+    object_id TEXT,
+    error TEXT,
+    progress TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_pending ON jobs (status, next_attempt);
+"""
+
+
+def register_handler(kind, handler):
+    """Register the coroutine function which stores a submission of the given kind in the KG"""
+    _handlers[kind] = handler
+
+
+class IngestionQueue:
+    """Durable queue of submissions waiting to be stored in the KG"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._connection.row_factory = sqlite3.Row
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.executescript(_schema)
+        columns = [row["name"] for row in self._connection.execute("PRAGMA table_info(jobs)")]
+        if "progress" not in columns:  # queue created by an earlier version
+            self._connection.execute("ALTER TABLE jobs ADD COLUMN progress TEXT")
+
+    def _execute(self, sql, *args):
+        with self._lock:
+            return self._connection.execute(sql, args).fetchall()
+
+    def enqueue(self, kind, payload, idempotency_key):
+        """
+        Add a submission to the queue, and return the job.
+
+        If a job with the same idempotency key already exists, it is returned instead,
+        unless it was for a different submission, which is an error.
+        """
+        payload_hash = hashlib.sha1(payload.encode("utf-8")).hexdigest()
+        now = time()
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR IGNORE INTO jobs (id, idempotency_key, kind, payload, payload_hash, "
+                "status, created, updated, next_attempt) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (str(uuid.uuid4()), idempotency_key, kind, payload, payload_hash, QUEUED, now, now, now)
+            )
+            job = self._connection.execute(
+                "SELECT * FROM jobs WHERE idempotency_key = ?", (idempotency_key,)
+            ).fetchone()
+        if job["kind"] != kind or job["payload_hash"] != payload_hash:
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail=f"Idempotency key '{idempotency_key}' has already been used for a different submission",
+            )
+        return job
+
+    def get(self, job_id):
+        jobs = self._execute("SELECT * FROM jobs WHERE id = ?", str(job_id))
+        return jobs[0] if jobs else None
+
+    def claim(self):
+        """
+        Return the oldest job which is ready to be stored, marking it as running
+        and counting the attempt, or None if there is no such job.
+        """
+        now = time()
+        with self._lock:
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                job = self._connection.execute(
+                    "SELECT * FROM jobs WHERE status IN (?, ?) AND next_attempt <= ? "
+                    "ORDER BY next_attempt LIMIT 1",
+                    (QUEUED, RUNNING, now)
+                ).fetchone()
+                if job is not None:
+                    # if the worker does not finish before the lease expires, the job is retried
+                    self._connection.execute(
+                        "UPDATE jobs SET status = ?, attempts = attempts + 1, updated = ?, next_attempt = ? "
+                        "WHERE id = ?",
+                        (RUNNING, now, now + settings.INGESTION_LEASE, job["id"])
+                    )
+                    job = self._connection.execute(
+                        "SELECT * FROM jobs WHERE id = ?", (job["id"],)
+                    ).fetchone()
+                self._connection.execute("COMMIT")
+            except Exception:
+                self._connection.execute("ROLLBACK")
+                raise
+        return job
+
+    def renew_lease(self, job_id):
+        now = time()
+        self._execute(
+            "UPDATE jobs SET updated = ?, next_attempt = ? WHERE id = ? AND status = ?",
+            now, now + settings.INGESTION_LEASE, job_id, RUNNING
+        )
+
+    def save_progress(self, job_id, progress):
+        self._execute(
+            "UPDATE jobs SET updated = ?, progress = ? WHERE id = ?",
+            time(), json.dumps(progress), job_id
+        )
+
+    def complete(self, job_id, object_id):
+        self._execute(
+            "UPDATE jobs SET status = ?, updated = ?, object_id = ?, error = NULL WHERE id = ?",
+            DONE, time(), str(object_id), job_id
+        )
+
+    def retry(self, job_id, error, delay):
+        now = time()
+        self._execute(
+            "UPDATE jobs SET status = ?, updated = ?, next_attempt = ?, error = ? WHERE id = ?",
+            QUEUED, now, now + delay, error, job_id
+        )
+
+    def fail(self, job_id, error):
+        self._execute(
+            "UPDATE jobs SET status = ?, updated = ?, error = ? WHERE id = ?",
+            FAILED, time(), error, job_id
+        )
+
+    def depth(self):
+        """Number of jobs not yet stored in the KG"""
+        return self._execute(
+            "SELECT COUNT(*) FROM jobs WHERE status IN (?, ?)", QUEUED, RUNNING
+        )[0][0]
+
+    def lag(self):
+        """Time in seconds since the oldest job not yet stored in the KG was submitted"""
+        oldest = self._execute(
+            "SELECT MIN(created) FROM jobs WHERE status IN (?, ?)", QUEUED, RUNNING
+        )[0][0]
+        return time() - oldest if oldest is not None else 0.0
+
+
+_queue = None
+_queue_lock = threading.Lock()
+_workers = []
+
+
+def get_queue():
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            _queue = IngestionQueue(settings.INGESTION_QUEUE_PATH)
+        return _queue
+
+
+async def _run(func, *args):
+    """Run a blocking queue operation outside the event loop"""
+    loop = asyncio.get_event_loop()
+    return await loop.run_in_executor(None, func, *args)
+
+
+def wants_async(prefer):
+    """Whether the client asked for the submission to be queued, given the Prefer header (RFC 7240)"""
+    return bool(settings.INGESTION_QUEUE_PATH) and bool(prefer) and "respond-async" in prefer
+
+
+async def accepted(kind, payload, idempotency_key=None):
+    """
+    Queue a submission for storage in the KG, and return a 202 response
+    whose Location header gives the URL for following the job.
+    """
+    job = await _run(get_queue().enqueue, kind, payload, idempotency_key or str(uuid.uuid4()))
+    return JSONResponse(
+        status_code=status.HTTP_202_ACCEPTED,
+        content=jsonable_encoder(job_status(job)),
+        headers={
+            "Location": f"/ingestion/jobs/{job['id']}",
+            "Idempotency-Key": job["idempotency_key"],
+            "Preference-Applied": "respond-async",
+        },
+    )
+
+
+def job_status(job):
+    """Describe a job, for the API"""
+    return {
+        "id": job["id"],
+        "idempotency_key": job["idempotency_key"],
+        "kind": job["kind"],
+        "status": job["status"],
+        "attempts": job["attempts"],
+        "created": datetime.fromtimestamp(job["created"], timezone.utc),
+        "updated": datetime.fromtimestamp(job["updated"], timezone.utc),
+        "object_id": job["object_id"],
+        "error": job["error"],
+    }
+
+
+class JobProgress(dict):
+    """
+    The steps already completed by previous attempts at a job, as a mapping from step name
+    to a JSON-serializable value (e.g. the URI of a saved KG object)
+    """
+
+    def __init__(self, queue, job):
+        super().__init__(json.loads(job["progress"] or "{}"))
+        self.queue = queue
+        self.job_id = job["id"]
+
+    async def record(self, step, value):
+        self[step] = value
+        await _run(self.queue.save_progress, self.job_id, dict(self))
+
+    async def started_at(self):
+        """
+        The time of the first attempt at the job, for use as the timestamp of a submission
+        which has none, so that a retried job creates its remaining objects with the same one
+        """
+        if "started_at" not in self:
+            await self.record("started_at", datetime.now(timezone.utc).isoformat())
+        return datetime.fromisoformat(self["started_at"])
+
+
+async def save_once(obj, client, progress, step):
+    """
+    Save a KG object, unless a previous attempt at the job has already saved it,
+    in which case the object is given the ID it was saved with.
+    Without job progress (`progress` is None), the object is always saved.
+    """
+    if progress is not None and step in progress:
+        obj.id = progress[step]
+        return
+    await kg_call(save_object, obj, client)
+    if progress is not None:
+        await progress.record(step, obj.id)
+
+
+async def _renew_lease(queue, job_id):
+    while True:
+        await asyncio.sleep(settings.INGESTION_LEASE / 3)
+        try:
+            await _run(queue.renew_lease, job_id)
+        except sqlite3.OperationalError as err:
+            logger.warning(f"Unable to renew the lease of ingestion job {job_id}: {err}")
+
+
+def _retry_delay(attempts):
+    return min(
+        settings.INGESTION_RETRY_BACKOFF * 2 ** (attempts - 1), settings.INGESTION_RETRY_BACKOFF_MAX
+    )
+
+
+async def _run_handler(queue, job):
+    """Store the submission of a job, renewing the job's lease until this has finished"""
+    renewal = asyncio.ensure_future(_renew_lease(queue, job["id"]))
+    try:
+        return await _handlers[job["kind"]](job["payload"], JobProgress(queue, job))
+    finally:
+        renewal.cancel()
+
+
+async def _process(queue, job):
+    try:
+        object_id = await _run_handler(queue, job)
+    except Exception as err:
+        if isinstance(err, HTTPException):
+            error = f"{err.status_code}: {err.detail}"
+            # client errors (e.g. a model instance which does not exist) will not go away on retrying
+            permanent = err.status_code < 500
+        else:
+            error = str(err) or err.__class__.__name__
+            permanent = False
+        if permanent or job["attempts"] >= settings.INGESTION_MAX_ATTEMPTS:
+            logger.error(f"Giving up on storing {job['kind']} for job {job['id']}: {error}")
+            await _run(queue.fail, job["id"], error)
+            metrics.increment("ingestion.failed")
+        else:
+            delay = _retry_delay(job["attempts"])
+            logger.warning(f"Unable to store {job['kind']} for job {job['id']}, retrying in {delay} s: {error}")
+            await _run(queue.retry, job["id"], error, delay)
+            metrics.increment("ingestion.retried")
+    else:
+        await _run(queue.complete, job["id"], object_id)
+        metrics.increment("ingestion.completed")
+        metrics.observe("ingestion.latency", time() - job["created"])
+
+
+async def _work(queue):
+    while True:
+        try:
+            job = await _run(queue.claim)
+        except sqlite3.OperationalError as err:  # e.g. database locked by another process
+            logger.warning(f"Unable to claim an ingestion job: {err}")
+            job = None
+        if job is None:
+            await asyncio.sleep(settings.INGESTION_POLL_INTERVAL)
+        else:
+            await _process(queue, job)
+
+
+def start_workers():
+    queue = get_queue()
+    metrics.register_gauge("ingestion.queue_depth", queue.depth)
+    metrics.register_gauge("ingestion.lag", queue.lag)
+    for i in range(settings.INGESTION_WORKERS):
+        _workers.append(asyncio.ensure_future(_work(queue)))
+
+
+async def stop_workers():
+    for worker in _workers:
+        worker.cancel()
+    await asyncio.gather(*_workers, return_exceptions=True)
+    _workers.clear()
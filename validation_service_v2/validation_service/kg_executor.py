@@ -0,0 +1,96 @@
+"""
+Execution of blocking Knowledge Graph calls outside the event loop.
+
+fairgraph (and the Nexus client it uses) is synchronous, so calling it directly from
+an `async` endpoint blocks every other request handled by the same worker.
+Use `kg_call()` to run such calls in a bounded thread pool.
+"""
+
+import asyncio
+import contextvars
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+
+from fastapi import HTTPException, status
+
+from . import settings, metrics
+
+
+logger = logging.getLogger("validation_service_v2")
+
+executor = ThreadPoolExecutor(
+    max_workers=settings.KG_THREAD_POOL_SIZE, thread_name_prefix="kg"
+)
+
+_lock = threading.Lock()
+_queued = 0
+_active = 0
+
+
+def _queue_depth():
+    return _queued
+
+
+def _active_calls():
+    return _active
+
+
+metrics.register_gauge("kg_executor.queue_depth", _queue_depth)
+metrics.register_gauge("kg_executor.active", _active_calls)
+metrics.register_gauge("kg_executor.max_workers", lambda: settings.KG_THREAD_POOL_SIZE)
+
+
+async def kg_call(func, *args, timeout=None, **kwargs):
+    """
+    Run `func(*args, **kwargs)` in the KG thread pool and wait for the result.
+
+    If the call takes longer than `timeout` seconds (default `KG_CALL_TIMEOUT`),
+    a 504 error is raised. Note that the thread itself cannot be interrupted,
+    so a call which times out will still occupy a worker until it completes.
+    """
+    global _queued
+    if timeout is None:
+        timeout = settings.KG_CALL_TIMEOUT
+    # run in a copy of the current context, so that request-scoped context variables
+    # are visible in the worker thread
+    context = contextvars.copy_context()
+    submitted_at = perf_counter()
+    started = False
+
+    def run():
+        global _queued, _active
+        nonlocal started
+        started = True
+        started_at = perf_counter()
+        with _lock:
+            _queued -= 1
+            _active += 1
+        metrics.observe("kg_executor.wait", started_at - submitted_at)
+        try:
+            return context.run(func, *args, **kwargs)
+        finally:
+            with _lock:
+                _active -= 1
+            metrics.observe("kg_executor.run", perf_counter() - started_at)
+
+    def on_done(future):
+        global _queued
+        if not started:  # cancelled before it ran
+            with _lock:
+                _queued -= 1
+
+    with _lock:
+        _queued += 1
+    future = executor.submit(run)
+    future.add_done_callback(on_done)
+    try:
+        return await asyncio.wait_for(asyncio.wrap_future(future), timeout)
+    except asyncio.TimeoutError:
+        metrics.increment("kg_executor.timeouts")
+        logger.error(f"Timeout after {timeout} s calling {getattr(func, '__qualname__', func)}")
+        raise HTTPException(
+            status_code=status.HTTP_504_GATEWAY_TIMEOUT,
+            detail="Timeout while accessing the Knowledge Graph",
+        )
@@ -0,0 +1,242 @@
+"""
+Concurrent resolution of links between Knowledge Graph objects.
+
+Converting KG objects to the API data models means following many links
+(authors, organizations, model instances, scripts, ...). Resolving these one at a time
+costs one round-trip each, so here we resolve all the links at a given level of the
+hierarchy together, in parallel, resolving each distinct URI only once.
+
+Within a request, resolved objects are also kept in an identity map,
+so that an object linked from many places (e.g. the author of several models)
+is only retrieved once.
+
+Across requests, retrieved objects are kept in a bounded cache with a time-to-live.
+Objects saved or deleted through `save_object()` and `delete_object()` are updated
+in, or removed from, this cache immediately, but only in the current process,
+so types which can be edited (test definitions, model instances, ...) are given
+a TTL of a few seconds, while those which change rarely (people, organizations,
+data files) are kept for longer.
+"""
+
+import contextvars
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from fairgraph.base import KGObject, KGProxy
+
+from . import settings
+from .cache import TTLCache
+
+
+logger = logging.getLogger("validation_service_v2")
+
+# This pool is separate from the one in kg_executor, since resolve_many() is normally
+# called from code which is itself running in that pool.
+resolver_pool = ThreadPoolExecutor(
+    max_workers=settings.KG_RESOLVER_THREADS, thread_name_prefix="kg-resolver"
+)
+
+
+class IdentityMap(dict):
+    """Mapping from URI to resolved KG object, for the duration of a request"""
+
+    def __init__(self):
+        super().__init__()
+        self._lock = threading.Lock()
+        self.resolves = 0
+        self.resolves_saved = 0
+
+    def count(self, resolves=0, resolves_saved=0):
+        with self._lock:
+            self.resolves += resolves
+            self.resolves_saved += resolves_saved
+
+
+identity_map = contextvars.ContextVar("kg_identity_map", default=None)
+
+
+_object_caches = {}  # KG class name -> TTLCache, or None if the class is not cached
+_object_caches_lock = threading.Lock()
+_refreshing = set()
+_refreshing_lock = threading.Lock()
+
+
+class ResolvedObjects(dict):
+    """Mapping from URI to resolved KG object"""
+
+    def lookup(self, obj):
+        """
+        Return the resolved object for a KGProxy,
+        or the object itself if it is already a real object (or None).
+        """
+        if isinstance(obj, KGProxy):
+            return self.get(obj.id)
+        return obj
+
+
+def _object_cache(cls):
+    name = cls.__name__
+    with _object_caches_lock:
+        if name not in _object_caches:
+            maxsize = settings.KG_OBJECT_CACHE_SIZES.get(name, 0)
+            if maxsize > 0:
+                _object_caches[name] = TTLCache(
+                    f"kg_objects.{name}",
+                    maxsize,
+                    settings.KG_OBJECT_CACHE_TTLS.get(name, settings.KG_OBJECT_CACHE_TTL),
+                    stale_ttl=settings.KG_OBJECT_CACHE_STALE_TTL,
+                )
+            else:
+                _object_caches[name] = None
+        return _object_caches[name]
+
+
+def _fetch(cls, uri, client):
+    obj = cls.from_uri(uri, client, use_cache=False, api="nexus")
+    # fairgraph also caches every object it retrieves, without limit or expiry,
+    # so we remove them from there: our own cache is the one that should be used
+    KGObject.object_cache.pop(uri, None)
+    client.cache.pop(uri, None)
+    return obj
+
+
+def _refresh(cls, uri, client, cache):
+    try:
+        obj = _fetch(cls, uri, client)
+    except Exception as err:
+        logger.warning(f"Unable to refresh {uri}: {err}")
+    else:
+        if obj is None:
+            cache.invalidate(uri)
+        else:
+            cache.set(uri, obj)
+    finally:
+        with _refreshing_lock:
+            _refreshing.discard(uri)
+
+
+def _refresh_in_background(cls, uri, client, cache):
+    with _refreshing_lock:
+        if uri in _refreshing:
+            return
+        _refreshing.add(uri)
+    resolver_pool.submit(_refresh, cls, uri, client, cache)
+
+
+def _get(cls, uri, client):
+    objects = identity_map.get()
+    if objects is not None and uri in objects:
+        objects.count(resolves_saved=1)
+        return objects[uri]
+    cache = _object_cache(cls)
+    found = False
+    if cache is not None:
+        found, obj, stale = cache.lookup(uri)
+        if found and stale:
+            _refresh_in_background(cls, uri, client, cache)
+    if not found:
+        obj = _fetch(cls, uri, client)
+        if cache is not None and obj is not None:
+            cache.set(uri, obj)
+    if objects is not None:
+        if found:
+            objects.count(resolves_saved=1)
+        else:
+            objects.count(resolves=1)
+        if obj is not None:
+            objects[uri] = obj
+    return obj
+
+
+def _resolve(proxy, client):
+    try:
+        return _get(proxy.cls, proxy.id, client)
+    except Exception as err:
+        logger.warning(f"Unable to resolve {proxy.id}: {err}")
+        return None
+
+
+def resolve(obj, client):
+    """
+    Resolve a single KGProxy, using the identity map for the current request.
+    Objects which are not proxies are returned unchanged.
+    """
+    if isinstance(obj, KGProxy):
+        return _resolve(obj, client)
+    return obj
+
+
+def get_by_uuid(cls, uuid, client):
+    """Equivalent to `cls.from_uuid()`, but using the identity map and the object cache"""
+    return _get(cls, cls.uri_from_uuid(uuid, client), client)
+
+
+def save_object(obj, client):
+    """Save a KG object, and update the cached copy"""
+    obj.save(client)
+    cache = _object_cache(obj.__class__)
+    if cache is not None:
+        cache.set(obj.id, obj)
+    objects = identity_map.get()
+    if objects is not None:
+        objects[obj.id] = obj
+
+
+def delete_object(obj, client):
+    """Delete a KG object (or the object a KGProxy refers to), and remove any cached copy"""
+    obj.delete(client)
+    invalidate(obj.id)
+
+
+def invalidate(uri):
+    """Remove the object with the given URI from the caches"""
+    with _object_caches_lock:
+        caches = list(_object_caches.values())
+    for cache in caches:
+        if cache is not None:
+            cache.invalidate(uri)
+    KGObject.object_cache.pop(uri, None)
+    objects = identity_map.get()
+    if objects is not None:
+        objects.pop(uri, None)
+
+
+def resolve_many(objects, client):
+    """
+    Resolve any KGProxy objects among `objects`, concurrently.
+
+    Returns a `ResolvedObjects` mapping. Proxies that could not be resolved map to None.
+    """
+    proxies = {}
+    duplicates = 0
+    for obj in objects:
+        if isinstance(obj, KGProxy):
+            if obj.id in proxies:
+                duplicates += 1
+            else:
+                proxies[obj.id] = obj
+    if duplicates and identity_map.get() is not None:
+        identity_map.get().count(resolves_saved=duplicates)
+    resolved = ResolvedObjects()
+    if len(proxies) == 1:
+        uri, proxy = proxies.popitem()
+        resolved[uri] = _resolve(proxy, client)
+    elif proxies:
+        futures = {
+            # each task needs its own copy of the context, so that request-scoped
+            # context variables are visible in the resolver threads
+            uri: resolver_pool.submit(contextvars.copy_context().run, _resolve, proxy, client)
+            for uri, proxy in proxies.items()
+        }
+        for uri, future in futures.items():
+            resolved[uri] = future.result()
+    return resolved
+
+
+def map_concurrently(func, items):
+    """Apply a blocking function to each item in parallel, returning a list of results"""
+    futures = [
+        resolver_pool.submit(contextvars.copy_context().run, func, item) for item in items
+    ]
+    return [future.result() for future in futures]
@@ -1,9 +1,22 @@
-from fastapi import FastAPI
+import logging
+
+from fastapi import FastAPI, Request
 from starlette.middleware.sessions import SessionMiddleware
 from starlette.middleware.cors import CORSMiddleware
 
-from .resources import models, tests, vocab, results, auth, simulations
-from . import settings
+from .resources import models, tests, vocab, results, auth, simulations, monitoring, ingestion
+from . import settings, metrics
+from .ingestion import start_workers, stop_workers
+from .catalog import start_sync, stop_sync
+from .search import stop_indexing
+from .aliases import start_refreshing, stop_refreshing
+from .scores import start_score_updates, stop_score_updates
+from .auth import request_permissions, close_http_client
+from .kg_resolver import identity_map, IdentityMap
+from .streaming import NDJSON
+
+
+logger = logging.getLogger("validation_service_v2")
 
 
 description = """
@@ -37,11 +50,71 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[
+        "X-Total-Count", "X-Next-Cursor", "X-KG-Resolves", "X-KG-Resolves-Saved",
+        "Location", "Idempotency-Key", "Preference-Applied", "X-Results-Backend",
+        "X-Catalog-Replica-Age",
+    ],
 )
 
+
+@app.middleware("http")
+async def deduplicate_permission_checks(request: Request, call_next):
+    context_token = request_permissions.set({})
+    try:
+        return await call_next(request)
+    finally:
+        request_permissions.reset(context_token)
+
+
+@app.middleware("http")
+async def kg_identity_map(request: Request, call_next):
+    objects = IdentityMap()
+    context_token = identity_map.set(objects)
+    try:
+        response = await call_next(request)
+    finally:
+        identity_map.reset(context_token)
+    # streamed responses are still being prepared at this point, with an identity map
+    # for each chunk, so the counts would be incomplete
+    if not response.headers.get("content-type", "").startswith(NDJSON):
+        response.headers["X-KG-Resolves"] = str(objects.resolves)
+        response.headers["X-KG-Resolves-Saved"] = str(objects.resolves_saved)
+    metrics.increment("kg_resolver.resolves", objects.resolves)
+    metrics.increment("kg_resolver.resolves_saved", objects.resolves_saved)
+    if objects.resolves_saved:
+        logger.debug(
+            f"{request.method} {request.url.path}: {objects.resolves} KG resolves, "
+            f"{objects.resolves_saved} saved by identity map"
+        )
+    return response
+
+
+@app.on_event("startup")
+async def startup():
+    if settings.INGESTION_QUEUE_PATH:
+        start_workers()
+    if settings.CATALOG_REPLICA_PATH:
+        start_sync()
+        start_score_updates()
+    start_refreshing()
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    await stop_workers()
+    await stop_sync()
+    await stop_indexing()
+    await stop_refreshing()
+    await stop_score_updates()
+    await close_http_client()
+
+
 app.include_router(auth.router, tags=["Authentication and authorization"])
 app.include_router(models.router, tags=["Models"])
 app.include_router(tests.router, tags=["Validation Tests"])
 app.include_router(results.router, tags=["Validation Results"])
 app.include_router(simulations.router, tags=["Simulations"])
+app.include_router(ingestion.router, tags=["Background storage"])
 app.include_router(vocab.router, tags=["Controlled vocabularies"])
+app.include_router(monitoring.router, tags=["Monitoring"])
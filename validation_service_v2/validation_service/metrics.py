@@ -0,0 +1,44 @@
+"""
+Simple in-process metrics, for monitoring
+"""
+
+import threading
+
+
+_lock = threading.Lock()
+_counters = {}
+_timers = {}
+_gauges = {}
+
+
+def increment(name, value=1):
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def observe(name, seconds):
+    """Record the duration of an operation"""
+    with _lock:
+        timer = _timers.setdefault(name, {"count": 0, "total": 0.0, "max": 0.0})
+        timer["count"] += 1
+        timer["total"] += seconds
+        timer["max"] = max(timer["max"], seconds)
+
+
+def register_gauge(name, func):
+    """Register a function which returns the current value of some quantity"""
+    _gauges[name] = func
+
+
+def get_metrics():
+    with _lock:
+        timers = {
+            name: dict(timer, mean=timer["total"] / timer["count"] if timer["count"] else None)
+            for name, timer in _timers.items()
+        }
+        counters = dict(_counters)
+    return {
+        "counters": counters,
+        "timers": timers,
+        "gauges": {name: func() for name, func in _gauges.items()},
+    }
@@ -1,4 +1,8 @@
-from itertools import chain
+import json
+from datetime import datetime, timezone
+from itertools import chain, product
+from urllib.parse import quote_plus
+from fairgraph.base import as_list
 from fairgraph.brainsimulation import (
     ModelProject,
     ValidationTestDefinition,
@@ -87,6 +91,22 @@ def build_validation_test_filters(
     return filter_query, context
 
 
+def build_modified_since_filter(timestamp):
+    """
+    Filter for KG objects modified after the given time (seconds since the epoch),
+    or None (no filter) if `timestamp` is None
+    """
+    context = {"nxv": "https://bbp-nexus.epfl.ch/vocabs/nexus/core/terms/v0.1.0/"}
+    if timestamp is None:
+        return None, context
+    modified_since = datetime.fromtimestamp(timestamp, timezone.utc).isoformat()
+    filter_query = {
+        "op": "and",
+        "value": [{"path": "nxv:updatedAt", "op": "gt", "value": modified_since}],
+    }
+    return filter_query, context
+
+
 def get_full_uri(kg_types, uuid, client):
     if not isinstance(kg_types, (list, tuple)):
         kg_types = [kg_types]
@@ -115,20 +135,26 @@ def build_result_filters(
 
     if model_instance_id is not None:
         model_instance_id = list(
-            chain(
+            chain.from_iterable(
                 get_full_uri([ModelInstance, MEModel], uuid, kg_client)
                 for uuid in model_instance_id
             )
         )
     if test_instance_id is not None:
         test_instance_id = list(
-            chain(get_full_uri(ValidationScript, uuid, kg_client) for uuid in test_instance_id)
+            chain.from_iterable(
+                get_full_uri(ValidationScript, uuid, kg_client) for uuid in test_instance_id
+            )
         )
     if model_id is not None:
-        model_id = list(chain(get_full_uri(ModelProject, uuid, kg_client) for uuid in model_id))
+        model_id = list(
+            chain.from_iterable(get_full_uri(ModelProject, uuid, kg_client) for uuid in model_id)
+        )
     if test_id is not None:
         test_id = list(
-            chain(get_full_uri(ValidationTestDefinition, uuid, kg_client) for uuid in test_id)
+            chain.from_iterable(
+                get_full_uri(ValidationTestDefinition, uuid, kg_client) for uuid in test_id
+            )
         )
 
     for value, path in (
@@ -157,3 +183,59 @@ def model_alias_exists(alias, client):
 def test_alias_exists(alias, client):
     test_with_same_alias = ValidationTestDefinition.from_alias(alias, client, api="nexus")
     return bool(test_with_same_alias)
+
+
+def query_kg_objects(cls, filter_query, context, client, size=100, from_index=0):
+    """
+    Retrieve one page of KG objects of type `cls`, matching the filter if one is given.
+
+    Unlike KGQuery.resolve(), this supports `from_index`, so that pagination
+    is performed by the KG.
+    """
+    if not filter_query or not filter_query["value"]:
+        filter_query = None
+    instances = client.query_nexus(
+        path=cls.path, filter=filter_query, context=context, from_index=from_index, size=size
+    )
+    return [cls.from_kg_instance(instance, client) for instance in instances]
+
+
+def count_kg_objects(cls, filter_query, context, client):
+    """Return the total number of KG objects of type `cls` matching the filter"""
+    url = f"{client.nexus_endpoint}/data/{cls.path}/?size=1&deprecated=false"
+    if filter_query and filter_query["value"]:
+        url += "&filter={}&context={}".format(
+            quote_plus(json.dumps(filter_query)), quote_plus(json.dumps(context))
+        )
+    return client._nexus_client._http_client.get(url)["total"]
+
+
+def plan_queries(filters, multi_valued=()):
+    """
+    Plan the queries needed for a search, given a dict of filters each with a list of values
+    (or None, or a single value).
+
+    Filters named in `multi_valued` accept several values in a single query. For any
+    other filter with several values, one query is needed per value, so the plan contains
+    one query for each combination of such values (and only those).
+
+    Returns a list of dicts, one per query, mapping each filter name to a single value,
+    or to a list of values for multi-valued filters.
+    """
+    fixed = {}
+    expanded = {}
+    for name, values in filters.items():
+        values = as_list(values)
+        if len(values) == 0:
+            continue
+        elif len(values) == 1:
+            fixed[name] = values[0]
+        elif name in multi_valued:
+            fixed[name] = values
+        else:
+            expanded[name] = values
+    names = list(expanded)
+    return [
+        dict(fixed, **dict(zip(names, combination)))
+        for combination in product(*(expanded[name] for name in names))
+    ]
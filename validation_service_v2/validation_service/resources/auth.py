@@ -1,7 +1,7 @@
 from fastapi import APIRouter, Depends
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from starlette.requests import Request
-from ..auth import oauth
+from ..auth import oauth, get_userinfo
 from ..settings import BASE_URL
 
 router = APIRouter()
@@ -39,9 +39,7 @@ async def list_projects(
     request: Request,
     token: HTTPAuthorizationCredentials = Depends(auth),
 ):
-    user_info = await oauth.ebrains.userinfo(
-        token={"access_token": token.credentials, "token_type": "bearer"}
-    )
+    user_info = await get_userinfo(token.credentials)
     roles = user_info.get("roles", {}).get("team", [])
     projects = {}
     for role in roles:
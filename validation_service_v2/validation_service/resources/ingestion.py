@@ -0,0 +1,32 @@
+"""
+Status of submissions queued for storage in the Knowledge Graph
+"""
+
+from uuid import UUID
+
+from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+
+from ..data_models import IngestionJob
+from ..ingestion import get_queue, job_status
+from .. import settings
+
+
+auth = HTTPBearer()
+router = APIRouter()
+
+
+@router.get("/ingestion/jobs/{job_id}", response_model=IngestionJob)
+def get_ingestion_job(job_id: UUID, token: HTTPAuthorizationCredentials = Depends(auth)):
+    """
+    Status of a validation result or simulation submitted with `Prefer: respond-async`.
+
+    Once the status is "done", `object_id` gives the ID of the stored result or simulation.
+    """
+    job = get_queue().get(job_id) if settings.INGESTION_QUEUE_PATH else None
+    if job is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Ingestion job {job_id} not found.",
+        )
+    return job_status(job)
@@ -1,16 +1,34 @@
 from uuid import UUID
 from typing import List
+import asyncio
 from datetime import datetime
 import logging
 
-from fairgraph.base import KGQuery, as_list
+from fairgraph.base import as_list
 from fairgraph.brainsimulation import ModelProject, ModelInstance as ModelInstanceKG, MEModel
 
-from fastapi import APIRouter, Depends, Query, Path, HTTPException, status
+from fastapi import APIRouter, Depends, Header, Query, Path, HTTPException, Response, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from fastapi.responses import JSONResponse
+from fastapi.encoders import jsonable_encoder
 
 from ..auth import get_kg_client, get_user_from_token, is_collab_member, is_admin
-from ..db import kg_client, _get_model_instance_by_id, _get_model_by_id_or_alias
+from ..db import (
+    kg_client,
+    _get_model_instance_by_id,
+    _get_model_instance_and_project,
+    _get_model_by_id_or_alias,
+    _check_model_access,
+    _check_project_access,
+    remember_saved_project,
+    forget_saved_project,
+)
+from ..kg_executor import kg_call
+from ..kg_resolver import resolve, get_by_uuid, save_object, delete_object
+from ..streaming import wants_ndjson, fetch_in_chunks, single_chunk, ndjson_response
+from ..catalog import MAX_STALENESS_DESCRIPTION
+from .. import catalog, search
+from ..aliases import model_aliases, model_alias_exists
 from ..data_models import (
     Person,
     Species,
@@ -20,10 +38,15 @@ from ..data_models import (
     AbstractionLevel,
     ScientificModel,
     ScientificModelPatch,
+    ScientificModelSummary,
     ModelInstance,
     ModelInstancePatch,
 )
-from ..queries import build_model_project_filters, model_alias_exists
+from ..queries import (
+    build_model_project_filters,
+    query_kg_objects,
+    count_kg_objects,
+)
 
 
 logger = logging.getLogger("validation_service_v2")
@@ -39,6 +62,7 @@ def read_root():
 
 @router.get("/models/", response_model=List[ScientificModel])
 async def query_models(
+    response: Response,
     alias: List[str] = Query(
         None, description="A list of model aliases (short names) to search for"
     ),
@@ -62,15 +86,41 @@ async def query_models(
         None, description="Find models belonging to a specific project/projects"
     ),
     private: bool = Query(None, description="Limit the search to public or private models"),
+    q: str = Query(
+        None,
+        description="Find models whose name, alias, description or authors contain these words "
+        "(or words starting with them, or with similar spelling), most relevant first",
+    ),
     size: int = Query(100, description="Maximum number of responses"),
     from_index: int = Query(0, description="Index of the first response returned"),
+    summary: bool = Query(
+        False, description="Return only top-level information about each model, with a count of instances"
+    ),
+    fields: List[str] = Query(
+        None, description="Return only these fields (implies `summary`, but any summary field may be chosen)"
+    ),
+    max_staleness: float = Query(None, description=MAX_STALENESS_DESCRIPTION),
     # from header
+    accept: str = Header(None),
     token: HTTPAuthorizationCredentials = Depends(auth),
 ):
     """
     Search the model catalog for specific models (identitified by their unique ID or by a short name / alias),
     and/or search by attributes of the models (e.g. the cell types being modelled, the type of model, the model author).
+
+    For listings, use `summary=true` or `fields=...`: model instances are then not retrieved,
+    which is much faster.
+
+    The total number of matching models is returned in the `X-Total-Count` header.
+
+    With `Accept: application/x-ndjson`, models are streamed as newline-delimited JSON,
+    each one being sent as soon as it is ready.
+
+    If the local copy of the catalog is recent enough, it is used to answer the request,
+    and its age is returned in the `X-Catalog-Replica-Age` header.
     """
+    if summary or fields:
+        fields = ScientificModelSummary.select_fields(fields)
 
     # If project_id is provided:
     #     - private = None: both public and private models from that project (collab), if the user is a member
@@ -107,6 +157,32 @@ async def query_models(
     if abstraction_level:
         abstraction_level = abstraction_level.value
 
+    filters = {
+        "alias": alias,
+        "id": id,
+        "name": name,
+        "brain_region": brain_region,
+        "species": species,
+        "cell_type": cell_type,
+        "model_scope": model_scope,
+        "abstraction_level": abstraction_level,
+        "author": author,
+        "owner": owner,
+        "organization": organization,
+        "project_id": project_id,
+        "private": private,
+    }
+    if q:
+        return await _search_models(q, filters, size, from_index, fields, accept, max_staleness)
+
+    replica = catalog.fresh_replica(max_staleness)
+    if replica is not None:
+        models, total = await catalog.replica_call(replica.query_models, filters, size, from_index, fields)
+        headers = dict(catalog.replica_age_header(replica), **{"X-Total-Count": str(total)})
+        if wants_ndjson(accept):
+            return ndjson_response(single_chunk(models), headers=headers)
+        return JSONResponse(jsonable_encoder(models), headers=headers)
+
     filter_query, context = build_model_project_filters(
         alias,
         id,
@@ -124,32 +200,96 @@ async def query_models(
     )
     if len(filter_query["value"]) > 0:
         logger.info("Searching for ModelProject with the following query: {}".format(filter_query))
-        # note that from_index is not currently supported by KGQuery.resolve
-        model_projects = KGQuery(ModelProject, {"nexus": filter_query}, context).resolve(
-            kg_client, api="nexus", size=size
+
+    async def fetch(start, limit):
+        return await kg_call(
+            query_kg_objects, ModelProject, filter_query, context, kg_client,
+            size=limit, from_index=start
+        )
+
+    async def convert(model_projects):
+        if fields:
+            models = await kg_call(
+                ScientificModelSummary.from_kg_objects, model_projects, kg_client, fields
+            )
+            return [model.dict(include=fields) for model in models]
+        return await kg_call(ScientificModel.from_kg_objects, model_projects, kg_client)
+
+    if wants_ndjson(accept):
+        total = await kg_call(count_kg_objects, ModelProject, filter_query, context, kg_client)
+        return ndjson_response(
+            fetch_in_chunks(fetch, convert, size, from_index), headers={"X-Total-Count": str(total)}
         )
+    model_projects, total = await asyncio.gather(
+        fetch(from_index, size),
+        kg_call(count_kg_objects, ModelProject, filter_query, context, kg_client),
+    )
+    models = await convert(model_projects)
+    if fields:
+        return JSONResponse(jsonable_encoder(models), headers={"X-Total-Count": str(total)})
+    response.headers["X-Total-Count"] = str(total)
+    return models
+
+
+async def _search_models(q, filters, size, from_index, fields, accept, max_staleness):
+    index = await search.ready(search.model_index)
+    documents = index.search(
+        q, lambda document: search.matches_filters(document, filters, people=("author", "owner"))
+    )
+    page = documents[from_index:from_index + size]
+    if fields:
+        models = [
+            {key: value for key, value in document.items() if key in fields} for document in page
+        ]
     else:
-        model_projects = ModelProject.list(
-            kg_client, api="nexus", size=size, from_index=from_index
+        models = await _get_models([document["id"] for document in page], max_staleness)
+    headers = {"X-Total-Count": str(len(documents))}
+    if wants_ndjson(accept):
+        return ndjson_response(single_chunk(models), headers=headers)
+    return JSONResponse(jsonable_encoder(models), headers=headers)
+
+
+async def _get_models(model_ids, max_staleness):
+    """Return the models with the given IDs, in the same order, from the replica where possible"""
+    models = {}
+    replica = catalog.fresh_replica(max_staleness)
+    if replica is not None:
+        for model_id in model_ids:
+            model = replica.get_model(model_id)
+            if model is not None:
+                models[model_id] = model
+    missing = [model_id for model_id in model_ids if model_id not in models]
+    if missing:
+        model_projects = await asyncio.gather(
+            *(kg_call(get_by_uuid, ModelProject, model_id, kg_client) for model_id in missing)
+        )
+        converted = await kg_call(
+            ScientificModel.from_kg_objects,
+            [model_project for model_project in model_projects if model_project],
+            kg_client,
         )
-    return [
-        ScientificModel.from_kg_object(model_project, kg_client)
-        for model_project in as_list(model_projects)
-    ]
+        models.update((str(model.id), model) for model in converted)
+    return [models[model_id] for model_id in model_ids if model_id in models]
 
 
 @router.get("/models/{model_id}", response_model=ScientificModel)
 async def get_model(
     model_id: str = Path(..., title="Model ID", description="ID of the model to be retrieved"),
+    max_staleness: float = Query(None, description=MAX_STALENESS_DESCRIPTION),
     token: HTTPAuthorizationCredentials = Depends(auth),
 ):
     """Retrieve information about a specific model identified by a UUID"""
+    replica = catalog.fresh_replica(max_staleness)
+    model = replica.get_model(model_id) if replica else None
+    if model is not None:
+        await _check_project_access(model["private"], model["project_id"], token)
+        return JSONResponse(jsonable_encoder(model), headers=catalog.replica_age_header(replica))
     model_project = await _get_model_by_id_or_alias(model_id, token)
     if not model_project:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail=f"Model with ID '{model_id}' not found."
         )
-    return ScientificModel.from_kg_object(model_project, kg_client)
+    return await kg_call(ScientificModel.from_kg_object, model_project, kg_client)
 
 
 @router.post("/models/", response_model=ScientificModel, status_code=status.HTTP_201_CREATED)
@@ -170,7 +310,7 @@ async def create_model(
             detail=f"This account is not a member of Collab #{model.project_id}",
         )
     # check uniqueness of alias
-    if model.alias and model_alias_exists(model.alias, kg_client):
+    if model.alias and await model_alias_exists(model.alias):
         raise HTTPException(
             status_code=status.HTTP_409_CONFLICT,
             detail=f"Another model with alias '{model.alias}' already exists.",
@@ -178,7 +318,7 @@ async def create_model(
     kg_objects = model.to_kg_objects()
     model_project = kg_objects[-1]
     assert isinstance(model_project, ModelProject)
-    if model_project.exists(kg_client, api="any"):
+    if await kg_call(model_project.exists, kg_client, api="any"):
         # see https://stackoverflow.com/questions/3825990/http-response-code-for-post-when-resource-already-exists
         # for a discussion of the most appropriate status code to use here
         raise HTTPException(
@@ -186,8 +326,13 @@ async def create_model(
             detail=f"Another model with the same name and timestamp already exists.",
         )
     for obj in kg_objects:
-        obj.save(kg_client)
-    return ScientificModel.from_kg_object(model_project, kg_client)
+        await kg_call(save_object, obj, kg_client)
+    remember_saved_project(model_project)
+    model = await kg_call(ScientificModel.from_kg_object, model_project, kg_client)
+    await catalog.store_model(model)
+    search.index_model(model)
+    model_aliases.set(model.id, model.alias)
+    return model
 
 
 @router.put("/models/{model_id}", response_model=ScientificModel, status_code=status.HTTP_200_OK)
@@ -206,8 +351,8 @@ async def update_model(
             detail=f"This account is not a member of Collab #{model_patch.project_id}",
         )
     # retrieve stored model
-    model_project = ModelProject.from_uuid(str(model_id), kg_client, api="nexus")
-    stored_model = ScientificModel.from_kg_object(model_project, kg_client)
+    model_project = await kg_call(get_by_uuid, ModelProject, str(model_id), kg_client)
+    stored_model = await kg_call(ScientificModel.from_kg_object, model_project, kg_client)
     # if retrieved project_id is different to payload id, check permissions for that id
     if stored_model.project_id != model_patch.project_id and not (
         await is_collab_member(stored_model.project_id, token.credentials)
@@ -221,7 +366,7 @@ async def update_model(
     if (
         model_patch.alias
         and model_patch.alias != stored_model.alias
-        and model_alias_exists(model_patch.alias, kg_client)
+        and await model_alias_exists(model_patch.alias)
     ):
         raise HTTPException(
             status_code=status.HTTP_409_CONFLICT,
@@ -240,16 +385,21 @@ async def update_model(
     updated_model = stored_model.copy(update=update_data)
     kg_objects = updated_model.to_kg_objects()
     for obj in kg_objects:
-        obj.save(kg_client)
+        await kg_call(save_object, obj, kg_client)
     model_project = kg_objects[-1]
     assert isinstance(model_project, ModelProject)
-    return ScientificModel.from_kg_object(model_project, kg_client)
+    remember_saved_project(model_project)
+    model = await kg_call(ScientificModel.from_kg_object, model_project, kg_client)
+    await catalog.store_model(model)
+    search.index_model(model)
+    model_aliases.set(model.id, model.alias)
+    return model
 
 
 @router.delete("/models/{model_id}", status_code=status.HTTP_200_OK)
 async def delete_model(model_id: UUID, token: HTTPAuthorizationCredentials = Depends(auth)):
     # todo: handle non-existent UUID
-    model_project = ModelProject.from_uuid(str(model_id), kg_client, api="nexus")
+    model_project = await kg_call(get_by_uuid, ModelProject, str(model_id), kg_client)
     if not (
         await is_collab_member(model_project.collab_id, token.credentials)
         or await is_admin(token.credentials)
@@ -258,11 +408,15 @@ async def delete_model(model_id: UUID, token: HTTPAuthorizationCredentials = Dep
             status_code=status.HTTP_403_FORBIDDEN,
             detail=f"Access to this model is restricted to members of Collab #{model_project.collab_id}",
         )
-    model_project.delete(kg_client)
+    await kg_call(delete_object, model_project, kg_client)
+    forget_saved_project(model_project)
+    await catalog.remove_model(model_id)
+    search.remove_model(model_id)
+    model_aliases.remove(model_id)
     for model_instance in as_list(model_project.instances):
         # todo: we should possibly also delete emodels, modelscripts, morphologies,
         # but need to check they're not shared with other instances
-        model_instance.delete(kg_client)
+        await kg_call(delete_object, model_instance, kg_client)
 
 
 @router.get("/models/{model_id}/instances/", response_model=List[ModelInstance])
@@ -270,10 +424,10 @@ async def get_model_instances(
     model_id: str, version: str = None, token: HTTPAuthorizationCredentials = Depends(auth)
 ):
     model_project = await _get_model_by_id_or_alias(model_id, token)
-    model_instances = [
-        ModelInstance.from_kg_object(inst, kg_client, model_project.uuid)
+    model_instances = await asyncio.gather(*(
+        kg_call(ModelInstance.from_kg_object, inst, kg_client, model_project.uuid)
         for inst in as_list(model_project.instances)
-    ]
+    ))
     if version is not None:
         model_instances = [inst for inst in model_instances if inst.version == version]
     return model_instances
@@ -284,7 +438,7 @@ async def get_model_instance_from_instance_id(
     model_instance_id: UUID, token: HTTPAuthorizationCredentials = Depends(auth)
 ):
     inst, model_id = await _get_model_instance_by_id(model_instance_id, token)
-    return ModelInstance.from_kg_object(inst, kg_client, model_id)
+    return await kg_call(ModelInstance.from_kg_object, inst, kg_client, model_id)
 
 
 @router.get("/models/{model_id}/instances/latest", response_model=ModelInstance)
@@ -292,10 +446,10 @@ async def get_latest_model_instance_given_model_id(
     model_id: str, token: HTTPAuthorizationCredentials = Depends(auth)
 ):
     model_project = await _get_model_by_id_or_alias(model_id, token)
-    model_instances = [
-        ModelInstance.from_kg_object(inst, kg_client, model_project.uuid)
+    model_instances = await asyncio.gather(*(
+        kg_call(ModelInstance.from_kg_object, inst, kg_client, model_project.uuid)
         for inst in as_list(model_project.instances)
-    ]
+    ))
     latest = sorted(model_instances, key=lambda inst: inst["timestamp"])[-1]
     return latest
 
@@ -307,7 +461,7 @@ async def get_model_instance_given_model_id(
     model_project = await _get_model_by_id_or_alias(model_id, token)
     for inst in as_list(model_project.instances):
         if UUID(inst.uuid) == model_instance_id:
-            return ModelInstance.from_kg_object(inst, kg_client, model_project.uuid)
+            return await kg_call(ModelInstance.from_kg_object, inst, kg_client, model_project.uuid)
     raise HTTPException(
         status_code=status.HTTP_400_BAD_REQUEST,
         detail="Model ID/alias and model instance ID are inconsistent",
@@ -337,22 +491,27 @@ async def create_model_instance(
     kg_objects = model_instance.to_kg_objects(model_project)
     model_instance_kg = kg_objects[-1]
     # check if an identical model instance already exists, raise an error if so
-    if model_instance_kg.exists(kg_client, api="any"):
+    if await kg_call(model_instance_kg.exists, kg_client, api="any"):
         raise HTTPException(
             status_code=status.HTTP_409_CONFLICT,
             detail=f"Another model instance with the same name already exists.",
         )
     # otherwise save to KG
     for obj in kg_objects:
-        obj.save(kg_client)
+        await kg_call(save_object, obj, kg_client)
     # not sure the following is needed.
     # Should just be able to leave the existing model instances as KGProxy objects?
-    model_project.instances = [
-        inst.resolve(kg_client, api="nexus") for inst in as_list(model_project.instances)
-    ]
+    model_project.instances = await asyncio.gather(*(
+        kg_call(resolve, inst, kg_client) for inst in as_list(model_project.instances)
+    ))
     model_project.instances.append(model_instance_kg)
-    model_project.save(kg_client)
-    return ModelInstance.from_kg_object(model_instance_kg, kg_client, model_project.uuid)
+    await kg_call(save_object, model_project, kg_client)
+    remember_saved_project(model_project)
+    model_instance = await kg_call(
+        ModelInstance.from_kg_object, model_instance_kg, kg_client, model_project.uuid
+    )
+    await catalog.store_model_instance(model_instance)
+    return model_instance
 
 
 @router.put("/models/query/instances/{model_instance_id}", response_model=ModelInstance)
@@ -361,8 +520,8 @@ async def update_model_instance_by_id(
     model_instance_patch: ModelInstancePatch,
     token: HTTPAuthorizationCredentials = Depends(auth),
 ):
-    model_instance_kg, model_id = await _get_model_instance_by_id(model_instance_id, token)
-    model_project = model_instance_kg.project.resolve(kg_client, api="nexus")
+    model_instance_kg, model_project = await _get_model_instance_and_project(model_instance_id)
+    await _check_model_access(model_project, token)
     return await _update_model_instance(
         model_instance_kg, model_project, model_instance_patch, token
     )
@@ -397,25 +556,29 @@ async def _update_model_instance(model_instance_kg, model_project, model_instanc
             detail=f"This account is not a member of Collab #{model_project.project_id}",
         )
 
-    stored_model_instance = ModelInstance.from_kg_object(
-        model_instance_kg, kg_client, model_project.uuid
+    stored_model_instance = await kg_call(
+        ModelInstance.from_kg_object, model_instance_kg, kg_client, model_project.uuid
     )
     update_data = model_instance_patch.dict(exclude_unset=True)
     updated_model_instance = stored_model_instance.copy(update=update_data)
     kg_objects = updated_model_instance.to_kg_objects(model_project)
     for obj in kg_objects:
-        obj.save(kg_client)
+        await kg_call(save_object, obj, kg_client)
     model_instance_kg = kg_objects[-1]
     assert isinstance(model_instance_kg, (ModelInstanceKG, MEModel))
-    return ModelInstance.from_kg_object(model_instance_kg, kg_client, model_project.uuid)
+    model_instance = await kg_call(
+        ModelInstance.from_kg_object, model_instance_kg, kg_client, model_project.uuid
+    )
+    await catalog.store_model_instance(model_instance)
+    return model_instance
 
 
 @router.delete("/models/query/instances/{model_instance_id}", status_code=status.HTTP_200_OK)
 async def delete_model_instance_by_id(
     model_instance_id: UUID, token: HTTPAuthorizationCredentials = Depends(auth)
 ):
-    model_instance_kg, model_id = await _get_model_instance_by_id(model_instance_id, token)
-    model_project = model_instance_kg.project.resolve(kg_client, api="nexus")
+    model_instance_kg, model_project = await _get_model_instance_and_project(model_instance_id)
+    await _check_model_access(model_project, token)
     await _delete_model_instance(model_instance_id, model_project)
 
 
@@ -424,7 +587,7 @@ async def delete_model_instance(
     model_id: UUID, model_instance_id: UUID, token: HTTPAuthorizationCredentials = Depends(auth)
 ):
     # todo: handle non-existent UUID
-    model_project = ModelProject.from_uuid(str(model_id), kg_client, api="nexus")
+    model_project = await kg_call(get_by_uuid, ModelProject, str(model_id), kg_client)
     if not (
         await is_collab_member(model_project.collab_id, token.credentials)
         or await is_admin(token.credentials)
@@ -437,13 +600,15 @@ async def delete_model_instance(
 
 
 async def _delete_model_instance(model_instance_id, model_project):
+    forget_saved_project(model_project)
     model_instances = as_list(model_project.instances)
     for model_instance in model_instances[:]:
         # todo: we should possibly also delete emodels, modelscripts, morphologies,
         # but need to check they're not shared with other instances
         if model_instance.uuid == str(model_instance_id):
-            model_instance.delete(kg_client)
+            await kg_call(delete_object, model_instance, kg_client)
+            await catalog.remove_model_instance(model_instance_id)
             model_instances.remove(model_instance)
             break
         model_project.instances = model_instances
-        model_project.save(kg_client)
+        await kg_call(save_object, model_project, kg_client)
@@ -0,0 +1,33 @@
+"""
+Statistics about the service, for monitoring
+"""
+
+from fastapi import APIRouter
+
+from ..aliases import model_aliases, test_aliases
+from ..cache import cache_stats
+from ..metrics import get_metrics
+
+
+router = APIRouter()
+
+
+@router.get("/monitoring/caches")
+def get_cache_statistics():
+    """Size, hit and miss counts for the in-memory caches"""
+    return cache_stats()
+
+
+@router.get("/monitoring/metrics")
+def get_service_metrics():
+    """Counters, timings and gauges (e.g. queue depths) collected by the service"""
+    return get_metrics()
+
+
+@router.get("/monitoring/aliases")
+def get_duplicate_aliases():
+    """Aliases shared by several models or tests, which should be unique"""
+    return {
+        "models": model_aliases.duplicates(),
+        "tests": test_aliases.duplicates(),
+    }
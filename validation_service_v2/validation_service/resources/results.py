@@ -1,25 +1,45 @@
 from uuid import UUID
 from enum import Enum
 from typing import List
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 from urllib.parse import quote_plus, urlencode
 import os
 import logging
-import itertools
-from requests.exceptions import HTTPError
+import asyncio
+import base64
+import json
+from requests.exceptions import RequestException
 
 from fairgraph.client import KGClient, SCOPE_MAP
 from fairgraph.base import KGQuery, KGProxy, as_list
 from fairgraph.brainsimulation import ValidationResult as ValidationResultKG, ValidationActivity
 
-from fastapi import APIRouter, Depends, Header, Query, HTTPException, status
+from fastapi import APIRouter, Depends, Header, Query, HTTPException, Response, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from fastapi.responses import JSONResponse
+from fastapi.encoders import jsonable_encoder
 from pydantic import ValidationError
 
 from ..auth import get_kg_client, get_user_from_token, is_collab_member, is_admin
-from ..data_models import ScoreType, ValidationResult, ValidationResultWithTestAndModel, ConsistencyError
-from ..queries import build_result_filters
-from .. import settings
+from ..data_models import (
+    ScoreType,
+    ValidationResult,
+    ValidationResultWithTestAndModel,
+    ValidationResultStatus,
+    IngestionJob,
+    ScoreMatrix,
+    ScoreStatistics,
+    ConsistencyError,
+    ensure_has_timezone,
+    _get_model_instance_by_id_no_access_check,
+    _get_test_script_and_definition,
+)
+from ..queries import build_result_filters, query_kg_objects, count_kg_objects, plan_queries
+from ..kg_executor import kg_call
+from ..kg_resolver import get_by_uuid, delete_object
+from ..streaming import wants_ndjson, fetch_in_chunks, single_chunk, ndjson_response
+from ..catalog import MAX_STALENESS_DESCRIPTION
+from .. import settings, metrics, ingestion, catalog, scores
 
 
 logger = logging.getLogger("validation_service_v2")
@@ -29,8 +49,53 @@ kg_client = get_kg_client()
 router = APIRouter()
 
 
+class ResultsBackend(str, Enum):
+    kg_query = "kg_query"
+    nexus = "nexus"
+    replica = "replica"
+
+
+class Normalization(str, Enum):
+    zscore = "zscore"
+    percentile = "percentile"
+
+
+class StatisticsGroup(str, Enum):
+    model = "model"
+    model_instance = "model_instance"
+    test = "test"
+    test_instance = "test_instance"
+    score_type = "score_type"
+    project = "project"
+
+
+class MatrixStatistic(str, Enum):
+    count = "count"
+    mean = "mean"
+    latest = "latest"
+    best = "best"
+
+
+CURSOR_DESCRIPTION = (
+    "Return results in reverse chronological order, starting from this position. "
+    "Pass an empty value to get the first page; the cursor for the following page "
+    "is returned in the `X-Next-Cursor` header, which is absent on the last page. "
+    "Results are ordered by their `timestamp`, which is set by the client that posted them, "
+    "so a result posted while paging with a timestamp older than the current position "
+    "(e.g. one uploaded late) is not returned; start again from the first page to see it."
+)
+
+NORMALIZATION_DESCRIPTION = (
+    "Replace the normalized score sent with each result by one computed over all the results "
+    "of the same test: the z-score (number of standard deviations from the mean score) or "
+    "the percentile rank of the score. New results are normalized within a few seconds; "
+    "until then, and for results not yet in the local copy of the catalog, the value is null."
+)
+
+
 @router.get("/results/", response_model=List[ValidationResult])
-def query_results(
+async def query_results(
+    response: Response,
     passed: List[bool] = Query(None),
     project_id: List[int] = Query(None),
     model_instance_id: List[UUID] = Query(
@@ -44,15 +109,97 @@ def query_results(
     score_type: List[ScoreType] = None,
     size: int = Query(100),
     from_index: int = Query(0),
+    cursor: str = Query(None, description=CURSOR_DESCRIPTION),
+    backend: ResultsBackend = Query(
+        None,
+        description="Search the local copy of the catalog, or search with the KG Query API "
+        "or with the Nexus API (by default, the local copy if it is recent enough, "
+        "otherwise the API set by the server)"
+    ),
+    max_staleness: float = Query(None, description=MAX_STALENESS_DESCRIPTION),
+    normalization: Normalization = Query(None, description=NORMALIZATION_DESCRIPTION),
     # from header
+    accept: str = Header(None),
     token: HTTPAuthorizationCredentials = Depends(auth),
 ):
-    return _query_results(passed, project_id, model_instance_id, test_instance_id, model_id, test_id, model_alias, test_alias, score_type,  size,
+    """
+    Search for validation results. The total number of matching results is returned
+    in the `X-Total-Count` header.
+
+    With `Accept: application/x-ndjson`, results are streamed as newline-delimited JSON,
+    each one being sent as soon as it is ready. Streaming always uses the Nexus API,
+    unless the local copy of the catalog is used.
+    """
+    table = await scores.ready() if normalization else None
+    replica = None
+    if backend in (None, ResultsBackend.replica) and cursor is None:
+        replica = catalog.fresh_replica(max_staleness)
+    if replica is not None:
+        results, total = await catalog.replica_call(
+            replica.query_results,
+            {
+                "passed": passed,
+                "project_id": project_id,
+                "model_instance_id": model_instance_id,
+                "test_instance_id": test_instance_id,
+                "model_id": model_id,
+                "test_id": test_id,
+                "model_alias": model_alias,
+                "test_alias": test_alias,
+                "score_type": [item.value for item in score_type] if score_type else None,
+            },
+            size,
+            from_index,
+        )
+        if normalization:
+            _set_normalized_scores(results, table, normalization)
+        headers = dict(
+            catalog.replica_age_header(replica),
+            **{"X-Total-Count": str(total), "X-Results-Backend": ResultsBackend.replica.value}
+        )
+        if wants_ndjson(accept):
+            return ndjson_response(single_chunk(results), headers=headers)
+        return JSONResponse(jsonable_encoder(results), headers=headers)
+    if wants_ndjson(accept):
+        return await _stream_results(passed, project_id, model_instance_id, test_instance_id, model_id, test_id, model_alias, test_alias, score_type,  size,
+from_index, token, cursor, normalization, table)
+    page = None
+    if backend in (None, ResultsBackend.replica):
+        backend = settings.RESULTS_BACKEND
+    if backend == ResultsBackend.kg_query and cursor is None:
+        page = await _query_results2(passed, project_id, model_instance_id, test_instance_id, model_id, test_id, model_alias, test_alias, score_type,  size,
 from_index, token)
+    if page is None:
+        backend = ResultsBackend.nexus
+        page = await _query_results(passed, project_id, model_instance_id, test_instance_id, model_id, test_id, model_alias, test_alias, score_type,  size,
+from_index, token, cursor)
+    results, total, next_cursor = page
+    _set_pagination_headers(response, total, next_cursor)
+    response.headers["X-Results-Backend"] = ResultsBackend(backend).value
+    if normalization:
+        _set_normalized_scores(results, table, normalization)
+    return results
 
 
-def _query_results(passed, project_id, model_instance_id, test_instance_id, model_id, test_id, model_alias, test_alias, score_type,  size,
-from_index, token):
+def _set_normalized_scores(results, table, normalization):
+    """
+    Replace the normalized scores of results (`ValidationResult` objects,
+    or their JSON representations) by those computed in the score table
+    """
+    normalized = table.normalized_scores(
+        [result["id"] if isinstance(result, dict) else result.id for result in results],
+        normalization.value,
+    )
+    for result in results:
+        if isinstance(result, dict):
+            result["normalized_score"] = normalized.get(str(result["id"]))
+        else:
+            result.normalized_score = normalized.get(str(result.id))
+    return results
+
+
+async def _query_results(passed, project_id, model_instance_id, test_instance_id, model_id, test_id, model_alias, test_alias, score_type,  size,
+from_index, token, cursor=None):
     filter_query, context = build_result_filters(
         model_instance_id,
         test_instance_id,
@@ -65,80 +212,454 @@ from_index, token):
         project_id,
         kg_client,
     )
-    if len(filter_query["value"]) > 0:
-        logger.info(f"Searching for ValidationResult with the following query: {filter_query}")
-        # note that from_index is not currently supported by KGQuery.resolve
-        query = KGQuery(ValidationResultKG, {"nexus": filter_query}, context)
-        results = query.resolve(kg_client, api="nexus", size=size)
-    else:
-        results = ValidationResultKG.list(kg_client, api="nexus", size=size, from_index=from_index)
+    results, total, next_cursor = await _get_result_page(filter_query, context, size, from_index, cursor)
+    return await _convert_results(results), total, next_cursor
+
+
+async def _convert_results(results):
+    objects = await asyncio.gather(
+        *(kg_call(ValidationResult.from_kg_object, result, kg_client) for result in results),
+        return_exceptions=True
+    )
     response = []
-    for result in results:
-        try:
-            obj = ValidationResult.from_kg_object(result, kg_client)
-        except ConsistencyError as err:  # todo: count these and report them in the response
-            logger.warning(str(err))
+    for obj in objects:
+        if isinstance(obj, ConsistencyError):  # todo: count these and report them in the response
+            logger.warning(str(obj))
+        elif isinstance(obj, Exception):
+            raise obj
         else:
             response.append(obj)
     return response
 
 
-def expand_combinations(D):
-    keys, values = zip(*D.items())
-    return [dict(zip(keys, v)) for v in itertools.product(*[as_list(v) for v in values])]
+async def _stream_results(passed, project_id, model_instance_id, test_instance_id, model_id, test_id, model_alias, test_alias, score_type,  size,
+from_index, token, cursor=None, normalization=None, table=None):
+    if cursor is not None:
+        # the page must be complete before we know the next cursor
+        results, total, next_cursor = await _query_results(passed, project_id, model_instance_id, test_instance_id, model_id, test_id, model_alias, test_alias, score_type,  size,
+from_index, token, cursor)
+        chunks = single_chunk(results)
+    else:
+        filter_query, context = build_result_filters(
+            model_instance_id,
+            test_instance_id,
+            model_id,
+            test_id,
+            model_alias,
+            test_alias,
+            score_type,
+            passed,
+            project_id,
+            kg_client,
+        )
+
+        async def fetch(start, limit):
+            return await kg_call(
+                query_kg_objects, ValidationResultKG, filter_query, context, kg_client,
+                size=limit, from_index=start
+            )
+
+        total = await kg_call(count_kg_objects, ValidationResultKG, filter_query, context, kg_client)
+        next_cursor = None
+        chunks = fetch_in_chunks(fetch, _convert_results, size, from_index)
+    if normalization:
+        chunks = _normalized_chunks(chunks, table, normalization)
+    response = ndjson_response(chunks, headers={"X-Results-Backend": ResultsBackend.nexus.value})
+    _set_pagination_headers(response, total, next_cursor)
+    return response
+
+
+async def _normalized_chunks(chunks, table, normalization):
+    async for results in chunks:
+        yield _set_normalized_scores(results, table, normalization)
+
+
+async def _get_result_page(filter_query, context, size, from_index, cursor=None):
+    if len(filter_query["value"]) > 0:
+        logger.info(f"Searching for ValidationResult with the following query: {filter_query}")
+    if cursor is not None:
+        if from_index:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="'cursor' and 'from_index' cannot be used together",
+            )
+        (results, next_cursor), total = await asyncio.gather(
+            _get_result_page_by_cursor(filter_query, context, size, cursor),
+            kg_call(count_kg_objects, ValidationResultKG, filter_query, context, kg_client),
+        )
+        return results, total, next_cursor
+    results, total = await asyncio.gather(
+        kg_call(
+            query_kg_objects, ValidationResultKG, filter_query, context, kg_client,
+            size=size, from_index=from_index
+        ),
+        kg_call(count_kg_objects, ValidationResultKG, filter_query, context, kg_client),
+    )
+    return results, total, None
+
+
+def _set_pagination_headers(response, total, next_cursor):
+    if total is not None:
+        response.headers["X-Total-Count"] = str(total)
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+
+
+def _encode_cursor(timestamp, result_id, window):
+    data = json.dumps({"t": timestamp.isoformat(), "id": result_id, "w": window})
+    return base64.urlsafe_b64encode(data.encode("utf-8")).decode("ascii")
+
+
+def _decode_cursor(cursor):
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return datetime.fromisoformat(data["t"]), data["id"], float(data["w"])
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail=f"Invalid cursor: '{cursor}'"
+        )
+
+
+def _sort_key(result):
+    return ensure_has_timezone(result.timestamp), result.uuid
+
+
+def _add_conditions(filter_query, *conditions):
+    return {"op": "and", "value": filter_query["value"] + list(conditions)}
+
+
+async def _get_all_results(filter_query, context):
+    results = []
+    while True:
+        batch = await kg_call(
+            query_kg_objects, ValidationResultKG, filter_query, context, kg_client,
+            size=settings.RESULTS_CURSOR_BATCH_SIZE, from_index=len(results)
+        )
+        results.extend(batch)
+        if len(batch) < settings.RESULTS_CURSOR_BATCH_SIZE:
+            return results
+
 
+MIN_CURSOR_WINDOW = 0.001  # seconds, below which all the results in a window are retrieved
 
-def _query_results2(passed, project_id, model_instance_id, test_instance_id, model_id, test_id, model_alias, test_alias, score_type,  size,
+
+async def _get_window(filter_query, context, upper, window, limit):
+    """
+    Return the results with a timestamp in the window (upper - window, upper],
+    together with the length of the window.
+
+    If the window holds more than `limit` results, it is shortened (keeping its upper bound)
+    until it does not, so that the work done depends on `limit`, not on the number
+    of results in the window.
+    """
+    while True:
+        window_query = _add_conditions(
+            filter_query,
+            {"path": "schema:dateCreated", "op": "lte", "value": upper.isoformat()},
+            {"path": "schema:dateCreated", "op": "gt", "value": (upper - timedelta(seconds=window)).isoformat()},
+        )
+        if window <= MIN_CURSOR_WINDOW:
+            # many results with the same timestamp
+            return await _get_all_results(window_query, context), window
+        results = await kg_call(
+            query_kg_objects, ValidationResultKG, window_query, context, kg_client,
+            size=limit + 1, from_index=0
+        )
+        if len(results) <= limit:
+            return results, window
+        window /= 2
+
+
+async def _get_result_page_by_cursor(filter_query, context, size, cursor):
+    """
+    Return a page of results in reverse chronological order, ordered by (timestamp, id),
+    starting after the position given by `cursor` (or with the most recent result if
+    `cursor` is empty), together with the cursor for the next page.
+
+    The Nexus API cannot sort, so we search backwards in time through windows of
+    increasing length until the page is full. A window holding more results than are
+    needed for the page is shortened, so that the work done depends on the page size,
+    not on the density of results. The cursor records the window length reached,
+    so that following pages start with a suitable one. Results posted after the first page was retrieved do not
+    shift later pages.
+
+    The timestamp (schema:dateCreated) is the one given by the client, so a result posted
+    later with an older timestamp than the cursor is skipped. Nexus does not let us filter
+    on its own creation time, which would avoid this, so the limitation is documented
+    in the description of the `cursor` parameter.
+    """
+    if cursor:
+        before, before_id, window = _decode_cursor(cursor)
+        before = ensure_has_timezone(before)
+    else:
+        before, before_id, window = datetime.now(timezone.utc), None, settings.RESULTS_CURSOR_WINDOW
+    found = []
+    exhausted = False
+    upper = before
+    while len(found) <= size:
+        results, window = await _get_window(filter_query, context, upper, window, size + 1)
+        lower = upper - timedelta(seconds=window)
+        found.extend(
+            result
+            for result in results
+            if result.timestamp and (before_id is None or _sort_key(result) < (before, before_id))
+        )
+        if len(found) > size:
+            break
+        remaining = await kg_call(
+            count_kg_objects,
+            ValidationResultKG,
+            _add_conditions(
+                filter_query,
+                {"path": "schema:dateCreated", "op": "lte", "value": lower.isoformat()},
+            ),
+            context,
+            kg_client,
+        )
+        if remaining == 0:
+            exhausted = True
+            break
+        upper = lower
+        window *= 2
+    found.sort(key=_sort_key, reverse=True)
+    page = found[:size]
+    if exhausted and len(found) <= size or not page:
+        return page, None
+    if len(found) > 2 * size:
+        # the last window was larger than needed, use a smaller one for the next page
+        window = max(window * size / len(found), MIN_CURSOR_WINDOW)
+    last_timestamp, last_id = _sort_key(page[-1])
+    return page, _encode_cursor(last_timestamp, last_id, window)
+
+
+def _kg_query_parameter(value):
+    if isinstance(value, Enum):
+        return value.value
+    elif isinstance(value, bool):
+        return str(value).lower()
+    return str(value)
+
+
+async def _query_results2(passed, project_id, model_instance_id, test_instance_id, model_id, test_id, model_alias, test_alias, score_type,  size,
 from_index, token):
-    # todo : more sophisticated handling of size and from_index
-    path = "/modelvalidation/simulation/validationresult/v0.1.0"
-    query_id = "test"  # "vf"
-    scope = SCOPE_MAP["latest"]
+    """
+    Search for results using a stored query in the KG Query API, which returns the results
+    together with the IDs of their model and test instances, so no further requests are needed.
+
+    Filters with several values are passed in a single query where the stored query supports
+    this, otherwise the search is split into sub-queries, which are run concurrently.
+    Returns None if the search would need too many sub-queries, or if the KG Query API fails,
+    in which case the Nexus API should be used instead.
+    """
+    filters = {
+        "passed": passed,
+        "project_id": project_id,
+        "model_instance_id": model_instance_id,
+        "test_instance_id": test_instance_id,
+        "model_id": model_id,
+        "test_id": test_id,
+        "model_alias": model_alias,
+        "test_alias": test_alias,
+        "score_type": score_type,
+    }
+    plan = plan_queries(filters, settings.KG_QUERY_MULTI_VALUED_FILTERS)
+    if len(plan) > settings.RESULTS_MAX_SUBQUERIES:
+        return None
+    try:
+        if len(plan) == 1:
+            response, total = await _kg_query_results(plan[0], from_index, size)
+        else:
+            # the sub-queries cannot be paginated individually, so each must return
+            # everything up to the end of the requested page
+            response, total = await _merge_unique(
+                (_kg_query_results(query_filters, 0, from_index + size) for query_filters in plan),
+                limit=from_index + size,
+                max_concurrency=settings.RESULTS_SUBQUERY_CONCURRENCY,
+            )
+            response = response[from_index:]
+    except (RequestException, HTTPException, KeyError, TypeError, ValueError) as err:
+        # the KG Query API may be unavailable, slow (kg_call raises a 504 error),
+        # or return results whose structure is not the one expected
+        if isinstance(err, HTTPException) and err.status_code < 500:
+            raise
+        logger.warning(f"KG Query API search for results failed, falling back to Nexus: {err!r}")
+        metrics.increment("results.kg_query_fallbacks")
+        return None
+    return response, total, None
+
+
+async def _kg_query_results(query_filters, start, size):
     query_parameters = {
-        "start": 0,   #from_index,
-        "size": 100000,  #size,
+        "start": start,
+        "size": size,
         "vocab": "https://schema.hbp.eu/myQuery/",
-        "scope": scope
+        "scope": SCOPE_MAP["latest"],
     }
-    for filter_name in ("passed", "project_id", "model_instance_id", "test_instance_id",
-                        "model_id", "test_id", "model_alias", "test_alias", "score_type"):
-        value = locals()[filter_name]
-        if value is not None:
-            query_parameters[filter_name] = value
-    query_parameters_list = expand_combinations(query_parameters)
+    for filter_name, value in query_filters.items():
+        if isinstance(value, list):
+            query_parameters[filter_name] = [_kg_query_parameter(item) for item in value]
+        else:
+            query_parameters[filter_name] = _kg_query_parameter(value)
+    url = (
+        f"{settings.KG_QUERY_RESULTS_PATH}/{settings.KG_QUERY_RESULTS_ID}/instances?"
+        + urlencode(query_parameters, doseq=True)
+    )
+    logger.debug(f"Searching for ValidationResult with the KG Query API: {url}")
+    kg_response = await kg_call(kg_client._kg_query_client.get, url)
     response = []
-    for query_parameters in query_parameters_list:
-        query_string = urlencode(query_parameters, doseq=True)
-        url = f"{path}/{query_id}/instances?" + query_string
-        print(url)
+    for result in kg_response.get("results", []):
         try:
-            kg_response = kg_client._kg_query_client.get(url)
-        except HTTPError as err:
-            if err.response.status_code == 403:
-                kg_response = None
-            else:
-                raise
-        if kg_response and "results" in kg_response:
-            for result in kg_response["results"]:
-                try:
-                    obj = ValidationResult.from_kg_query(result)
-                except ConsistencyError as err:  # todo: count these and report them in the response
-                    logger.warning(str(err))
-                else:
-                    response.append(obj)
-                if len(response) >= size + from_index:
-                    break
-            if len(response) >= size + from_index:
+            obj = ValidationResult.from_kg_query(result)
+        except ConsistencyError as err:  # todo: count these and report them in the response
+            logger.warning(str(err))
+        else:
+            response.append(obj)
+    return response, kg_response.get("total", len(response))
+
+
+async def _merge_unique(queries, limit, max_concurrency):
+    """
+    Run queries concurrently, at most `max_concurrency` at a time, and merge their results,
+    in the order the queries were given, without duplicates.
+
+    Results matching several queries are only counted once, so the total number of results
+    is only known if every query returned all of its matches (at most `limit`),
+    otherwise it is returned as None. As soon as `limit` results have been collected,
+    any queries still pending are cancelled.
+    """
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def run(query):
+        async with semaphore:
+            return await query
+
+    tasks = [asyncio.ensure_future(run(query)) for query in queries]
+    merged = []
+    seen = set()
+    complete = True
+    try:
+        for task in tasks:
+            results, query_total = await task
+            complete = complete and query_total <= limit
+            for result in results:
+                if result.uri not in seen:
+                    seen.add(result.uri)
+                    merged.append(result)
+            if len(merged) >= limit:
+                complete = complete and task is tasks[-1]
                 break
-    return response[from_index:from_index + size]
+    finally:
+        for task in tasks:
+            task.cancel()
+    return merged[:limit], len(seen) if complete else None
+
+
+@router.get("/results/matrix", response_model=ScoreMatrix)
+async def get_score_matrix(
+    model_instance_id: List[UUID] = Query(None),
+    model_id: List[UUID] = Query(None),
+    test_instance_id: List[UUID] = Query(None),
+    test_id: List[UUID] = Query(None),
+    score_type: List[ScoreType] = None,
+    statistic: List[MatrixStatistic] = Query(
+        None, description="Statistics to return for each cell (by default, all of them)"
+    ),
+    # from header
+    accept: str = Header(None),
+    token: HTTPAuthorizationCredentials = Depends(auth),
+):
+    """
+    Number, mean, most recent and best of the scores of each model instance for each test instance,
+    for those model instances and test instances which have results. The best z-score is
+    the one closest to zero, for other score types it is the highest score.
+
+    The matrix is given in columnar form: the IDs of the model instances (the rows)
+    and of the test instances (the columns), then for each cell with results its row and column
+    indices and its statistics. With `Accept: application/x-npz`, the columns are returned
+    as NumPy arrays, to be read with `numpy.load()`.
+
+    This needs the local copy of the catalog, whose age is given in the `X-Catalog-Replica-Age` header.
+    """
+    table = await scores.ready()
+    matrix = table.matrix(
+        model_instance_ids=model_instance_id,
+        model_ids=model_id,
+        test_instance_ids=test_instance_id,
+        test_ids=test_id,
+        score_types=[item.value for item in score_type] if score_type else None,
+    )
+    if statistic:
+        selected = set(item.value for item in statistic)
+        if "latest" in selected:
+            selected.add("latest_timestamp")
+        for name in ("count", "mean", "latest", "latest_timestamp", "best"):
+            if name not in selected:
+                del matrix[name]
+    headers = catalog.replica_age_header(catalog.get_replica())
+    if scores.wants_npz(accept):
+        return scores.npz_response(matrix, headers=headers)
+    return JSONResponse(scores.jsonable_columns(matrix), headers=headers)
+
+
+@router.get("/results/stats", response_model=ScoreStatistics)
+async def get_score_statistics(
+    group_by: StatisticsGroup = Query(StatisticsGroup.test),
+    percentile: List[float] = Query([5, 25, 50, 75, 95]),
+    passed: List[bool] = Query(None),
+    project_id: List[int] = Query(None),
+    model_instance_id: List[UUID] = Query(None),
+    test_instance_id: List[UUID] = Query(None),
+    model_id: List[UUID] = Query(None),
+    test_id: List[UUID] = Query(None),
+    score_type: List[ScoreType] = None,
+    # from header
+    accept: str = Header(None),
+    token: HTTPAuthorizationCredentials = Depends(auth),
+):
+    """
+    Number of results, and the mean, standard deviation, minimum, maximum and percentiles
+    of their scores, and the fraction of them which passed (of those for which this is known),
+    for the results matching the filters, grouped by test, model, score type or project
+    (or by test instance or model instance).
+
+    The statistics are given in columnar form, as for `/results/matrix`, and may be returned
+    as NumPy arrays with `Accept: application/x-npz`.
+    """
+    if any(not 0 <= q <= 100 for q in percentile):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Percentiles must be between 0 and 100",
+        )
+    table = await scores.ready()
+    statistics = scores.cached_statistics(
+        table,
+        group_by.value,
+        percentile,
+        passed=passed,
+        project_ids=project_id,
+        model_instance_ids=model_instance_id,
+        test_instance_ids=test_instance_id,
+        model_ids=model_id,
+        test_ids=test_id,
+        score_types=[item.value for item in score_type] if score_type else None,
+    )
+    headers = catalog.replica_age_header(catalog.get_replica())
+    if scores.wants_npz(accept):
+        return scores.npz_response(statistics, headers=headers)
+    return JSONResponse(scores.jsonable_columns(statistics), headers=headers)
 
 
 @router.get("/results/{result_id}", response_model=ValidationResult)
-def get_result(result_id: UUID, token: HTTPAuthorizationCredentials = Depends(auth)):
-    result = ValidationResultKG.from_uuid(str(result_id), kg_client, api="nexus")
+async def get_result(
+    result_id: UUID,
+    normalization: Normalization = Query(None, description=NORMALIZATION_DESCRIPTION),
+    token: HTTPAuthorizationCredentials = Depends(auth),
+):
+    table = await scores.ready() if normalization else None
+    result = await kg_call(get_by_uuid, ValidationResultKG, str(result_id), kg_client)
     if result:
         try:
-            obj = ValidationResult.from_kg_object(result, kg_client)
+            obj = await kg_call(ValidationResult.from_kg_object, result, kg_client)
         except ConsistencyError as err:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(err))
     else:
@@ -146,11 +667,14 @@ def get_result(result_id: UUID, token: HTTPAuthorizationCredentials = Depends(au
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f"Validation result {result_id} not found.",
         )
+    if normalization:
+        _set_normalized_scores([obj], table, normalization)
     return obj
 
 
 @router.get("/results-extended/", response_model=List[ValidationResultWithTestAndModel])
 async def query_results_extended(
+    response: Response,
     passed: List[bool] = Query(None),
     project_id: List[int] = Query(None),
     model_instance_id: List[UUID] = Query(
@@ -164,9 +688,12 @@ async def query_results_extended(
     score_type: List[ScoreType] = None,
     size: int = Query(100),
     from_index: int = Query(0),
+    cursor: str = Query(None, description=CURSOR_DESCRIPTION),
+    normalization: Normalization = Query(None, description=NORMALIZATION_DESCRIPTION),
     # from header
     token: HTTPAuthorizationCredentials = Depends(auth),
 ):
+    table = await scores.ready() if normalization else None
     filter_query, context = build_result_filters(
         model_instance_id,
         test_instance_id,
@@ -179,28 +706,22 @@ async def query_results_extended(
         project_id,
         kg_client,
     )
-    if len(filter_query["value"]) > 0:
-        logger.info(f"Searching for ValidationResult with the following query: {filter_query}")
-        # note that from_index is not currently supported by KGQuery.resolve
-        query = KGQuery(ValidationResultKG, {"nexus": filter_query}, context)
-        results = query.resolve(kg_client, api="nexus", size=size)
-    else:
-        results = ValidationResultKG.list(kg_client, api="nexus", size=size, from_index=from_index)
-    response = []
-    for result in results:
-        try:
-            obj = await ValidationResultWithTestAndModel.from_kg_object(result, kg_client, token)
-        except ConsistencyError as err:  # todo: count these and report them in the response
-            logger.warning(str(err))
-        else:
-            response.append(obj)
-    return response
+    results, total, next_cursor = await _get_result_page(filter_query, context, size, from_index, cursor)
+    _set_pagination_headers(response, total, next_cursor)
+    results = await ValidationResultWithTestAndModel.from_kg_objects(results, kg_client, token)
+    if normalization:
+        _set_normalized_scores(results, table, normalization)
+    return results
 
 
 @router.get("/results-extended/{result_id}", response_model=ValidationResultWithTestAndModel)
-async def get_result_extended(result_id: UUID,
-                     token: HTTPAuthorizationCredentials = Depends(auth)):
-    result = ValidationResultKG.from_uuid(str(result_id), kg_client, api="nexus")
+async def get_result_extended(
+    result_id: UUID,
+    normalization: Normalization = Query(None, description=NORMALIZATION_DESCRIPTION),
+    token: HTTPAuthorizationCredentials = Depends(auth),
+):
+    table = await scores.ready() if normalization else None
+    result = await kg_call(get_by_uuid, ValidationResultKG, str(result_id), kg_client)
     if result:
         try:
             obj = await ValidationResultWithTestAndModel.from_kg_object(result, kg_client, token)
@@ -211,38 +732,157 @@ async def get_result_extended(result_id: UUID,
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f"Validation result {result_id} not found.",
         )
+    if normalization:
+        _set_normalized_scores([obj], table, normalization)
     return obj
 
 
-@router.post("/results/", response_model=ValidationResult, status_code=status.HTTP_201_CREATED)
-def create_result(result: ValidationResult, token: HTTPAuthorizationCredentials = Depends(auth)):
+@router.post("/results/", response_model=ValidationResult, status_code=status.HTTP_201_CREATED,
+             responses={status.HTTP_202_ACCEPTED: {"model": IngestionJob}})
+async def create_result(
+    result: ValidationResult,
+    prefer: str = Header(None),
+    idempotency_key: str = Header(None),
+    token: HTTPAuthorizationCredentials = Depends(auth)
+):
+    """
+    Store a validation result.
+
+    With `Prefer: respond-async`, the result is queued to be stored in the background,
+    and the response (status code 202) gives the URL for following its progress in the
+    `Location` header. Submissions with the same `Idempotency-Key` header are only stored once.
+    """
+    if ingestion.wants_async(prefer):
+        return await ingestion.accepted("result", result.json(), idempotency_key)
+    return await _store_result(result)
+
+
+async def _store_result(result, progress=None):
     logger.info("Beginning post result")
-    kg_objects = result.to_kg_objects(kg_client)
+    kg_objects = await kg_call(result.to_kg_objects, kg_client)
     logger.info("Created objects")
-    for obj in kg_objects:
-        obj.save(kg_client)
+    result_kg = await _save_result(kg_objects, progress)
     logger.info("Saved objects")
-    result_kg = kg_objects[-2]
-    activity_kg = kg_objects[-1]
-    assert isinstance(result_kg, ValidationResultKG)
+    # all the objects linked from the result are in memory, so this does not access the KG
+    stored = ValidationResult.from_kg_object(result_kg, kg_client)
+    await catalog.store_result(stored)
+    await scores.add_result(stored)
+    return stored
+
+
+async def _store_queued_result(payload, progress):
+    result = ValidationResult.parse_raw(payload)
+    if result.timestamp is None:
+        result.timestamp = await progress.started_at()
+    stored = await _store_result(result, progress)
+    return stored.id
+
+
+ingestion.register_handler("result", _store_queued_result)
+
+
+async def _save_result(kg_objects, progress=None):
+    """
+    Save the objects created by `ValidationResult.to_kg_objects()`,
+    skipping those already saved by a previous attempt at the same ingestion job (`progress`).
+
+    The files and the reference data do not depend on each other, and are saved concurrently,
+    then the activity, which links to the reference data, then the result,
+    which links to all the others. Finally the activity is saved again with the inverse
+    link to the result (prov:generated), which other KG clients may rely on.
+    """
+    *dependencies, activity_kg, result_kg = kg_objects
     assert isinstance(activity_kg, ValidationActivity)
-    result_kg.generated_by = activity_kg
-    result_kg.save(kg_client)
-    return ValidationResult.from_kg_object(result_kg, kg_client)
+    assert isinstance(result_kg, ValidationResultKG)
+    await asyncio.gather(*(
+        ingestion.save_once(obj, kg_client, progress, f"dependency.{i}")
+        for i, obj in enumerate(dependencies)
+    ))
+    await ingestion.save_once(activity_kg, kg_client, progress, "activity")
+    await ingestion.save_once(result_kg, kg_client, progress, "result")
+    activity_kg.result = result_kg
+    await ingestion.save_once(activity_kg, kg_client, progress, "activity.generated")
+    return result_kg
+
+
+@router.post("/results/bulk", response_model=List[ValidationResultStatus])
+async def create_results(results: List[ValidationResult], token: HTTPAuthorizationCredentials = Depends(auth)):
+    """
+    Store a batch of validation results.
+
+    Each distinct test instance and model instance is retrieved only once for the whole batch.
+    A failure to store one result does not affect the others: the response contains
+    the status of each result, in the same order as the request
+    (status code 201 and the stored result, or an error status code and the reason for the failure).
+    """
+    if len(results) > settings.BULK_RESULTS_MAX_ITEMS:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"At most {settings.BULK_RESULTS_MAX_ITEMS} results may be submitted at once",
+        )
+    test_instance_ids = list(set(result.test_instance_id for result in results))
+    model_instance_ids = list(set(result.model_instance_id for result in results))
+    lookups = await asyncio.gather(
+        *(kg_call(_get_test_script_and_definition, test_instance_id, kg_client)
+          for test_instance_id in test_instance_ids),
+        *(kg_call(_get_model_instance_by_id_no_access_check, model_instance_id, kg_client)
+          for model_instance_id in model_instance_ids),
+        return_exceptions=True
+    )
+    test_instances = dict(zip(test_instance_ids, lookups[:len(test_instance_ids)]))
+    model_instances = dict(zip(model_instance_ids, lookups[len(test_instance_ids):]))
+    semaphore = asyncio.Semaphore(settings.BULK_RESULTS_CONCURRENCY)
+
+    async def create(index, result):
+        try:
+            for found in (test_instances[result.test_instance_id], model_instances[result.model_instance_id]):
+                if isinstance(found, Exception):
+                    raise found
+            test_code, test_definition = test_instances[result.test_instance_id]
+            async with semaphore:
+                kg_objects = await kg_call(
+                    result.to_kg_objects, kg_client,
+                    test_code=test_code,
+                    test_definition=test_definition,
+                    model_instance=model_instances[result.model_instance_id]
+                )
+                result_kg = await _save_result(kg_objects)
+            stored = ValidationResult.from_kg_object(result_kg, kg_client)
+            await catalog.store_result(stored)
+            await scores.add_result(stored)
+        except HTTPException as err:
+            return ValidationResultStatus(index=index, status_code=err.status_code, detail=err.detail)
+        except Exception as err:
+            logger.error(f"Unable to store result {index} of batch: {err}")
+            return ValidationResultStatus(
+                index=index,
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail=str(err) or err.__class__.__name__
+            )
+        return ValidationResultStatus(index=index, status_code=status.HTTP_201_CREATED, result=stored)
+
+    statuses = await asyncio.gather(*(create(index, result) for index, result in enumerate(results)))
+    logger.info(
+        f"Stored {sum(item.status_code == status.HTTP_201_CREATED for item in statuses)} "
+        f"of {len(results)} results"
+    )
+    return statuses
 
 
 @router.delete("/results/{result_id}", status_code=status.HTTP_200_OK)
 async def delete_result(result_id: UUID, token: HTTPAuthorizationCredentials = Depends(auth)):
     # todo: handle non-existent UUID
-    result = ValidationResultKG.from_uuid(str(result_id), kg_client, api="nexus")
+    result = await kg_call(get_by_uuid, ValidationResultKG, str(result_id), kg_client)
     if not await is_admin(token.credentials):
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Deleting validation results is restricted to admins",
         )
     for item in as_list(result.additional_data):
-        item.delete(kg_client)
+        await kg_call(delete_object, item, kg_client)
         # todo: check whether the result has been used in further analysis
         #       if so, we should probably disallow deletion unless forced
-    result.generated_by.delete(kg_client)
-    result.delete(kg_client)
+    await kg_call(delete_object, result.generated_by, kg_client)
+    await kg_call(delete_object, result, kg_client)
+    await catalog.remove_result(result_id)
+    scores.remove_result(result_id)
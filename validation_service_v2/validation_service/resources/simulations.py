@@ -17,8 +17,10 @@ from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from pydantic import ValidationError
 
 from ..auth import get_kg_client, get_user_from_token
-from ..data_models import Simulation, ConsistencyError
-from .. import settings
+from ..data_models import Simulation, ConsistencyError, IngestionJob
+from ..kg_executor import kg_call
+from ..kg_resolver import get_by_uuid
+from .. import settings, ingestion
 
 
 logger = logging.getLogger("validation_service_v2")
@@ -41,11 +43,13 @@ def query_simulations(
 
 
 @router.get("/simulations/{simulation_id}", response_model=Simulation)
-def get_simulation(simulation_id: UUID, token: HTTPAuthorizationCredentials = Depends(auth)):
-    simulation_activity = fairgraph.brainsimulation.Simulation.from_uuid(str(simulation_id), kg_client, api="nexus")
+async def get_simulation(simulation_id: UUID, token: HTTPAuthorizationCredentials = Depends(auth)):
+    simulation_activity = await kg_call(
+        get_by_uuid, fairgraph.brainsimulation.Simulation, str(simulation_id), kg_client
+    )
     if simulation_activity:
         try:
-            obj = Simulation.from_kg_object(simulation_activity, kg_client)
+            obj = await kg_call(Simulation.from_kg_object, simulation_activity, kg_client)
         except ConsistencyError as err:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(err))
     else:
@@ -56,17 +60,50 @@ def get_simulation(simulation_id: UUID, token: HTTPAuthorizationCredentials = De
     return obj
 
 
-@router.post("/simulations/", response_model=Simulation, status_code=status.HTTP_201_CREATED)
-def create_simulation(simulation: Simulation, token: HTTPAuthorizationCredentials = Depends(auth)):
+@router.post("/simulations/", response_model=Simulation, status_code=status.HTTP_201_CREATED,
+             responses={status.HTTP_202_ACCEPTED: {"model": IngestionJob}})
+async def create_simulation(
+    simulation: Simulation,
+    prefer: str = Header(None),
+    idempotency_key: str = Header(None),
+    token: HTTPAuthorizationCredentials = Depends(auth)
+):
+    """
+    Store a record of a simulation.
+
+    With `Prefer: respond-async`, the simulation is queued to be stored in the background,
+    and the response (status code 202) gives the URL for following its progress in the
+    `Location` header. Submissions with the same `Idempotency-Key` header are only stored once.
+    """
+    if ingestion.wants_async(prefer):
+        await simulation.prepare_for_queue(token)
+        return await ingestion.accepted("simulation", simulation.json(), idempotency_key)
+    return await _store_simulation(simulation, token)
+
+
+async def _store_simulation(simulation, token, progress=None):
     logger.info("Beginning post simulation")
-    kg_objects = simulation.to_kg_objects(kg_client, token)
+    kg_objects = await simulation.to_kg_objects(kg_client, token)
     logger.info("Created objects")
+    # with the progress of an ingestion job, objects saved by a previous attempt are not saved again
     for label in ('person', 'config', 'outputs', 'hardware', 'dependencies', 'env', 'activity'):
-        for obj in as_list(kg_objects[label]):
-            obj.save(kg_client)
-    for obj in as_list(kg_objects['outputs']):
+        for i, obj in enumerate(as_list(kg_objects[label])):
+            await ingestion.save_once(obj, kg_client, progress, f"{label}.{i}")
+    for i, obj in enumerate(as_list(kg_objects['outputs'])):
         obj.generated_by = kg_objects['activity']
-        obj.save(kg_client)
+        await ingestion.save_once(obj, kg_client, progress, f"outputs.{i}.generated_by")
     logger.info("Saved objects")
 
-    return Simulation.from_kg_object(kg_objects['activity'], kg_client)
+    return await kg_call(Simulation.from_kg_object, kg_objects['activity'], kg_client)
+
+
+async def _store_queued_simulation(payload, progress):
+    simulation = Simulation.parse_raw(payload)
+    if simulation.timestamp is None:
+        simulation.timestamp = await progress.started_at()
+    # prepare_for_queue() has already used the access token, so it is not needed here
+    stored = await _store_simulation(simulation, None, progress)
+    return stored.id
+
+
+ingestion.register_handler("simulation", _store_queued_simulation)
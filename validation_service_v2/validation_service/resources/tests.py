@@ -1,17 +1,24 @@
 from uuid import UUID
 from typing import List
 from datetime import datetime
+import asyncio
 import logging
 
-from fairgraph.base import KGQuery, as_list
+from fairgraph.base import as_list
 from fairgraph.brainsimulation import ValidationTestDefinition, ValidationScript
 
-from fastapi import APIRouter, Depends, Query, HTTPException, status
+from fastapi import APIRouter, Depends, Header, Query, HTTPException, Response, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from fastapi.responses import JSONResponse
+from fastapi.encoders import jsonable_encoder
 from pydantic import ValidationError
 
 from ..auth import get_kg_client, get_user_from_token, is_collab_member, is_admin
 from ..db import kg_client, _get_test_by_id_or_alias, _get_test_instance_by_id
+from ..kg_executor import kg_call
+from ..kg_resolver import resolve, get_by_uuid, save_object, delete_object
+from ..streaming import wants_ndjson, fetch_in_chunks, single_chunk, ndjson_response
+from ..catalog import MAX_STALENESS_DESCRIPTION
 from ..data_models import (
     Person,
     Species,
@@ -23,10 +30,16 @@ from ..data_models import (
     ValidationTest,
     ValidationTestInstance,
     ValidationTestPatch,
+    ValidationTestSummary,
     ValidationTestInstancePatch,
 )
-from ..queries import build_validation_test_filters, test_alias_exists
-from .. import settings
+from ..queries import (
+    build_validation_test_filters,
+    query_kg_objects,
+    count_kg_objects,
+)
+from .. import settings, catalog, search
+from ..aliases import test_aliases, test_alias_exists
 
 
 logger = logging.getLogger("validation_service_v2")
@@ -36,7 +49,8 @@ router = APIRouter()
 
 
 @router.get("/tests/")
-def query_tests(
+async def query_tests(
+    response: Response,
     alias: List[str] = Query(None),
     id: List[UUID] = Query(None),
     name: List[str] = Query(None),
@@ -49,11 +63,36 @@ def query_tests(
     test_type: List[ValidationTestType] = Query(None),
     score_type: List[ScoreType] = Query(None),
     author: List[str] = Query(None),
+    q: str = Query(
+        None,
+        description="Find tests whose name, alias, description or authors contain these words "
+        "(or words starting with them, or with similar spelling), most relevant first",
+    ),
     size: int = Query(100),
     from_index: int = Query(0),
+    summary: bool = Query(
+        False, description="Return only top-level information about each test, without instances"
+    ),
+    fields: List[str] = Query(
+        None, description="Return only these fields (implies `summary`, but any summary field may be chosen)"
+    ),
+    max_staleness: float = Query(None, description=MAX_STALENESS_DESCRIPTION),
     # from header
+    accept: str = Header(None),
     token: HTTPAuthorizationCredentials = Depends(auth),
 ):
+    """
+    Search for validation tests. The total number of matching tests is returned
+    in the `X-Total-Count` header.
+
+    With `Accept: application/x-ndjson`, tests are streamed as newline-delimited JSON,
+    each one being sent as soon as it is ready.
+
+    If the local copy of the catalog is recent enough, it is used to answer the request,
+    and its age is returned in the `X-Catalog-Replica-Age` header.
+    """
+    if summary or fields:
+        fields = ValidationTestSummary.select_fields(fields)
 
     # get the values of of the Enums
     if brain_region:
@@ -69,6 +108,31 @@ def query_tests(
     if score_type:
         score_type = [item.value for item in score_type]
 
+    filters = {
+        "alias": alias,
+        "id": id,
+        "name": name,
+        "implementation_status": implementation_status,
+        "brain_region": brain_region,
+        "species": species,
+        "cell_type": cell_type,
+        "data_type": data_type,
+        "recording_modality": recording_modality,
+        "test_type": test_type,
+        "score_type": score_type,
+        "author": author,
+    }
+    if q:
+        return await _search_tests(q, filters, size, from_index, fields, accept, max_staleness)
+
+    replica = catalog.fresh_replica(max_staleness)
+    if replica is not None:
+        tests, total = await catalog.replica_call(replica.query_tests, filters, size, from_index, fields)
+        headers = dict(catalog.replica_age_header(replica), **{"X-Total-Count": str(total)})
+        if wants_ndjson(accept):
+            return ndjson_response(single_chunk(tests), headers=headers)
+        return JSONResponse(jsonable_encoder(tests), headers=headers)
+
     filter_query, context = build_validation_test_filters(
         alias,
         id,
@@ -87,29 +151,107 @@ def query_tests(
         logger.info(
             f"Searching for ValidationTestDefinition with the following query: {filter_query}"
         )
-        # note that from_index is not currently supported by KGQuery.resolve
-        query = KGQuery(ValidationTestDefinition, {"nexus": filter_query}, context)
-        test_definitions = query.resolve(kg_client, api="nexus", size=size)
+
+    async def fetch(start, limit):
+        return await kg_call(
+            query_kg_objects, ValidationTestDefinition, filter_query, context, kg_client,
+            size=limit, from_index=start
+        )
+
+    async def convert(test_definitions):
+        if fields:
+            tests = await kg_call(
+                ValidationTestSummary.from_kg_objects, test_definitions, kg_client, fields
+            )
+            return [test.dict(include=fields) for test in tests]
+        return await kg_call(ValidationTest.from_kg_objects, test_definitions, kg_client)
+
+    if wants_ndjson(accept):
+        total = await kg_call(
+            count_kg_objects, ValidationTestDefinition, filter_query, context, kg_client
+        )
+        return ndjson_response(
+            fetch_in_chunks(fetch, convert, size, from_index), headers={"X-Total-Count": str(total)}
+        )
+    test_definitions, total = await asyncio.gather(
+        fetch(from_index, size),
+        kg_call(count_kg_objects, ValidationTestDefinition, filter_query, context, kg_client),
+    )
+    tests = await convert(test_definitions)
+    if fields:
+        return JSONResponse(jsonable_encoder(tests), headers={"X-Total-Count": str(total)})
+    response.headers["X-Total-Count"] = str(total)
+    return tests
+
+
+async def _search_tests(q, filters, size, from_index, fields, accept, max_staleness):
+    index = await search.ready(search.test_index)
+    documents = index.search(
+        q, lambda document: search.matches_filters(document, filters, people=("author",))
+    )
+    page = documents[from_index:from_index + size]
+    if fields and not fields.intersection({"instance_count", "data_location"}):
+        tests = [
+            {key: value for key, value in document.items() if key in fields} for document in page
+        ]
     else:
-        test_definitions = ValidationTestDefinition.list(
-            kg_client, api="nexus", size=size, from_index=from_index
+        tests = await _get_tests([document["id"] for document in page], max_staleness)
+        if fields:
+            tests = [
+                {
+                    key: value
+                    for key, value in dict(test, instance_count=len(test["instances"])).items()
+                    if key in fields
+                }
+                for test in tests
+            ]
+    headers = {"X-Total-Count": str(len(documents))}
+    if wants_ndjson(accept):
+        return ndjson_response(single_chunk(tests), headers=headers)
+    return JSONResponse(jsonable_encoder(tests), headers=headers)
+
+
+async def _get_tests(test_ids, max_staleness):
+    """Return the tests with the given IDs, in the same order, from the replica where possible"""
+    tests = {}
+    replica = catalog.fresh_replica(max_staleness)
+    if replica is not None:
+        for test_id in test_ids:
+            test = replica.get_test(test_id)
+            if test is not None:
+                tests[test_id] = test
+    missing = [test_id for test_id in test_ids if test_id not in tests]
+    if missing:
+        test_definitions = await asyncio.gather(
+            *(kg_call(get_by_uuid, ValidationTestDefinition, test_id, kg_client) for test_id in missing)
         )
-    return [
-        ValidationTest.from_kg_object(test_definition, kg_client)
-        for test_definition in test_definitions
-    ]
+        converted = await kg_call(
+            ValidationTest.from_kg_objects,
+            [test_definition for test_definition in test_definitions if test_definition],
+            kg_client,
+        )
+        tests.update((str(test.id), jsonable_encoder(test)) for test in converted)
+    return [tests[test_id] for test_id in test_ids if test_id in tests]
 
 
 @router.get("/tests/{test_id}", response_model=ValidationTest)
-def get_test(test_id: str, token: HTTPAuthorizationCredentials = Depends(auth)):
-    test_definition = _get_test_by_id_or_alias(test_id, token)
-    return ValidationTest.from_kg_object(test_definition, kg_client)
+async def get_test(
+    test_id: str,
+    max_staleness: float = Query(None, description=MAX_STALENESS_DESCRIPTION),
+    token: HTTPAuthorizationCredentials = Depends(auth),
+):
+    replica = catalog.fresh_replica(max_staleness)
+    test = replica.get_test(test_id) if replica else None
+    if test is not None:
+        return JSONResponse(jsonable_encoder(test), headers=catalog.replica_age_header(replica))
+    test_definition = await _get_test_by_id_or_alias(test_id, token)
+    return await kg_call(ValidationTest.from_kg_object, test_definition, kg_client)
 
 
 @router.post("/tests/", response_model=ValidationTest, status_code=status.HTTP_201_CREATED)
-def create_test(test: ValidationTest, token: HTTPAuthorizationCredentials = Depends(auth)):
+async def create_test(test: ValidationTest, token: HTTPAuthorizationCredentials = Depends(auth)):
     # check uniqueness of alias
-    if test.alias and test_alias_exists(test.alias, kg_client):
+    if test.alias and await test_alias_exists(test.alias):
         raise HTTPException(
             status_code=status.HTTP_409_CONFLICT,
             detail=f"Another validation test with alias '{test.alias}' already exists.",
@@ -123,7 +265,7 @@ def create_test(test: ValidationTest, token: HTTPAuthorizationCredentials = Depe
             test_definition = obj
         elif isinstance(obj, ValidationScript):
             recently_saved_scripts.append(obj)
-    if test_definition.exists(kg_client, api="any"):
+    if await kg_call(test_definition.exists, kg_client, api="any"):
         # see https://stackoverflow.com/questions/3825990/http-response-code-for-post-when-resource-already-exists
         # for a discussion of the most appropriate status code to use here
         raise HTTPException(
@@ -131,26 +273,33 @@ def create_test(test: ValidationTest, token: HTTPAuthorizationCredentials = Depe
             detail=f"Another validation test with the same name and timestamp already exists.",
         )
     for obj in kg_objects:
-        obj.save(kg_client)
-    return ValidationTest.from_kg_object(
+        await kg_call(save_object, obj, kg_client)
+    test = await kg_call(
+        ValidationTest.from_kg_object,
         test_definition, kg_client, recently_saved_scripts=recently_saved_scripts
     )
+    await catalog.store_test(test)
+    search.index_test(test)
+    test_aliases.set(test.id, test.alias)
+    return test
 
 
 @router.put("/tests/{test_id}", response_model=ValidationTest, status_code=status.HTTP_200_OK)
-def update_test(
+async def update_test(
     test_id: UUID,
     test_patch: ValidationTestPatch,
     token: HTTPAuthorizationCredentials = Depends(auth),
 ):
     # retrieve stored test
-    test_definition = ValidationTestDefinition.from_uuid(str(test_id), kg_client, api="nexus")
-    stored_test = ValidationTest.from_kg_object(test_definition, kg_client)
+    test_definition = await kg_call(
+        get_by_uuid, ValidationTestDefinition, str(test_id), kg_client
+    )
+    stored_test = await kg_call(ValidationTest.from_kg_object, test_definition, kg_client)
     # if alias changed, check uniqueness of new alias
     if (
         test_patch.alias
         and test_patch.alias != stored_test.alias
-        and test_alias_exists(test_patch.alias, kg_client)
+        and await test_alias_exists(test_patch.alias)
     ):
         raise HTTPException(
             status_code=status.HTTP_409_CONFLICT,
@@ -168,34 +317,45 @@ def update_test(
     updated_test = stored_test.copy(update=update_data)
     kg_objects = updated_test.to_kg_objects()
     for obj in kg_objects:
-        obj.save(kg_client)
+        await kg_call(save_object, obj, kg_client)
         if isinstance(obj, ValidationTestDefinition):
             test_definition = obj
-    return ValidationTest.from_kg_object(test_definition, kg_client)
+    test = await kg_call(ValidationTest.from_kg_object, test_definition, kg_client)
+    await catalog.store_test(test)
+    search.index_test(test)
+    test_aliases.set(test.id, test.alias)
+    return test
 
 
 @router.delete("/tests/{test_id}", status_code=status.HTTP_200_OK)
 async def delete_test(test_id: UUID, token: HTTPAuthorizationCredentials = Depends(auth)):
     # todo: handle non-existent UUID
-    test_definition = ValidationTestDefinition.from_uuid(str(test_id), kg_client, api="nexus")
+    test_definition = await kg_call(
+        get_by_uuid, ValidationTestDefinition, str(test_id), kg_client
+    )
     if not await is_admin(token.credentials):
         # todo: replace this check with a group membership check for Collab v2
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN, detail="Deleting tests is restricted to admins"
         )
-    test_definition.delete(kg_client)
-    for test_script in as_list(test_definition.scripts.resolve(kg_client, api="nexus")):
-        test_script.delete(kg_client)
+    await kg_call(delete_object, test_definition, kg_client)
+    test_scripts = await kg_call(test_definition.scripts.resolve, kg_client, api="nexus")
+    for test_script in as_list(test_scripts):
+        await kg_call(delete_object, test_script, kg_client)
+    await catalog.remove_test(test_id)
+    search.remove_test(test_id)
+    test_aliases.remove(test_id)
 
 
 @router.get("/tests/{test_id}/instances/", response_model=List[ValidationTestInstance])
-def get_test_instances(
+async def get_test_instances(
     test_id: str, version: str = Query(None), token: HTTPAuthorizationCredentials = Depends(auth)
 ):
-    test_definition = _get_test_by_id_or_alias(test_id, token)
+    test_definition = await _get_test_by_id_or_alias(test_id, token)
+    test_scripts = await kg_call(test_definition.scripts.resolve, kg_client, api="nexus")
     test_instances = [
         ValidationTestInstance.from_kg_object(inst, kg_client)
-        for inst in as_list(test_definition.scripts.resolve(kg_client, api="nexus"))
+        for inst in as_list(test_scripts)
     ]
     if version:
         test_instances = [inst for inst in test_instances if inst.version == version]
@@ -203,21 +363,22 @@ def get_test_instances(
 
 
 @router.get("/tests/query/instances/{test_instance_id}", response_model=ValidationTestInstance)
-def get_test_instance_from_instance_id(
+async def get_test_instance_from_instance_id(
     test_instance_id: UUID, token: HTTPAuthorizationCredentials = Depends(auth)
 ):
-    inst = _get_test_instance_by_id(test_instance_id, token)
+    inst = await _get_test_instance_by_id(test_instance_id, token)
     return ValidationTestInstance.from_kg_object(inst, kg_client)
 
 
 @router.get("/tests/{test_id}/instances/latest", response_model=ValidationTestInstance)
-def get_latest_test_instance_given_test_id(
+async def get_latest_test_instance_given_test_id(
     test_id: str, token: HTTPAuthorizationCredentials = Depends(auth)
 ):
-    test_definition = _get_test_by_id_or_alias(test_id, token)
+    test_definition = await _get_test_by_id_or_alias(test_id, token)
+    test_scripts = await kg_call(test_definition.scripts.resolve, kg_client, api="nexus")
     test_instances = [
         ValidationTestInstance.from_kg_object(inst, kg_client)
-        for inst in as_list(test_definition.scripts.resolve(kg_client, api="nexus"))
+        for inst in as_list(test_scripts)
     ]
     if len(test_instances) == 0:
         raise HTTPException(
@@ -229,11 +390,12 @@ def get_latest_test_instance_given_test_id(
 
 
 @router.get("/tests/{test_id}/instances/{test_instance_id}", response_model=ValidationTestInstance)
-def get_test_instance_given_test_id(
+async def get_test_instance_given_test_id(
     test_id: str, test_instance_id: UUID, token: HTTPAuthorizationCredentials = Depends(auth)
 ):
-    test_definition = _get_test_by_id_or_alias(test_id, token)
-    for inst in as_list(test_definition.scripts.resolve(kg_client, api="nexus")):
+    test_definition = await _get_test_by_id_or_alias(test_id, token)
+    test_scripts = await kg_call(test_definition.scripts.resolve, kg_client, api="nexus")
+    for inst in as_list(test_scripts):
         if UUID(inst.uuid) == test_instance_id:
             return ValidationTestInstance.from_kg_object(inst, kg_client)
     raise HTTPException(
@@ -243,10 +405,10 @@ def get_test_instance_given_test_id(
 
 
 @router.get("/tests/query/instances/{test_instance_id}", response_model=ValidationTestInstance)
-def get_test_instance_from_instance_id(
+async def get_test_instance_from_instance_id(
     test_instance_id: UUID, token: HTTPAuthorizationCredentials = Depends(auth)
 ):
-    test_instance_kg = _get_test_instance_by_id(test_instance_id, token)
+    test_instance_kg = await _get_test_instance_by_id(test_instance_id, token)
     return ValidationTestInstance.from_kg_object(test_instance_kg, kg_client)
 
 
@@ -255,16 +417,18 @@ def get_test_instance_from_instance_id(
     response_model=ValidationTestInstance,
     status_code=status.HTTP_201_CREATED,
 )
-def create_test_instance(
+async def create_test_instance(
     test_id: str,
     test_instance: ValidationTestInstance,
     token: HTTPAuthorizationCredentials = Depends(auth),
 ):
-    test_definition = _get_test_by_id_or_alias(test_id, token)
+    test_definition = await _get_test_by_id_or_alias(test_id, token)
     kg_object = test_instance.to_kg_objects(test_definition)[0]
-    _check_test_script_uniqueness(test_definition, kg_object, kg_client)
-    kg_object.save(kg_client)
-    return ValidationTestInstance.from_kg_object(kg_object, kg_client)
+    await kg_call(_check_test_script_uniqueness, test_definition, kg_object, kg_client)
+    await kg_call(save_object, kg_object, kg_client)
+    test_instance = ValidationTestInstance.from_kg_object(kg_object, kg_client)
+    await catalog.store_test_instance(test_instance)
+    return test_instance
 
 
 @router.put(
@@ -272,14 +436,16 @@ def create_test_instance(
     response_model=ValidationTestInstance,
     status_code=status.HTTP_200_OK,
 )
-def update_test_instance_by_id(
+async def update_test_instance_by_id(
     test_instance_id: str,
     test_instance_patch: ValidationTestInstancePatch,
     token: HTTPAuthorizationCredentials = Depends(auth),
 ):
-    validation_script = _get_test_instance_by_id(test_instance_id, token)
-    test_definition_kg = validation_script.test_definition.resolve(kg_client, api="nexus")
-    return _update_test_instance(validation_script, test_definition_kg, test_instance_patch, token)
+    validation_script = await _get_test_instance_by_id(test_instance_id, token)
+    test_definition_kg = await kg_call(
+        resolve, validation_script.test_definition, kg_client
+    )
+    return await _update_test_instance(validation_script, test_definition_kg, test_instance_patch, token)
 
 
 @router.put(
@@ -287,15 +453,15 @@ def update_test_instance_by_id(
     response_model=ValidationTestInstance,
     status_code=status.HTTP_200_OK,
 )
-def update_test_instance(
+async def update_test_instance(
     test_id: str,
     test_instance_id: str,
     test_instance_patch: ValidationTestInstancePatch,
     token: HTTPAuthorizationCredentials = Depends(auth),
 ):
-    validation_script = _get_test_instance_by_id(test_instance_id, token)
-    test_definition_kg = _get_test_by_id_or_alias(test_id, token)
-    return _update_test_instance(validation_script, test_definition_kg, test_instance_patch, token)
+    validation_script = await _get_test_instance_by_id(test_instance_id, token)
+    test_definition_kg = await _get_test_by_id_or_alias(test_id, token)
+    return await _update_test_instance(validation_script, test_definition_kg, test_instance_patch, token)
 
 
 def _check_test_script_uniqueness(test_definition, test_script, kg_client):
@@ -312,7 +478,7 @@ def _check_test_script_uniqueness(test_definition, test_script, kg_client):
             )
 
 
-def _update_test_instance(validation_script, test_definition_kg, test_instance_patch, token):
+async def _update_test_instance(validation_script, test_definition_kg, test_instance_patch, token):
     stored_test_instance = ValidationTestInstance.from_kg_object(validation_script, kg_client)
     update_data = test_instance_patch.dict(exclude_unset=True)
     updated_test_instance = stored_test_instance.copy(update=update_data)
@@ -320,10 +486,12 @@ def _update_test_instance(validation_script, test_definition_kg, test_instance_p
     test_instance_kg = kg_objects[-1]
     assert isinstance(test_instance_kg, ValidationScript)
     assert test_instance_kg.id == validation_script.id
-    _check_test_script_uniqueness(test_definition_kg, test_instance_kg, kg_client)
+    await kg_call(_check_test_script_uniqueness, test_definition_kg, test_instance_kg, kg_client)
     for obj in kg_objects:
-        obj.save(kg_client)
-    return ValidationTestInstance.from_kg_object(test_instance_kg, kg_client)
+        await kg_call(save_object, obj, kg_client)
+    test_instance = ValidationTestInstance.from_kg_object(test_instance_kg, kg_client)
+    await catalog.store_test_instance(test_instance)
+    return test_instance
 
 
 @router.delete("/tests/query/instances/{test_instance_id}", status_code=status.HTTP_200_OK)
@@ -331,14 +499,17 @@ async def delete_test_instance_by_id(
     test_instance_id: UUID, token: HTTPAuthorizationCredentials = Depends(auth)
 ):
     # todo: handle non-existent UUID, inconsistent test_id and test_instance_id
-    test_script = ValidationScript.from_uuid(str(test_instance_id), kg_client, api="nexus")
+    test_script = await kg_call(
+        get_by_uuid, ValidationScript, str(test_instance_id), kg_client
+    )
     if not await is_admin(token.credentials):
         # todo: replace this check with a group membership check for Collab v2
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Deleting test instances is restricted to admins",
         )
-    test_script.delete(kg_client)
+    await kg_call(delete_object, test_script, kg_client)
+    await catalog.remove_test_instance(test_instance_id)
 
 
 @router.delete("/tests/{test_id}/instances/{test_instance_id}", status_code=status.HTTP_200_OK)
@@ -346,11 +517,14 @@ async def delete_test_instance(
     test_id: str, test_instance_id: UUID, token: HTTPAuthorizationCredentials = Depends(auth)
 ):
     # todo: handle non-existent UUID, inconsistent test_id and test_instance_id
-    test_script = ValidationScript.from_uuid(str(test_instance_id), kg_client, api="nexus")
+    test_script = await kg_call(
+        get_by_uuid, ValidationScript, str(test_instance_id), kg_client
+    )
     if not await is_admin(token.credentials):
         # todo: replace this check with a group membership check for Collab v2
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Deleting test instances is restricted to admins",
         )
-    test_script.delete(kg_client)
+    await kg_call(delete_object, test_script, kg_client)
+    await catalog.remove_test_instance(test_instance_id)
@@ -0,0 +1,815 @@
+"""
+Scores of validation results held in memory as NumPy arrays, so that statistics over many
+results can be computed without retrieving the results one by one.
+
+The table is loaded from the local copy of the catalog (see `catalog`), and so is only
+available if `CATALOG_REPLICA_PATH` is set. It is reloaded in full every
+`SCORES_FULL_REFRESH_INTERVAL` (which also drops results deleted by other processes), and
+in between, every `SCORES_REFRESH_INTERVAL`, picks up the results added to the replica since
+the previous refresh. Results stored or deleted through this service are applied immediately.
+
+For each pair of model instance and test instance with results (a cell of the score matrix),
+the number of results, their mean, the most recent score and the best score are updated
+as results are added, so that the matrix does not need to be computed for each request.
+Statistics of groups of results are computed over the columns, and cached until the table
+next changes.
+
+The score of each result is also normalized over all the results of the same test, so that
+scores can be compared across submissions. This is done in the background shortly after
+results are added or removed, only for the tests concerned, and the normalized scores are
+kept in the table rather than being written to the KG.
+"""
+
+import asyncio
+import io
+import logging
+import threading
+from time import time
+
+import numpy as np
+from fastapi import HTTPException, Response, status
+
+from . import settings, metrics, catalog
+from .cache import TTLCache
+
+
+logger = logging.getLogger("validation_service_v2")
+
+UNKNOWN = -1  # code for a missing value
+GROUPS = ("model", "model_instance", "test", "test_instance", "score_type", "project")
+NPZ = "application/x-npz"
+ZSCORE = "z-score"  # the best z-score is the one closest to zero, otherwise the highest score
+
+_row_columns = {
+    "model_instance": (np.int32, UNKNOWN),
+    "test_instance": (np.int32, UNKNOWN),
+    "score": (np.float64, np.nan),
+    "timestamp": (np.float64, -np.inf),
+    "passed": (np.int8, UNKNOWN),
+    "project": (np.int32, UNKNOWN),
+    "cell": (np.int32, UNKNOWN),
+    "live": (np.bool_, False),
+    # scores normalized over all the results of the same test
+    "zscore": (np.float64, np.nan),
+    "percentile": (np.float64, np.nan),
+}
+_cell_columns = {
+    "model_instance": (np.int32, UNKNOWN),
+    "test_instance": (np.int32, UNKNOWN),
+    "count": (np.int64, 0),
+    "total": (np.float64, 0.0),
+    "best": (np.float64, np.nan),
+    "latest": (np.float64, np.nan),
+    "latest_timestamp": (np.float64, -np.inf),
+}
+
+
+class _Codes:
+    """Dense integer codes for the distinct values of a column (IDs, score types, ...)"""
+
+    def __init__(self):
+        self.codes = {}
+        self.values = []
+
+    def __len__(self):
+        return len(self.values)
+
+    def code(self, value):
+        if value is None:
+            return UNKNOWN
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+    def lookup(self, values):
+        """Return the codes of those of the values which are known"""
+        return np.array(
+            [self.codes[value] for value in map(str, values) if value in self.codes], dtype=np.int32
+        )
+
+    def decode(self, codes):
+        return [self.values[code] if code != UNKNOWN else None for code in codes.tolist()]
+
+
+class _Columns:
+    """Equal-length NumPy arrays, grown as needed"""
+
+    def __init__(self, spec):
+        self._spec = spec
+        self.size = 0
+        for name, (dtype, fill) in spec.items():
+            setattr(self, name, np.full(0, fill, dtype=dtype))
+
+    def extend(self, count):
+        """Add `count` elements to each column, with the default values, returning the index of the first"""
+        index = self.size
+        self.size += count
+        if self.size > len(getattr(self, next(iter(self._spec)))):
+            capacity = max(1024, 2 * self.size)
+            for name, (dtype, fill) in self._spec.items():
+                grown = np.full(capacity, fill, dtype=dtype)
+                grown[:index] = getattr(self, name)[:index]
+                setattr(self, name, grown)
+        return index
+
+    def append(self):
+        return self.extend(1)
+
+    def __getitem__(self, name):
+        return getattr(self, name)[:self.size]
+
+
+def _lookup(array, codes):
+    """Return `array[codes]`, with UNKNOWN for unknown or out-of-range codes"""
+    found = np.full(len(codes), UNKNOWN, dtype=array.dtype)
+    known = (codes != UNKNOWN) & (codes < len(array))
+    found[known] = array[codes[known]]
+    return found
+
+
+def _at(array, indices, valid):
+    """Return `array[indices]` where `valid`, NaN elsewhere"""
+    values = np.full(len(indices), np.nan)
+    values[valid] = array[indices[valid]]
+    return values
+
+
+def _group_last(groups, keys):
+    """
+    Return the distinct groups, in order, and for each group the index of the element
+    with the largest key (the last one if there are several)
+    """
+    order = np.lexsort((np.arange(len(keys)), keys, groups))
+    sorted_groups = groups[order]
+    last = np.flatnonzero(np.r_[sorted_groups[1:] != sorted_groups[:-1], True])
+    return sorted_groups[last], order[last]
+
+
+class ScoreTable:
+    """Thread-safe columnar table of the scores of validation results"""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._rows = {}  # result ID -> row
+        self.result_ids = []  # row -> result ID, or None for deleted results
+        self.rows = _Columns(_row_columns)
+        self.cells = _Columns(_cell_columns)
+        self._cell_index = {}  # (model instance code, test instance code) -> cell
+        self.model_instances = _Codes()
+        self.models = _Codes()
+        self.test_instances = _Codes()
+        self.tests = _Codes()
+        self.score_types = _Codes()
+        self.projects = _Codes()
+        self.instance_model = np.full(0, UNKNOWN, dtype=np.int32)  # model instance code -> model code
+        self.instance_test = np.full(0, UNKNOWN, dtype=np.int32)  # test instance code -> test code
+        self.test_score_type = np.full(0, UNKNOWN, dtype=np.int32)  # test code -> score type code
+        # result ID -> result values (or None if removed), recorded until the table has been (re)loaded
+        self._changes = {}
+        # test instances with results added or removed since the scores were last normalized
+        self._unnormalized = set()
+        self._normalize_all = False
+        self.loaded_at = None
+        self.version = 0  # incremented by every change, for caching what is computed from the table
+
+    def __len__(self):
+        return len(self._rows)
+
+    # dimensions
+
+    @staticmethod
+    def _set_code(array, index, value):
+        if index >= len(array):
+            grown = np.full(max(1024, 2 * (index + 1)), UNKNOWN, dtype=array.dtype)
+            grown[:len(array)] = array
+            array = grown
+        changed = array[index] != value
+        array[index] = value
+        return array, changed
+
+    def set_dimensions(self, model_instances, test_instances):
+        """
+        Record the model of each model instance, given as a dict of model instance ID -> model ID,
+        and the test and score type of each test instance, given as a dict of
+        test instance ID -> (test ID, score type)
+        """
+        changed = False
+        with self._lock:
+            for instance_id, model_id in model_instances.items():
+                self.instance_model, updated = self._set_code(
+                    self.instance_model, self.model_instances.code(instance_id), self.models.code(model_id)
+                )
+                changed |= updated
+            for instance_id, (test_id, score_type) in test_instances.items():
+                test = self.tests.code(test_id)
+                self.instance_test, updated = self._set_code(
+                    self.instance_test, self.test_instances.code(instance_id), test
+                )
+                changed |= updated
+                if test != UNKNOWN:
+                    self.test_score_type, updated = self._set_code(
+                        self.test_score_type, test, self.score_types.code(score_type)
+                    )
+                    changed |= updated
+            if changed:
+                self.version += 1
+                self._normalize_all = True
+
+    def unknown_instances(self, model_instance_ids, test_instance_ids):
+        """Return those of the model and test instance IDs whose model, or test, is not yet known"""
+        with self._lock:
+            def unknown(ids, codes, array):
+                ids = sorted(set(map(str, ids)))
+                known = _lookup(array, np.array([codes.codes.get(id, UNKNOWN) for id in ids], dtype=np.int32))
+                return [id for id, code in zip(ids, known) if code == UNKNOWN]
+
+            return (
+                unknown(model_instance_ids, self.model_instances, self.instance_model),
+                unknown(test_instance_ids, self.test_instances, self.instance_test),
+            )
+
+    def _instance_models(self, instances):
+        return _lookup(self.instance_model, instances)
+
+    def _instance_tests(self, instances):
+        return _lookup(self.instance_test, instances)
+
+    def _test_score_types(self, tests):
+        return _lookup(self.test_score_type, tests)
+
+    def _instance_score_types(self, instances):
+        return self._test_score_types(self._instance_tests(instances))
+
+    def _goodness(self, scores, score_types):
+        """Values which are larger for better scores"""
+        zscore = self.score_types.codes.get(ZSCORE, UNKNOWN - 1)
+        goodness = np.where(score_types == zscore, -np.abs(scores), scores)
+        return np.where(np.isnan(goodness), -np.inf, goodness)
+
+    # changes
+
+    def _add(self, result_id, values):
+        model_instance_id, test_instance_id, score, timestamp, passed, project_id = values
+        row = self.rows.append()
+        self.result_ids.append(result_id)
+        self._rows[result_id] = row
+        model_instance = self.model_instances.code(model_instance_id)
+        test_instance = self.test_instances.code(test_instance_id)
+        rows = self.rows
+        rows.model_instance[row] = model_instance
+        rows.test_instance[row] = test_instance
+        rows.score[row] = np.nan if score is None else score
+        rows.timestamp[row] = -np.inf if timestamp is None else timestamp
+        rows.passed[row] = UNKNOWN if passed is None else int(passed)
+        rows.project[row] = self.projects.code(None if project_id is None else str(project_id))
+        rows.live[row] = True
+        self._unnormalized.add(test_instance)
+        key = (model_instance, test_instance)
+        cell = self._cell_index.get(key)
+        if cell is None:
+            cell = self._cell_index[key] = self.cells.append()
+            self.cells.model_instance[cell] = model_instance
+            self.cells.test_instance[cell] = test_instance
+        rows.cell[row] = cell
+        # update the statistics of the cell
+        cells = self.cells
+        cells.count[cell] += 1
+        cells.total[cell] += rows.score[row]
+        score_type = self._instance_score_types(np.array([test_instance]))
+        goodness = self._goodness(rows.score[[row]], score_type)[0]
+        if cells.count[cell] == 1 or goodness > self._goodness(cells.best[[cell]], score_type)[0]:
+            cells.best[cell] = rows.score[row]
+        if cells.count[cell] == 1 or rows.timestamp[row] >= cells.latest_timestamp[cell]:
+            cells.latest[cell] = rows.score[row]
+            cells.latest_timestamp[cell] = rows.timestamp[row]
+
+    def _remove(self, result_id):
+        row = self._rows.pop(result_id, None)
+        if row is None:
+            return
+        self.result_ids[row] = None
+        self.rows.live[row] = False
+        self._unnormalized.add(self.rows.test_instance[row])
+        self._recompute_cells(np.array([self.rows.cell[row]]))
+
+    def _values(self, row):
+        rows = self.rows
+        return (
+            self.model_instances.decode(rows.model_instance[[row]])[0],
+            self.test_instances.decode(rows.test_instance[[row]])[0],
+            None if np.isnan(rows.score[row]) else float(rows.score[row]),
+            None if np.isinf(rows.timestamp[row]) else float(rows.timestamp[row]),
+            None if rows.passed[row] == UNKNOWN else bool(rows.passed[row]),
+            self.projects.decode(rows.project[[row]])[0],
+        )
+
+    def _set(self, result_id, values):
+        row = self._rows.get(result_id)
+        if values is not None and row is not None and self._values(row) == values:
+            return False
+        self._remove(result_id)
+        if values is not None:
+            self._add(result_id, values)
+        return True
+
+    def set(self, result_id, values):
+        """
+        Add or replace a result, with values (model instance ID, test instance ID, score,
+        timestamp, passed, project ID), or remove it if `values` is None
+        """
+        result_id = str(result_id)
+        with self._lock:
+            if self._set(result_id, values):
+                self.version += 1
+            if self._changes is not None:
+                self._changes[result_id] = values
+
+    def update(self, rows):
+        """Add or replace results, given as rows from `CatalogReplica.score_rows()`"""
+        with self._lock:
+            changed = sum(self._set(row[0], tuple(row[1:])) for row in rows)
+            if changed:
+                self.version += 1
+        return changed
+
+    def _recompute_cells(self, cells):
+        """Compute the statistics of the given cells from their results"""
+        rows, cell_stats = self.rows, self.cells
+        for name in ("count", "total", "best", "latest", "latest_timestamp"):
+            dtype, fill = _cell_columns[name]
+            getattr(cell_stats, name)[cells] = fill
+        live = np.flatnonzero(rows["live"])
+        live = live[np.isin(rows.cell[live], cells)]
+        if len(live) == 0:
+            return
+        cell = rows.cell[live]
+        scores = rows.score[live]
+        counts = np.bincount(cell, minlength=cell_stats.size)
+        totals = np.bincount(cell, weights=scores, minlength=cell_stats.size)
+        present = np.flatnonzero(counts)
+        cell_stats.count[present] = counts[present]
+        cell_stats.total[present] = totals[present]
+        goodness = self._goodness(scores, self._instance_score_types(rows.test_instance[live]))
+        groups, best = _group_last(cell, goodness)
+        cell_stats.best[groups] = scores[best]
+        groups, latest = _group_last(cell, rows.timestamp[live])
+        cell_stats.latest[groups] = scores[latest]
+        cell_stats.latest_timestamp[groups] = rows.timestamp[live][latest]
+
+    def load(self, rows, dimensions):
+        """
+        Fill an empty table with rows from `CatalogReplica.score_rows()`
+        and dimensions from `CatalogReplica.score_dimensions()`
+        """
+        self.set_dimensions(*dimensions)
+        count = len(rows)
+        if count == 0:
+            return
+        result_ids, model_instance_ids, test_instance_ids, scores, timestamps, passed, project_ids = zip(*rows)
+        self.result_ids = list(result_ids)
+        self._rows = {result_id: row for row, result_id in enumerate(result_ids)}
+        self.rows.extend(count)
+        rows = self.rows
+        rows.model_instance[:count] = [self.model_instances.code(value) for value in model_instance_ids]
+        rows.test_instance[:count] = [self.test_instances.code(value) for value in test_instance_ids]
+        rows.score[:count] = np.array(scores, dtype=np.float64)  # None -> NaN
+        rows.timestamp[:count] = [-np.inf if value is None else value for value in timestamps]
+        rows.passed[:count] = [UNKNOWN if value is None else int(value) for value in passed]
+        rows.project[:count] = [
+            self.projects.code(None if value is None else str(value)) for value in project_ids
+        ]
+        rows.live[:count] = True
+        self._normalize_all = True
+        keys = (
+            rows.model_instance[:count].astype(np.int64) * (len(self.test_instances) + 1)
+            + rows.test_instance[:count]
+        )
+        keys, first, cell = np.unique(keys, return_index=True, return_inverse=True)
+        rows.cell[:count] = cell
+        self.cells.extend(len(keys))
+        self.cells.model_instance[:len(keys)] = rows.model_instance[first]
+        self.cells.test_instance[:len(keys)] = rows.test_instance[first]
+        self._cell_index = dict(zip(
+            zip(self.cells["model_instance"].tolist(), self.cells["test_instance"].tolist()),
+            range(len(keys)),
+        ))
+        self._recompute_cells(np.arange(len(keys)))
+
+    def needs_normalizing(self):
+        return self._normalize_all or bool(self._unnormalized)
+
+    def normalize(self):
+        """
+        Normalize the scores of all the results of those tests which have had results added
+        or removed since the last time, returning the number of results normalized.
+
+        Each score is normalized over the scores of all the results of the same test
+        (all versions), as a z-score (number of standard deviations from the mean)
+        and as a percentile rank (percentage of scores below it, counting half of any equal scores).
+        """
+        with self._lock:
+            rows = np.flatnonzero(self.rows["live"])
+            tests = self._instance_tests(self.rows.test_instance[rows])
+            if not self._normalize_all:
+                changed = self._instance_tests(np.fromiter(self._unnormalized, dtype=np.int32))
+                selected = np.isin(tests, changed)
+                rows, tests = rows[selected], tests[selected]
+            self._unnormalized = set()
+            self._normalize_all = False
+            scores = self.rows.score[rows]
+            self.rows.zscore[rows] = np.nan
+            self.rows.percentile[rows] = np.nan
+            valid = (tests != UNKNOWN) & ~np.isnan(scores)
+            rows, tests, scores = rows[valid], tests[valid], scores[valid]
+            if len(rows) == 0:
+                return 0
+            test_ids, group = np.unique(tests, return_inverse=True)
+            n = np.bincount(group, minlength=len(test_ids))
+            mean = np.bincount(group, weights=scores, minlength=len(test_ids)) / n
+            deviation = scores - mean[group]
+            std = np.sqrt(np.bincount(group, weights=deviation ** 2, minlength=len(test_ids)) / n)[group]
+            # all the scores are equal to the mean if the standard deviation is zero
+            self.rows.zscore[rows] = np.where(std > 0, deviation / np.where(std > 0, std, 1.0), 0.0)
+            # in order of score within each test, with equal scores forming runs
+            order = np.lexsort((scores, group))
+            sorted_groups, sorted_scores = group[order], scores[order]
+            new_run = np.r_[
+                True,
+                (sorted_groups[1:] != sorted_groups[:-1]) | (sorted_scores[1:] != sorted_scores[:-1])
+            ]
+            run = np.cumsum(new_run) - 1
+            run_starts = np.flatnonzero(new_run)
+            run_lengths = np.diff(np.r_[run_starts, len(order)])
+            group_starts = np.cumsum(n) - n
+            below = run_starts[run] - group_starts[sorted_groups]
+            percentile = np.empty(len(order))
+            percentile[order] = 100 * (below + 0.5 * run_lengths[run]) / n[sorted_groups]
+            self.rows.percentile[rows] = percentile
+            return len(rows)
+
+    def normalized_scores(self, result_ids, method):
+        """
+        Return a dict of result ID -> normalized score ("zscore" or "percentile")
+        for those of the results which are known, with None if the score could not be normalized
+        """
+        column = getattr(self.rows, method)
+        normalized = {}
+        with self._lock:
+            for result_id in map(str, result_ids):
+                row = self._rows.get(result_id)
+                if row is not None:
+                    value = column[row]
+                    normalized[result_id] = None if np.isnan(value) else float(value)
+        return normalized
+
+    def start_reload(self):
+        """Start recording changes, which will be applied again after `replace_with()`"""
+        with self._lock:
+            self._changes = {}
+
+    def replace_with(self, other):
+        """
+        Take the contents of another table, loaded in the background,
+        keeping any changes made since `start_reload()`
+        """
+        with self._lock:
+            changes = self._changes or {}
+            version = self.version
+            lock = self._lock
+            self.__dict__.update(other.__dict__)
+            self._lock = lock
+            self._changes = None
+            for result_id, values in changes.items():
+                self._set(result_id, values)
+            self.version = version + 1
+            self.loaded_at = time()
+
+    # queries
+
+    def matrix(self, model_instance_ids=None, model_ids=None,
+               test_instance_ids=None, test_ids=None, score_types=None):
+        """
+        Return the score matrix of model instances (rows) against test instances (columns),
+        restricted to the given instances, models, tests and score types, as a dict of
+        lists of IDs for the rows and columns, and of arrays with the row, the column,
+        and the statistics of each cell with results
+        """
+        with self._lock:
+            cells = np.flatnonzero(self.cells["count"] > 0)
+            model_instances = self.cells.model_instance[cells]
+            test_instances = self.cells.test_instance[cells]
+            models = self._instance_models(model_instances)
+            tests = self._instance_tests(test_instances)
+            keep = np.ones(len(cells), dtype=bool)
+            for values, codes, column in (
+                (model_instance_ids, self.model_instances, model_instances),
+                (model_ids, self.models, models),
+                (test_instance_ids, self.test_instances, test_instances),
+                (test_ids, self.tests, tests),
+                (score_types, self.score_types, self._test_score_types(tests)),
+            ):
+                if values:
+                    keep &= np.isin(column, codes.lookup(values))
+            cells = cells[keep]
+            row_instances, row = np.unique(model_instances[keep], return_inverse=True)
+            column_instances, column = np.unique(test_instances[keep], return_inverse=True)
+            counts = self.cells.count[cells]
+            return {
+                "model_instance_id": self.model_instances.decode(row_instances),
+                "model_id": self.models.decode(self._instance_models(row_instances)),
+                "test_instance_id": self.test_instances.decode(column_instances),
+                "test_id": self.tests.decode(self._instance_tests(column_instances)),
+                "row": row.astype(np.int32),
+                "column": column.astype(np.int32),
+                "count": counts,
+                "mean": self.cells.total[cells] / counts,
+                "latest": self.cells.latest[cells],
+                "latest_timestamp": np.where(
+                    np.isinf(self.cells.latest_timestamp[cells]), np.nan, self.cells.latest_timestamp[cells]
+                ),
+                "best": self.cells.best[cells],
+            }
+
+
+    def statistics(self, group_by, percentiles, model_instance_ids=None, model_ids=None,
+                   test_instance_ids=None, test_ids=None, score_types=None, project_ids=None,
+                   passed=None):
+        """
+        Return statistics of the scores of the results matching the filters, grouped by
+        one of `GROUPS`, as a dict of lists (the group, i.e. the ID of the test, model, ...,
+        the score type or the project) and arrays (the statistics of each group).
+        NaN scores are counted, but are not included in the score statistics.
+        """
+        with self._lock:
+            rows = np.flatnonzero(self.rows["live"])
+            model_instances = self.rows.model_instance[rows]
+            test_instances = self.rows.test_instance[rows]
+            models = self._instance_models(model_instances)
+            tests = self._instance_tests(test_instances)
+            score_type_codes = self._test_score_types(tests)
+            projects = self.rows.project[rows]
+            passed_codes = self.rows.passed[rows]
+            keep = np.ones(len(rows), dtype=bool)
+            for values, codes, column in (
+                (model_instance_ids, self.model_instances, model_instances),
+                (model_ids, self.models, models),
+                (test_instance_ids, self.test_instances, test_instances),
+                (test_ids, self.tests, tests),
+                (score_types, self.score_types, score_type_codes),
+                (project_ids, self.projects, projects),
+            ):
+                if values:
+                    keep &= np.isin(column, codes.lookup(values))
+            if passed:
+                keep &= np.isin(passed_codes, [int(value) for value in passed])
+            groups, codes = {
+                "model_instance": (model_instances, self.model_instances),
+                "model": (models, self.models),
+                "test_instance": (test_instances, self.test_instances),
+                "test": (tests, self.tests),
+                "score_type": (score_type_codes, self.score_types),
+                "project": (projects, self.projects),
+            }[group_by]
+            groups = groups[keep]
+            scores = self.rows.score[rows][keep]
+            passed_codes = passed_codes[keep]
+        group_ids, group = np.unique(groups, return_inverse=True)
+        group_count = len(group_ids)
+        count = np.bincount(group, minlength=group_count)
+        known = passed_codes != UNKNOWN
+        passed_count = np.bincount(group[known], weights=(passed_codes[known] == 1).astype(np.float64), minlength=group_count)
+        known_count = np.bincount(group[known], minlength=group_count)
+        scored = ~np.isnan(scores)
+        group, scores = group[scored], scores[scored]
+        n = np.bincount(group, minlength=group_count)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean = np.bincount(group, weights=scores, minlength=group_count) / n
+            variance = np.bincount(group, weights=(scores - mean[group]) ** 2, minlength=group_count) / n
+            # scores sorted within each group, for the percentiles
+            order = np.lexsort((scores, group))
+            sorted_scores = scores[order]
+            starts = np.cumsum(n) - n
+            statistics = {
+                "group": codes.decode(group_ids),
+                "count": count,
+                "mean": mean,
+                "std": np.sqrt(variance),
+                "min": _at(sorted_scores, starts, n > 0),
+                "max": _at(sorted_scores, starts + n - 1, n > 0),
+            }
+            for q in percentiles:
+                # linear interpolation between the closest ranks, as numpy.percentile()
+                position = starts + q / 100 * (n - 1)
+                lower = np.floor(position).astype(np.int64)
+                upper = np.ceil(position).astype(np.int64)
+                fraction = position - lower
+                statistics[f"p{q:g}"] = (
+                    _at(sorted_scores, lower, n > 0) * (1 - fraction)
+                    + _at(sorted_scores, upper, n > 0) * fraction
+                )
+            statistics["pass_rate"] = passed_count / known_count
+        return statistics
+
+
+def wants_npz(accept):
+    """Whether the client asked for NumPy arrays, given the Accept header"""
+    return bool(accept) and NPZ in accept
+
+
+def jsonable_columns(columns):
+    """Convert a dict of arrays or lists to a dict of lists, with None for NaN"""
+    converted = {}
+    for name, values in columns.items():
+        if isinstance(values, np.ndarray):
+            if values.dtype.kind == "f":
+                values = np.where(np.isnan(values), None, values)
+            values = values.tolist()
+        converted[name] = values
+    return converted
+
+
+def npz_response(columns, headers=None):
+    """
+    Return a dict of arrays or lists as a NumPy archive (to be read with `numpy.load()`),
+    with lists of strings (which may contain None) converted to arrays of strings
+    """
+    arrays = {}
+    for name, values in columns.items():
+        if not isinstance(values, np.ndarray):
+            values = np.array(["" if value is None else value for value in values], dtype=str)
+        arrays[name] = values
+    buffer = io.BytesIO()
+    np.savez(buffer, **arrays)
+    return Response(buffer.getvalue(), media_type=NPZ, headers=headers)
+
+
+score_table = ScoreTable()
+_loading = None  # task (re)loading the table
+_refresh_task = None
+_normalizing = None  # task normalizing the scores of new results
+metrics.register_gauge("scores.results", lambda: len(score_table))
+
+# statistics computed from a given version of the table
+_statistics_cache = TTLCache("score_statistics", maxsize=256, ttl=3600)
+
+
+def cached_statistics(table, group_by, percentiles, **filters):
+    """Return `table.statistics()`, computing them again only once the table has changed"""
+    key = (table.version, group_by, tuple(percentiles)) + tuple(
+        (name, tuple(sorted(map(str, values))) if values else None)
+        for name, values in sorted(filters.items())
+    )
+    statistics = _statistics_cache.get(key)
+    if statistics is None:
+        started_at = time()
+        statistics = table.statistics(group_by, percentiles, **filters)
+        metrics.observe("scores.statistics", time() - started_at)
+        _statistics_cache.set(key, statistics)
+    return statistics
+
+
+async def _load():
+    started_at = time()
+    replica = catalog.get_replica()
+    score_table.start_reload()
+    loop = asyncio.get_event_loop()
+
+    def load():
+        table = ScoreTable()
+        table.load(replica.score_rows(), replica.score_dimensions())
+        table.normalize()
+        return table
+
+    score_table.replace_with(await loop.run_in_executor(None, load))
+    _schedule_normalization()
+    metrics.observe("scores.load", time() - started_at)
+    logger.info(f"Loaded the scores of {len(score_table)} results")
+    return started_at
+
+
+def reload():
+    """Start reloading the table in the background, unless this is already in progress"""
+    global _loading
+    if _loading is None or _loading.done():
+        _loading = asyncio.ensure_future(_load())
+    return _loading
+
+
+async def ready():
+    """Return the score table, loading it first if necessary"""
+    if not settings.CATALOG_REPLICA_PATH:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Score statistics need the local copy of the catalog, which is not enabled",
+        )
+    if catalog.get_replica().age() is None:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Score statistics will be available once the local copy of the catalog has been synchronized",
+        )
+    if score_table.loaded_at is None:
+        try:
+            await asyncio.shield(reload())
+        except Exception as err:
+            logger.error(f"Unable to load the score table: {err}")
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Score statistics are temporarily unavailable",
+            )
+    return score_table
+
+
+async def _refresh_periodically():
+    replica = catalog.get_replica()
+    refreshed_at = None
+    while True:
+        try:
+            if (
+                refreshed_at is None
+                or score_table.loaded_at is None
+                or time() - score_table.loaded_at >= settings.SCORES_FULL_REFRESH_INTERVAL
+            ):
+                refreshed_at = await asyncio.shield(reload())
+            else:
+                started_at = time()
+                # results are stored in the replica in transactions started a little
+                # before they are committed, so we look back a little further
+                since = refreshed_at - settings.CATALOG_SYNC_OVERLAP
+                rows = await catalog.replica_call(replica.score_rows, since)
+                await _add_dimensions([row[1] for row in rows], [row[2] for row in rows])
+                score_table.update(rows)
+                _schedule_normalization()
+                refreshed_at = started_at
+        except asyncio.CancelledError:
+            raise
+        except Exception as err:
+            logger.error(f"Unable to refresh the score table: {err}")
+            metrics.increment("scores.refresh_failures")
+        await asyncio.sleep(settings.SCORES_REFRESH_INTERVAL)
+
+
+async def _normalize_soon():
+    # wait a little, so that the scores of a batch of new results are normalized together
+    await asyncio.sleep(settings.SCORES_NORMALIZATION_DELAY)
+    started_at = time()
+    count = score_table.normalize()
+    metrics.observe("scores.normalize", time() - started_at)
+    logger.debug(f"Normalized the scores of {count} results")
+
+
+def _schedule_normalization():
+    """Normalize the scores of new results in the background, unless this is already scheduled"""
+    global _normalizing
+    if score_table.needs_normalizing() and (_normalizing is None or _normalizing.done()):
+        _normalizing = asyncio.ensure_future(_normalize_soon())
+
+
+def start_score_updates():
+    global _refresh_task
+    _refresh_task = asyncio.ensure_future(_refresh_periodically())
+
+
+async def stop_score_updates():
+    global _refresh_task
+    tasks = [task for task in (_refresh_task, _loading, _normalizing) if task is not None]
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    _refresh_task = None
+
+
+async def _add_dimensions(model_instance_ids, test_instance_ids):
+    """Record the model, or test, of those of the instances for which it is not yet known"""
+    model_instance_ids, test_instance_ids = score_table.unknown_instances(model_instance_ids, test_instance_ids)
+    if model_instance_ids or test_instance_ids:
+        score_table.set_dimensions(*await catalog.replica_call(
+            catalog.get_replica().score_dimensions, model_instance_ids, test_instance_ids
+        ))
+
+
+# updates from this service's own changes
+
+async def add_result(result):
+    """Add or update a result (`ValidationResult`) in the table"""
+    if not settings.CATALOG_REPLICA_PATH:
+        return
+    model_instance_id, test_instance_id = str(result.model_instance_id), str(result.test_instance_id)
+    await _add_dimensions([model_instance_id], [test_instance_id])
+    score_table.set(result.id, (
+        model_instance_id,
+        test_instance_id,
+        result.score,
+        result.timestamp.timestamp() if result.timestamp else None,
+        result.passed,
+        result.project_id,
+    ))
+    _schedule_normalization()
+
+
+def remove_result(result_id):
+    if not settings.CATALOG_REPLICA_PATH:
+        return
+    score_table.set(result_id, None)
+    _schedule_normalization()
@@ -0,0 +1,377 @@
+"""
+Full-text search over the names, aliases, descriptions and authors of models and tests.
+
+The KG only supports exact matches, so an inverted index is kept in memory, built from the
+catalog (from the local replica if it is up to date, otherwise from the KG) on the first
+search, and rebuilt every `SEARCH_INDEX_REFRESH_INTERVAL`. Models and tests created, updated or deleted through
+this service are updated in the index immediately.
+
+Each word of a query must match a word of the document, either exactly, as a prefix,
+or approximately (within a small edit distance). Documents are ranked by the sum,
+over the words of the query, of the weight of the field in which the word was found,
+the rarity of the word in the catalog, and the quality of the match.
+
+Each entry of the index also holds the summary representation of the model or test,
+so that other filters can be applied, and summaries returned, without accessing the KG.
+"""
+
+import asyncio
+import logging
+import re
+import threading
+import unicodedata
+from bisect import bisect_left
+from collections import defaultdict
+from math import log
+from time import time
+
+from fastapi import HTTPException, status
+from fastapi.encoders import jsonable_encoder
+from fairgraph.brainsimulation import ModelProject, ValidationTestDefinition
+
+from . import settings, metrics, catalog
+from .data_models import ScientificModelSummary, ValidationTestSummary
+from .db import kg_client
+from .kg_executor import kg_call
+from .queries import query_kg_objects
+
+
+logger = logging.getLogger("validation_service_v2")
+
+FIELD_WEIGHTS = {"name": 3.0, "alias": 3.0, "author": 2.0, "description": 1.0}
+EXACT, PREFIX, APPROXIMATE = 1.0, 0.7, 0.5  # quality of a match
+MIN_PREFIX_LENGTH = 3
+MAX_PREFIX_TERMS = 50  # for each word of a query
+MIN_APPROXIMATE_LENGTH = 4
+
+# summary fields stored in the index, for filtering and for responses
+MODEL_FIELDS = set(ScientificModelSummary.__fields__)
+TEST_FIELDS = set(ValidationTestSummary.__fields__).difference({"instance_count", "data_location"})
+
+_word = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text):
+    """Split text into lower-case words, without accents"""
+    if not text:
+        return []
+    text = unicodedata.normalize("NFKD", text)
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    return _word.findall(text.lower())
+
+
+def _trigrams(term):
+    padded = f"^{term}$"
+    return set(padded[i:i + 3] for i in range(len(padded) - 2))
+
+
+def _max_distance(term):
+    return 1 if len(term) < 8 else 2
+
+
+def _within_distance(a, b, max_distance):
+    """Whether the Levenshtein distance between a and b is at most `max_distance`"""
+    if abs(len(a) - len(b)) > max_distance:
+        return False
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(min(
+                previous[j] + 1,
+                current[j - 1] + 1,
+                previous[j - 1] + (char_a != char_b),
+            ))
+        if min(current) > max_distance:
+            return False
+        previous = current
+    return previous[-1] <= max_distance
+
+
+class SearchIndex:
+    """Thread-safe inverted index of documents (summary representations of models or tests)"""
+
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.RLock()
+        self._documents = {}  # id -> document
+        self._doc_terms = {}  # id -> {term: weight}
+        self._postings = defaultdict(dict)  # term -> {id: weight}
+        self._trigrams = defaultdict(set)  # trigram -> terms
+        self._sorted_terms = None  # for prefix searches, rebuilt when the vocabulary has changed
+        # id -> document (or None if removed), recorded while the index is being (re)built
+        self._changes = None
+        self.built_at = None
+
+    def __len__(self):
+        return len(self._documents)
+
+    @staticmethod
+    def _terms(document):
+        terms = {}
+
+        def add(words, weight):
+            for word in words:
+                terms[word] = max(terms.get(word, 0.0), weight)
+
+        add(tokenize(document.get("name")), FIELD_WEIGHTS["name"])
+        alias = document.get("alias")
+        if alias:
+            # aliases are often looked up as a whole, e.g. "CA1_pyr_cACpyr"
+            add(tokenize(alias) + ["".join(tokenize(alias))], FIELD_WEIGHTS["alias"])
+        for person in document.get("author") or []:
+            add(tokenize(person.get("family_name")), FIELD_WEIGHTS["author"])
+        add(tokenize(document.get("description")), FIELD_WEIGHTS["description"])
+        return terms
+
+    def _remove(self, doc_id):
+        for term in self._doc_terms.pop(doc_id, {}):
+            postings = self._postings[term]
+            postings.pop(doc_id, None)
+            if not postings:
+                del self._postings[term]
+                for trigram in _trigrams(term):
+                    self._trigrams[trigram].discard(term)
+                self._sorted_terms = None
+        self._documents.pop(doc_id, None)
+
+    def _add(self, doc_id, document):
+        terms = self._terms(document)
+        for term, weight in terms.items():
+            if term not in self._postings:
+                for trigram in _trigrams(term):
+                    self._trigrams[trigram].add(term)
+                self._sorted_terms = None
+            self._postings[term][doc_id] = weight
+        self._doc_terms[doc_id] = terms
+        self._documents[doc_id] = document
+
+    def add(self, document):
+        """Add a document, replacing any document with the same ID"""
+        document = jsonable_encoder(document)
+        with self._lock:
+            self._remove(document["id"])
+            self._add(document["id"], document)
+            if self._changes is not None:
+                self._changes[document["id"]] = document
+
+    def remove(self, doc_id):
+        with self._lock:
+            self._remove(str(doc_id))
+            if self._changes is not None:
+                self._changes[str(doc_id)] = None
+
+    def start_rebuild(self):
+        """Start recording changes, which will be applied again after `replace_all()`"""
+        with self._lock:
+            self._changes = {}
+
+    def abandon_rebuild(self):
+        """Stop recording changes, after a rebuild has failed"""
+        with self._lock:
+            self._changes = None
+
+    def replace_all(self, documents):
+        """
+        Replace the contents of the index, keeping any changes made since `start_rebuild()`,
+        which may not be reflected in `documents`
+        """
+        documents = [jsonable_encoder(document) for document in documents]
+        with self._lock:
+            self._documents.clear()
+            self._doc_terms.clear()
+            self._postings.clear()
+            self._trigrams.clear()
+            self._sorted_terms = None
+            for document in documents:
+                self._add(document["id"], document)
+            for doc_id, document in (self._changes or {}).items():
+                self._remove(doc_id)
+                if document is not None:
+                    self._add(doc_id, document)
+            self._changes = None
+            self.built_at = time()
+
+    def _matching_terms(self, word):
+        """Return a dict of the terms matching a word of a query, with the quality of each match"""
+        matches = {}
+        if len(word) >= MIN_APPROXIMATE_LENGTH:
+            max_distance = _max_distance(word)
+            trigrams = _trigrams(word)
+            # terms within the edit distance share most of their trigrams with the word
+            min_shared = max(1, len(trigrams) - 3 * max_distance)
+            counts = defaultdict(int)
+            for trigram in trigrams:
+                for term in self._trigrams.get(trigram, ()):
+                    counts[term] += 1
+            for term, count in counts.items():
+                if count >= min_shared and _within_distance(word, term, max_distance):
+                    matches[term] = APPROXIMATE
+        if len(word) >= MIN_PREFIX_LENGTH:
+            if self._sorted_terms is None:
+                self._sorted_terms = sorted(self._postings)
+            start = bisect_left(self._sorted_terms, word)
+            for term in self._sorted_terms[start:start + MAX_PREFIX_TERMS]:
+                if not term.startswith(word):
+                    break
+                matches[term] = PREFIX
+        if word in self._postings:
+            matches[word] = EXACT
+        return matches
+
+    def search(self, query, predicate=None):
+        """
+        Return the documents matching every word of the query, and the predicate if one is given,
+        most relevant first.
+        """
+        words = list(dict.fromkeys(tokenize(query)))
+        if not words:
+            return []
+        with self._lock:
+            total_documents = len(self._documents)
+            scores = None
+            for word in words:
+                word_scores = {}
+                for term, quality in self._matching_terms(word).items():
+                    postings = self._postings[term]
+                    idf = log(1 + total_documents / len(postings))
+                    for doc_id, weight in postings.items():
+                        if scores is None or doc_id in scores:
+                            score = quality * weight * idf
+                            if score > word_scores.get(doc_id, 0.0):
+                                word_scores[doc_id] = score
+                if scores is None:
+                    scores = word_scores
+                else:
+                    scores = {doc_id: scores[doc_id] + score for doc_id, score in word_scores.items()}
+                if not scores:
+                    return []
+            documents = [
+                (score, self._documents[doc_id]) for doc_id, score in scores.items()
+                if predicate is None or predicate(self._documents[doc_id])
+            ]
+        documents.sort(key=lambda item: (-item[0], item[1].get("name") or ""))
+        return [document for score, document in documents]
+
+
+def matches_filters(document, filters, people=()):
+    """
+    Whether a document matches all the filters (as for the KG queries),
+    each filter being a value or list of values.
+    `people` names the filters which match the family name of a list of people.
+    """
+    for name, value in filters.items():
+        if value is None:
+            continue
+        values = value if isinstance(value, (list, tuple, set)) else [value]
+        if not values:
+            continue
+        values = set(str(item) if not isinstance(item, bool) else item for item in values)
+        if name in people:
+            family_names = set(person.get("family_name") for person in document.get(name) or [])
+            if not family_names.intersection(values):
+                return False
+        elif document.get(name) not in values:
+            return False
+    return True
+
+
+model_index = SearchIndex("models")
+test_index = SearchIndex("tests")
+_builds = {}  # index name -> task rebuilding the index
+metrics.register_gauge("search.models", lambda: len(model_index))
+metrics.register_gauge("search.tests", lambda: len(test_index))
+
+
+async def _all_summaries(cls, summary_cls, fields):
+    summaries = []
+    batch_size = settings.CATALOG_SYNC_BATCH_SIZE
+    while True:
+        batch = await kg_call(
+            query_kg_objects, cls, None, None, kg_client, size=batch_size, from_index=len(summaries)
+        )
+        converted = await kg_call(summary_cls.from_kg_objects, batch, kg_client, fields)
+        summaries.extend(summary.dict(include=fields) for summary in converted)
+        if len(batch) < batch_size:
+            return summaries
+
+
+async def _build(index):
+    started_at = time()
+    index.start_rebuild()
+    replica = catalog.fresh_replica()
+    try:
+        if index is model_index:
+            if replica is not None:
+                documents, _ = await catalog.replica_call(replica.query_models, {}, -1, 0, MODEL_FIELDS)
+            else:
+                documents = await _all_summaries(ModelProject, ScientificModelSummary, MODEL_FIELDS)
+        else:
+            if replica is not None:
+                documents, _ = await catalog.replica_call(replica.query_tests, {}, -1, 0, TEST_FIELDS)
+            else:
+                documents = await _all_summaries(ValidationTestDefinition, ValidationTestSummary, TEST_FIELDS)
+    except BaseException:
+        index.abandon_rebuild()
+        raise
+    index.replace_all(documents)
+    metrics.observe(f"search.build.{index.name}", time() - started_at)
+    logger.info(f"Built search index of {len(documents)} {index.name}")
+
+
+def rebuild(index):
+    """Start rebuilding an index in the background, unless this is already in progress"""
+    task = _builds.get(index.name)
+    if task is None or task.done():
+        task = _builds[index.name] = asyncio.ensure_future(_build(index))
+    return task
+
+
+async def ready(index):
+    """
+    Return the index, building it first if necessary,
+    and starting a rebuild in the background if it is out of date
+    """
+    if index.built_at is None:
+        try:
+            await asyncio.shield(rebuild(index))
+        except Exception as err:
+            logger.error(f"Unable to build the search index of {index.name}: {err}")
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Search is temporarily unavailable",
+            )
+    elif time() - index.built_at > settings.SEARCH_INDEX_REFRESH_INTERVAL:
+        rebuild(index)
+    return index
+
+
+async def stop_indexing():
+    tasks = list(_builds.values())
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    _builds.clear()
+
+
+# updates from this service's own changes
+
+def index_model(model):
+    """Add or update a model (`ScientificModel`) in the index"""
+    data = model.dict(exclude={"instances"})
+    summary = ScientificModelSummary(**data, instance_count=len(model.instances or []))
+    model_index.add(summary.dict(include=MODEL_FIELDS))
+
+
+def remove_model(model_id):
+    model_index.remove(model_id)
+
+
+def index_test(test):
+    """Add or update a test (`ValidationTest`) in the index"""
+    summary = ValidationTestSummary(**test.dict(exclude={"instances"}))
+    test_index.add(summary.dict(include=TEST_FIELDS))
+
+
+def remove_test(test_id):
+    test_index.remove(test_id)
@@ -17,3 +17,88 @@ EBRAINS_IAM_SECRET = os.environ.get("EBRAINS_IAM_SECRET")
 SESSIONS_SECRET_KEY = os.environ.get("SESSIONS_SECRET_KEY")
 ADMIN_COLLAB_ID = "model-validation"  # "13947"
 BASE_URL = os.environ.get("VALIDATION_SERVICE_BASE_URL")
+USER_CACHE_SIZE = int(os.environ.get("USER_CACHE_SIZE", 1000))
+USER_CACHE_TTL = int(os.environ.get("USER_CACHE_TTL", 300))  # seconds
+JWKS_CACHE_TTL = int(os.environ.get("JWKS_CACHE_TTL", 3600))  # seconds
+JWKS_MIN_REFRESH_INTERVAL = 60  # seconds, limits refetching when an unknown key id is seen
+PERMISSIONS_CACHE_SIZE = int(os.environ.get("PERMISSIONS_CACHE_SIZE", 10000))
+PERMISSIONS_CACHE_TTL = int(os.environ.get("PERMISSIONS_CACHE_TTL", 60))  # seconds
+PERMISSIONS_NEGATIVE_CACHE_TTL = int(os.environ.get("PERMISSIONS_NEGATIVE_CACHE_TTL", 30))  # seconds
+HTTP_TIMEOUT = float(os.environ.get("HTTP_TIMEOUT", 10))  # seconds
+HTTP_CONNECT_TIMEOUT = float(os.environ.get("HTTP_CONNECT_TIMEOUT", 5))  # seconds
+HTTP_MAX_CONNECTIONS = int(os.environ.get("HTTP_MAX_CONNECTIONS", 100))
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.environ.get("HTTP_MAX_KEEPALIVE_CONNECTIONS", 20))
+HTTP_MAX_RETRIES = int(os.environ.get("HTTP_MAX_RETRIES", 2))
+HTTP_RETRY_BACKOFF = float(os.environ.get("HTTP_RETRY_BACKOFF", 0.2))  # seconds, doubled for each retry
+HTTP_RETRY_BACKOFF_MAX = float(os.environ.get("HTTP_RETRY_BACKOFF_MAX", 2))  # seconds
+KG_THREAD_POOL_SIZE = int(os.environ.get("KG_THREAD_POOL_SIZE", 20))
+KG_CALL_TIMEOUT = float(os.environ.get("KG_CALL_TIMEOUT", 120))  # seconds
+KG_RESOLVER_THREADS = int(os.environ.get("KG_RESOLVER_THREADS", 20))
+KG_OBJECT_CACHE_TTL = int(os.environ.get("KG_OBJECT_CACHE_TTL", 600))  # seconds
+# if non-zero, expired objects are served for up to this long while being refreshed in the background
+KG_OBJECT_CACHE_STALE_TTL = int(os.environ.get("KG_OBJECT_CACHE_STALE_TTL", 0))  # seconds
+# maximum number of cached objects for each KG type; types not listed here are not cached
+KG_OBJECT_CACHE_SIZES = {
+    cls_name.strip(): int(size)
+    for cls_name, size in (
+        item.split(":")
+        for item in os.environ.get(
+            "KG_OBJECT_CACHE_SIZES",
+            "Person:2000,Organization:500,ValidationTestDefinition:2000,ValidationScript:5000,"
+            "AnalysisResult:10000,Collection:2000,ModelInstance:5000,MEModel:1000,ModelScript:5000,"
+            "ValidationActivity:10000",
+        ).split(",")
+        if item.strip()
+    )
+}
+# time-to-live for each KG type which differs from KG_OBJECT_CACHE_TTL. Objects which can be
+# edited or deleted are only invalidated in the process that changed them, so for these
+# types the TTL bounds how long other worker processes may serve an out-of-date copy
+KG_OBJECT_CACHE_TTLS = {
+    cls_name.strip(): int(ttl)
+    for cls_name, ttl in (
+        item.split(":")
+        for item in os.environ.get(
+            "KG_OBJECT_CACHE_TTLS",
+            "ValidationTestDefinition:5,ValidationScript:5,ModelInstance:5,MEModel:5,ModelScript:5,"
+            "ValidationActivity:5",
+        ).split(",")
+        if item.strip()
+    )
+}
+RESULTS_CURSOR_WINDOW = float(os.environ.get("RESULTS_CURSOR_WINDOW", 7 * 24 * 3600))  # seconds, initial time window scanned for a page of results
+RESULTS_CURSOR_BATCH_SIZE = int(os.environ.get("RESULTS_CURSOR_BATCH_SIZE", 1000))
+RESULTS_BACKEND = os.environ.get("RESULTS_BACKEND", "nexus")  # or "kg_query", once the stored query below is deployed
+# stored query of the KG Query API used to search for results
+KG_QUERY_RESULTS_PATH = os.environ.get("KG_QUERY_RESULTS_PATH", "/modelvalidation/simulation/validationresult/v0.1.0")
+KG_QUERY_RESULTS_ID = os.environ.get("KG_QUERY_RESULTS_ID", "vf")
+# filters for which the stored KG query used to search for results accepts several values
+KG_QUERY_MULTI_VALUED_FILTERS = set(
+    name.strip() for name in os.environ.get("KG_QUERY_MULTI_VALUED_FILTERS", "").split(",") if name.strip()
+)
+RESULTS_MAX_SUBQUERIES = int(os.environ.get("RESULTS_MAX_SUBQUERIES", 50))  # beyond this, search with Nexus instead
+RESULTS_SUBQUERY_CONCURRENCY = int(os.environ.get("RESULTS_SUBQUERY_CONCURRENCY", 5))
+STREAM_CHUNK_SIZE = int(os.environ.get("STREAM_CHUNK_SIZE", 20))  # objects retrieved and converted at a time, when streaming
+BULK_RESULTS_MAX_ITEMS = int(os.environ.get("BULK_RESULTS_MAX_ITEMS", 1000))
+BULK_RESULTS_CONCURRENCY = int(os.environ.get("BULK_RESULTS_CONCURRENCY", 5))  # results being stored at the same time, per request
+INGESTION_QUEUE_PATH = os.environ.get("INGESTION_QUEUE_PATH", "")  # e.g. "ingestion_queue.sqlite3", leave empty to disable background storage
+INGESTION_WORKERS = int(os.environ.get("INGESTION_WORKERS", 2))  # per service process
+INGESTION_POLL_INTERVAL = float(os.environ.get("INGESTION_POLL_INTERVAL", 1))  # seconds
+INGESTION_LEASE = float(os.environ.get("INGESTION_LEASE", 600))  # seconds, after which a job being stored is assumed abandoned
+INGESTION_MAX_ATTEMPTS = int(os.environ.get("INGESTION_MAX_ATTEMPTS", 8))
+INGESTION_RETRY_BACKOFF = float(os.environ.get("INGESTION_RETRY_BACKOFF", 10))  # seconds, doubled for each retry
+INGESTION_RETRY_BACKOFF_MAX = float(os.environ.get("INGESTION_RETRY_BACKOFF_MAX", 600))  # seconds
+CATALOG_REPLICA_PATH = os.environ.get("CATALOG_REPLICA_PATH", "")  # e.g. "catalog.sqlite3", leave empty to always read from the KG
+CATALOG_REPLICA_MAX_STALENESS = float(os.environ.get("CATALOG_REPLICA_MAX_STALENESS", 300))  # seconds, beyond which reads go to the KG
+CATALOG_SYNC_INTERVAL = float(os.environ.get("CATALOG_SYNC_INTERVAL", 60))  # seconds
+CATALOG_FULL_SYNC_INTERVAL = float(os.environ.get("CATALOG_FULL_SYNC_INTERVAL", 24 * 3600))  # seconds, full syncs also remove deleted objects
+CATALOG_SYNC_OVERLAP = float(os.environ.get("CATALOG_SYNC_OVERLAP", 120))  # seconds, allowing for the time the KG takes to become consistent
+CATALOG_SYNC_BATCH_SIZE = int(os.environ.get("CATALOG_SYNC_BATCH_SIZE", 100))
+CATALOG_SYNC_LEASE = float(os.environ.get("CATALOG_SYNC_LEASE", 600))  # seconds, renewed after each batch
+SEARCH_INDEX_REFRESH_INTERVAL = float(os.environ.get("SEARCH_INDEX_REFRESH_INTERVAL", 3600))  # seconds
+SCORES_REFRESH_INTERVAL = float(os.environ.get("SCORES_REFRESH_INTERVAL", 60))  # seconds
+SCORES_FULL_REFRESH_INTERVAL = float(os.environ.get("SCORES_FULL_REFRESH_INTERVAL", 3600))  # seconds, full refreshes also drop deleted results
+SCORES_NORMALIZATION_DELAY = float(os.environ.get("SCORES_NORMALIZATION_DELAY", 5))  # seconds, after new results arrive
+ALIAS_INDEX_SYNC_INTERVAL = float(os.environ.get("ALIAS_INDEX_SYNC_INTERVAL", 30))  # seconds
+ALIAS_INDEX_REFRESH_INTERVAL = float(os.environ.get("ALIAS_INDEX_REFRESH_INTERVAL", 3600))  # seconds, between full refreshes
+ALIAS_INDEX_MAX_STALENESS = float(os.environ.get("ALIAS_INDEX_MAX_STALENESS", 120))  # seconds, beyond which aliases are looked up in the KG
@@ -0,0 +1,84 @@
+"""
+Streaming of query results as newline-delimited JSON (http://ndjson.org/)
+"""
+
+import asyncio
+import json
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
+
+from . import settings, metrics
+from .kg_resolver import identity_map, IdentityMap
+
+
+NDJSON = "application/x-ndjson"
+
+
+def wants_ndjson(accept):
+    """Whether the client asked for newline-delimited JSON, given the Accept header"""
+    return bool(accept) and NDJSON in accept
+
+
+def fetch_in_chunks(fetch, convert, size, from_index=0):
+    """
+    Retrieve and convert up to `size` objects, in chunks.
+
+    `fetch(from_index, size)` is a coroutine function returning a list of KG objects,
+    and `convert(kg_objects)` is a coroutine function returning the converted objects.
+
+    Returns an async iterator over lists of converted objects. The first chunk starts
+    being prepared immediately, and each following chunk is prepared while the previous
+    one is being consumed. Each chunk has its own identity map, so that the KG objects
+    resolved for a chunk can be freed once it has been sent.
+    """
+    chunk_size = settings.STREAM_CHUNK_SIZE
+
+    async def process(offset):
+        # each chunk is processed in its own task, so this does not affect the other chunks
+        objects = IdentityMap()
+        identity_map.set(objects)
+        limit = min(chunk_size, size - offset)
+        kg_objects = await fetch(from_index + offset, limit)
+        converted = await convert(kg_objects)
+        metrics.increment("kg_resolver.resolves", objects.resolves)
+        metrics.increment("kg_resolver.resolves_saved", objects.resolves_saved)
+        return len(kg_objects) == limit, converted
+
+    first = asyncio.ensure_future(process(0)) if size > 0 else None
+
+    async def chunks():
+        offset = 0
+        pending = first
+        try:
+            while pending:
+                more, objects = await pending
+                offset += chunk_size
+                if more and offset < size:
+                    pending = asyncio.ensure_future(process(offset))
+                else:
+                    pending = None
+                yield objects
+        finally:
+            if pending:
+                pending.cancel()
+
+    return chunks()
+
+
+async def single_chunk(objects):
+    yield objects
+
+
+def ndjson_response(chunks, headers=None):
+    """
+    Return a response which sends each object from an async iterator over lists of objects
+    as a line of JSON, as soon as it is available.
+    """
+
+    async def generate():
+        async for objects in chunks:
+            for obj in objects:
+                yield json.dumps(jsonable_encoder(obj)) + "\n"
+
+    return StreamingResponse(generate(), media_type=NDJSON, headers=headers)
@@ -1,4 +1,5 @@
 import os
+import json
 from datetime import datetime, timezone
 from time import sleep
 from urllib.parse import urlparse
@@ -175,6 +176,85 @@ def test_list_models_filter_by_brain_region_and_authors():
         assert model["brain_region"] == "hippocampus"
 
 
+def test_list_models_filter_by_brain_region_paginated():
+    response1 = client.get(f"/models/?size=6&brain_region=hippocampus", headers=AUTH_HEADER)
+    response2 = client.get(
+        f"/models/?size=3&from_index=3&brain_region=hippocampus", headers=AUTH_HEADER
+    )
+    assert response1.status_code == response2.status_code == 200
+    assert int(response1.headers["X-Total-Count"]) >= 6
+    assert [model["id"] for model in response1.json()[3:]] == [
+        model["id"] for model in response2.json()
+    ]
+
+
+def test_list_models_summary():
+    response = client.get(f"/models/?size=5&brain_region=hippocampus&summary=true", headers=AUTH_HEADER)
+    assert response.status_code == 200
+    models = response.json()
+    assert len(models) == 5
+    for model in models:
+        assert isinstance(model["name"], str)
+        assert model["brain_region"] == "hippocampus"
+        assert isinstance(model["instance_count"], int)
+        assert "instances" not in model
+        assert "description" not in model
+
+
+def test_list_models_selected_fields():
+    response = client.get(f"/models/?size=5&fields=name&fields=alias", headers=AUTH_HEADER)
+    assert response.status_code == 200
+    models = response.json()
+    assert len(models) == 5
+    for model in models:
+        assert set(model.keys()) == {"name", "alias"}
+
+
+def test_list_models_ndjson():
+    response = client.get(
+        f"/models/?size=25&brain_region=hippocampus&fields=name&fields=alias",
+        headers=dict(AUTH_HEADER, Accept="application/x-ndjson")
+    )
+    assert response.status_code == 200
+    assert response.headers["Content-Type"].startswith("application/x-ndjson")
+    models = [json.loads(line) for line in response.text.splitlines()]
+    assert len(models) == min(25, int(response.headers["X-Total-Count"]))
+    for model in models:
+        assert set(model.keys()) == {"name", "alias"}
+
+
+def test_list_models_from_kg():
+    # with max_staleness=0, the local copy of the catalog is never used
+    response = client.get(f"/models/?size=5&max_staleness=0&fields=name", headers=AUTH_HEADER)
+    assert response.status_code == 200
+    assert "X-Catalog-Replica-Age" not in response.headers
+    assert len(response.json()) == 5
+
+
+def test_search_models(caplog):
+    caplog.set_level(logging.INFO)
+    response = client.post("/models/", json=_build_sample_model(), headers=AUTH_HEADER)
+    assert response.status_code == 201
+    posted_model = response.json()
+    # the author's name is misspelled, and the last word is incomplete
+    response = client.get(
+        f"/models/?q=Bombadill TestModel&project_id=model-validation&fields=id&fields=name",
+        headers=AUTH_HEADER,
+    )
+    assert response.status_code == 200
+    models = response.json()
+    assert posted_model["id"] in [model["id"] for model in models]
+    for model in models:
+        assert set(model.keys()) == {"id", "name"}
+    response = client.delete(f"/models/{posted_model['id']}", headers=AUTH_HEADER)
+    assert response.status_code == 200
+
+
+def test_list_models_unknown_field():
+    response = client.get(f"/models/?size=5&fields=name&fields=foo", headers=AUTH_HEADER)
+    assert response.status_code == 400
+
+
 def test_create_and_delete_network_model(caplog):
     caplog.set_level(logging.DEBUG)
 
@@ -308,6 +388,23 @@ def test_create_model_with_existing_alias():
     }
 
 
+def test_reuse_alias_of_new_model():
+    payload = _build_sample_model()
+    response = client.post(f"/models/", json=payload, headers=AUTH_HEADER)
+    assert response.status_code == 201
+    posted_model = response.json()
+    # no need to wait for Nexus to become consistent, the new alias is in the alias index
+    response = client.get(f"/models/{posted_model['alias']}", headers=AUTH_HEADER)
+    assert response.status_code == 200
+    assert response.json()["id"] == posted_model["id"]
+    payload2 = _build_sample_model()
+    payload2["alias"] = posted_model["alias"]
+    response = client.post(f"/models/", json=payload2, headers=AUTH_HEADER)
+    assert response.status_code == status.HTTP_409_CONFLICT
+    response = client.delete(f"/models/{posted_model['id']}", headers=AUTH_HEADER)
+    assert response.status_code == 200
+
+
 @pytest.mark.xfail  # need to test with non-admin user
 def test_create_model_without_collab_membership():
     payload = _build_sample_model()
@@ -1,11 +1,17 @@
 import os
-from uuid import UUID
+import json
+from uuid import UUID, uuid4
 from datetime import datetime
 from urllib.parse import urlparse
+from time import sleep
 import logging
 
+import pytest
 from fastapi import status
+from fastapi.testclient import TestClient
 
+from ..main import app
+from .. import settings, ingestion
 from .fixtures import (
     _build_sample_model,
     _build_sample_validation_test,
@@ -68,6 +74,71 @@ def test_list_results_filter_by_model_id():
         assert validation_result["model_instance_id"] in model_instance_ids
 
 
+def test_list_results_filter_by_model_id_paginated():
+    model_uuid = "528ec0e6-2f21-413c-9abd-d131f7150882"
+    response1 = client.get(f"/results/?size=6&model_id={model_uuid}", headers=AUTH_HEADER)
+    response2 = client.get(f"/results/?size=3&from_index=3&model_id={model_uuid}", headers=AUTH_HEADER)
+    assert response1.status_code == response2.status_code == 200
+    assert int(response1.headers["X-Total-Count"]) >= 6
+    assert response1.headers["X-Total-Count"] == response2.headers["X-Total-Count"]
+    assert response1.json()[3:] == response2.json()
+
+
+def test_list_results_filter_by_model_id_with_cursor():
+    model_uuid = "528ec0e6-2f21-413c-9abd-d131f7150882"
+    response1 = client.get(f"/results/?size=3&model_id={model_uuid}&cursor=", headers=AUTH_HEADER)
+    assert response1.status_code == 200
+    page1 = response1.json()
+    assert len(page1) == 3
+    cursor = response1.headers["X-Next-Cursor"]
+    response2 = client.get(
+        f"/results/?size=3&model_id={model_uuid}&cursor={cursor}", headers=AUTH_HEADER
+    )
+    assert response2.status_code == 200
+    page2 = response2.json()
+    assert len(page2) > 0
+    timestamps = [datetime.fromisoformat(result["timestamp"]) for result in page1 + page2]
+    assert timestamps == sorted(timestamps, reverse=True)
+    assert not set(result["id"] for result in page1).intersection(result["id"] for result in page2)
+
+
+def test_list_results_invalid_cursor():
+    response = client.get(f"/results/?size=3&cursor=foo", headers=AUTH_HEADER)
+    assert response.status_code == 400
+
+
+def test_list_results_ndjson():
+    model_uuid = "528ec0e6-2f21-413c-9abd-d131f7150882"
+    # streaming always uses the Nexus API
+    response1 = client.get(f"/results/?size=25&model_id={model_uuid}&backend=nexus", headers=AUTH_HEADER)
+    response2 = client.get(
+        f"/results/?size=25&model_id={model_uuid}&backend=nexus",
+        headers=dict(AUTH_HEADER, Accept="application/x-ndjson")
+    )
+    assert response1.status_code == response2.status_code == 200
+    assert response2.headers["Content-Type"].startswith("application/x-ndjson")
+    assert response1.headers["X-Total-Count"] == response2.headers["X-Total-Count"]
+    streamed = [json.loads(line) for line in response2.text.splitlines()]
+    # the results are not sorted
+    assert set(result["id"] for result in streamed) == set(result["id"] for result in response1.json())
+    for validation_result in streamed:
+        check_validation_result(validation_result)
+
+
+def test_list_results_backends_agree():
+    model_alias = "bianchi_2012"
+    responses = [
+        client.get(f"/results/?size=5&model_alias={model_alias}&backend={backend}", headers=AUTH_HEADER)
+        for backend in ("nexus", "kg_query")
+    ]
+    for response in responses:
+        assert response.status_code == 200
+    assert responses[0].headers["X-Results-Backend"] == "nexus"
+    assert responses[0].headers["X-Total-Count"] == responses[1].headers["X-Total-Count"]
+    for validation_result in responses[1].json():
+        check_validation_result(validation_result)
+
+
 def test_list_results_filter_by_model_alias():
     model_alias = "bianchi_2012"
     response = client.get(f"/results/?size=5&model_alias={model_alias}", headers=AUTH_HEADER)
@@ -109,6 +180,61 @@ def test_list_results_filter_by_test_id():
         assert validation_result["test_instance_id"] in test_instance_ids
 
 
+def test_score_matrix():
+    test_uuid = "100abccb-6d30-4c1e-a960-bc0489e0d82d"
+    response = client.get(
+        f"/results/matrix?test_id={test_uuid}&statistic=mean&statistic=best", headers=AUTH_HEADER
+    )
+    if response.status_code == status.HTTP_503_SERVICE_UNAVAILABLE:
+        pytest.skip("local copy of the catalog not enabled")
+    assert response.status_code == 200
+    matrix = response.json()
+    assert set(matrix.keys()) == {
+        "model_instance_id", "model_id", "test_instance_id", "test_id", "row", "column", "mean", "best"
+    }
+    assert len(matrix["row"]) > 0
+    assert set(matrix["test_id"]) == {test_uuid}
+    assert len(matrix["row"]) == len(matrix["column"]) == len(matrix["mean"]) == len(matrix["best"])
+    assert max(matrix["row"]) < len(matrix["model_instance_id"])
+    assert max(matrix["column"]) < len(matrix["test_instance_id"])
+
+
+def test_score_statistics():
+    response = client.get(
+        f"/results/stats?group_by=score_type&percentile=10&percentile=50&percentile=90",
+        headers=AUTH_HEADER,
+    )
+    if response.status_code == status.HTTP_503_SERVICE_UNAVAILABLE:
+        pytest.skip("local copy of the catalog not enabled")
+    assert response.status_code == 200
+    statistics = response.json()
+    assert set(statistics.keys()) == {
+        "group", "count", "mean", "std", "min", "max", "p10", "p50", "p90", "pass_rate"
+    }
+    assert set(statistics["group"]).issubset({"Other", "Rsquare", "p-value", "z-score", None})
+    for i in range(len(statistics["group"])):
+        assert statistics["count"][i] > 0
+        if statistics["mean"][i] is not None:
+            assert statistics["min"][i] <= statistics["p10"][i] <= statistics["p50"][i]
+            assert statistics["p50"][i] <= statistics["p90"][i] <= statistics["max"][i]
+
+
+def test_list_results_with_normalized_scores():
+    test_uuid = "100abccb-6d30-4c1e-a960-bc0489e0d82d"
+    response = client.get(
+        f"/results/?size=10&test_id={test_uuid}&normalization=percentile", headers=AUTH_HEADER
+    )
+    if response.status_code == status.HTTP_503_SERVICE_UNAVAILABLE:
+        pytest.skip("local copy of the catalog not enabled")
+    assert response.status_code == 200
+    validation_results = response.json()
+    assert len(validation_results) == 10
+    for result in validation_results:
+        check_validation_result(result)
+        if result["normalized_score"] is not None:
+            assert 0 <= result["normalized_score"] <= 100
+
+
 def test_list_results_filter_by_test_instance_id():
     test_code_uuid = "1d22e1c0-5a74-49b4-b114-41d233d3250a"
     response = client.get(
@@ -214,3 +340,86 @@ def test_create_and_delete_validation_result(caplog):
     response = client.delete(f"/models/{model['id']}", headers=AUTH_HEADER)
     response = client.delete(f"/tests/{validation_test['id']}", headers=AUTH_HEADER)
     response = client.delete(f"/results/{posted_result['id']}", headers=AUTH_HEADER)
+
+
+def test_create_validation_results_in_bulk(caplog):
+    caplog.set_level(logging.INFO)
+    # create model and test
+    response = client.post("/models/", json=_build_sample_model(), headers=AUTH_HEADER)
+    assert response.status_code == 201
+    model = response.json()
+    response = client.post("/tests/", json=_build_sample_validation_test(), headers=AUTH_HEADER)
+    assert response.status_code == 201
+    validation_test = response.json()
+
+    # create results, one of which refers to a non-existent test instance
+    payload = [
+        _build_sample_result(model["instances"][0]["id"], validation_test["instances"][0]["id"]),
+        _build_sample_result(model["instances"][0]["id"], "00000000-0000-0000-0000-000000000000"),
+        _build_sample_result(model["instances"][0]["id"], validation_test["instances"][0]["id"]),
+    ]
+    response = client.post("/results/bulk", json=payload, headers=AUTH_HEADER)
+    assert response.status_code == 200
+    statuses = response.json()
+    assert [item["index"] for item in statuses] == [0, 1, 2]
+    assert [item["status_code"] for item in statuses] == [201, 404, 201]
+    posted_results = [statuses[0]["result"], statuses[2]["result"]]
+    for posted_result in posted_results:
+        check_validation_result(posted_result)
+
+    # retrieve results
+    for posted_result in posted_results:
+        response = client.get(f"/results/{posted_result['id']}", headers=AUTH_HEADER)
+        assert response.status_code == 200
+        assert response.json() == posted_result
+
+    # delete everything
+    response = client.delete(f"/models/{model['id']}", headers=AUTH_HEADER)
+    response = client.delete(f"/tests/{validation_test['id']}", headers=AUTH_HEADER)
+    for posted_result in posted_results:
+        response = client.delete(f"/results/{posted_result['id']}", headers=AUTH_HEADER)
+
+
+def test_create_validation_result_in_background(caplog, monkeypatch, tmp_path):
+    caplog.set_level(logging.INFO)
+    # background storage is disabled by default
+    monkeypatch.setattr(settings, "INGESTION_QUEUE_PATH", str(tmp_path / "ingestion_queue.sqlite3"))
+    monkeypatch.setattr(ingestion, "_queue", None)
+    response = client.post("/models/", json=_build_sample_model(), headers=AUTH_HEADER)
+    assert response.status_code == 201
+    model = response.json()
+    response = client.post("/tests/", json=_build_sample_validation_test(), headers=AUTH_HEADER)
+    assert response.status_code == 201
+    validation_test = response.json()
+
+    payload = _build_sample_result(
+        model["instances"][0]["id"], validation_test["instances"][0]["id"]
+    )
+    headers = dict(AUTH_HEADER, Prefer="respond-async", **{"Idempotency-Key": str(uuid4())})
+    # the background workers only run while the app is started up
+    with TestClient(app) as background_client:
+        response1 = background_client.post("/results/", json=payload, headers=headers)
+        assert response1.status_code == 202
+        # retrying with the same key does not create a second job
+        response2 = background_client.post("/results/", json=payload, headers=headers)
+        assert response2.status_code == 202
+        assert response1.headers["Location"] == response2.headers["Location"]
+        # nor does the same key with a different submission
+        response3 = background_client.post("/results/", json=dict(payload, score=0.5), headers=headers)
+        assert response3.status_code == 409
+
+        for i in range(60):
+            response = background_client.get(response1.headers["Location"], headers=AUTH_HEADER)
+            assert response.status_code == 200
+            job = response.json()
+            if job["status"] in ("done", "failed"):
+                break
+            sleep(1)
+    assert job["status"] == "done"
+    response = client.get(f"/results/{job['object_id']}", headers=AUTH_HEADER)
+    assert response.status_code == 200
+    check_validation_result(response.json())
+
+    response = client.delete(f"/models/{model['id']}", headers=AUTH_HEADER)
+    response = client.delete(f"/tests/{validation_test['id']}", headers=AUTH_HEADER)
+    response = client.delete(f"/results/{job['object_id']}", headers=AUTH_HEADER)
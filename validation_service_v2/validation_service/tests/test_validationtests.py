@@ -104,6 +104,27 @@ def test_list_validation_tests_filter_by_brain_region():
         assert validation_test["brain_region"] == "hippocampus"
 
 
+def test_list_validation_tests_summary():
+    response = client.get(f"/tests/?size=5&brain_region=hippocampus&summary=true", headers=AUTH_HEADER)
+    assert response.status_code == 200
+    validation_tests = response.json()
+    assert len(validation_tests) == 5
+    for validation_test in validation_tests:
+        assert isinstance(validation_test["name"], str)
+        assert validation_test["brain_region"] == "hippocampus"
+        assert "instances" not in validation_test
+
+
+def test_list_validation_tests_selected_fields():
+    response = client.get(f"/tests/?size=5&fields=alias&fields=instance_count", headers=AUTH_HEADER)
+    assert response.status_code == 200
+    validation_tests = response.json()
+    assert len(validation_tests) == 5
+    for validation_test in validation_tests:
+        assert set(validation_test.keys()) == {"alias", "instance_count"}
+        assert isinstance(validation_test["instance_count"], int)
+
+
 def test_list_validation_tests_filter_by_species():
     response = client.get(f"/tests/?size=5&species=Rattus%20norvegicus", headers=AUTH_HEADER)
     assert response.status_code == 200
@@ -143,6 +164,16 @@ def test_list_validation_tests_filter_by_brain_region_and_authors():
         assert validation_test["brain_region"] == "hippocampus"
 
 
+def test_search_validation_tests():
+    response = client.get(f"/tests/?q=hippocampus&size=5", headers=AUTH_HEADER)
+    assert response.status_code == 200
+    validation_tests = response.json()
+    assert 0 < len(validation_tests) <= 5
+    assert int(response.headers["X-Total-Count"]) >= len(validation_tests)
+    for validation_test in validation_tests:
+        assert "instances" in validation_test
+
+
 def test_create_and_delete_validation_test_definition(caplog):
     caplog.set_level(logging.DEBUG)
 